@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+Performance benchmarks for mciutil
+"""
@@ -0,0 +1,93 @@
+"""
+Benchmark for writing extracted records to csv
+
+Parses a set of synthetic records (see benchmarks.synthetic) before the
+timing starts, then writes them in turn to a temporary csv file until the
+requested number of rows (1M by default) is written using add_to_csv, then
+with the previous DictWriter based writer for comparison. Both files must
+be the same.
+
+Run from the project root::
+
+    python -m benchmarks.bench_csv
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import filecmp
+import itertools
+import os
+import tempfile
+import time
+
+from mciutil import get_message_elements
+from mciutil.cli.common import add_to_csv, get_config_filename, load_config
+from benchmarks.synthetic import MIXES, iter_synthetic_records
+
+
+def dict_writer_add_to_csv(data_list, field_list, output_filename):
+    """
+    The add_to_csv implementation that used DictWriter and a list based
+    dictionary filter
+    """
+    with open(output_filename, "w") as output_file:
+        writer = csv.DictWriter(output_file,
+                                fieldnames=field_list,
+                                extrasaction="ignore",
+                                lineterminator="\n")
+        writer.writeheader()
+        for item in data_list:
+            item = dict((key, item[key]) for key in item if key in field_list)
+            writer.writerow(dict(
+                (k, v.decode('latin1') if not isinstance(v, str) else v)
+                for k, v in item.items()
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--number", type=int, default=1000000, help="records to write")
+    parser.add_argument("--messages", type=int, default=10000,
+                        help="synthetic records parsed and written in turn")
+    parser.add_argument("-m", "--mix", choices=sorted(MIXES), default="clearing",
+                        help="field mix of the synthetic records")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    config = load_config(get_config_filename("mideu.yml"))
+    bit_config = config["bit_config"]
+    field_list = config["output_data_elements"]
+    messages = [
+        get_message_elements(record, bit_config, "ascii")
+        for record in iter_synthetic_records(
+            bit_config, args.messages, args.mix, "ascii", args.seed)
+    ]
+    print("{0} messages, {1:.0f} keys per message, {2} output fields".format(
+        len(messages), sum(len(message) for message in messages) / float(len(messages)),
+        len(field_list)))
+
+    output_dir = tempfile.mkdtemp()
+    filenames = []
+    try:
+        for name, function in (("add_to_csv", add_to_csv),
+                               ("DictWriter", dict_writer_add_to_csv)):
+            filename = os.path.join(output_dir, name + ".csv")
+            filenames.append(filename)
+            start = time.time()
+            function(itertools.islice(itertools.cycle(messages), args.number),
+                     field_list, filename)
+            elapsed = time.time() - start
+            print("{0:<12} {1:>8} records {2:>7.2f}s {3:>10.0f} records/sec".format(
+                name, args.number, elapsed, args.number / elapsed))
+        assert filecmp.cmp(filenames[0], filenames[1], shallow=False)
+        print("csv files match ({0} bytes)".format(os.path.getsize(filenames[0])))
+    finally:
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+        os.rmdir(output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Micro-benchmark for message parsing and encoding flips
+
+Times get_message_elements and flip_message_encoding on a wide record
+with DE48, DE55 and DE62 populated and reports records per second.
+
+Run from the project root::
+
+    python -m benchmarks.bench_parse
+
+The script only uses the mciutil functions present in every version, so it
+can time an earlier version too. To compare, run it with a checkout of the
+earlier commit first on the python path::
+
+    git worktree add /tmp/mciutil-base <commit>
+    PYTHONPATH=/tmp/mciutil-base python benchmarks/bench_parse.py
+
+The fields and lazy timings are only run when get_message_elements supports
+them.
+"""
+from __future__ import print_function
+
+import argparse
+import binascii
+import os
+import struct
+import timeit
+
+import yaml
+
+import mciutil
+from mciutil import get_message_elements, flip_message_encoding, b
+from mciutil.mciutil import _convert_text_asc2eb
+
+WIDE_RECORD_FIELDS = {
+    2: "5432123456789012",
+    3: "000000",
+    4: "000000012345",
+    12: "200815171512",
+    14: "2412",
+    22: "M00101M00100",
+    23: "001",
+    24: "200",
+    25: "1401",
+    26: "5411",
+    31: "75432121234567890123456",
+    33: "000012",
+    37: "123456789012",
+    38: "A1B2C3",
+    42: "123456789012345",
+    43: "BIG BOBS SUPERMARKET\\70 FERNDALE ST\\ANNERLEY\\4103      QLDAUS",
+    48: "".join("{0:04d}{1:03d}{2}".format(pds, 20, "X" * 20) for pds in range(2, 60, 3)),
+    49: "036",
+    55: binascii.unhexlify(
+        "9f26083e2424eda369aa479f360204dd820220009f02060000000014509f0306"
+        "0000000000009f2701809f34031f00009f5301b5"),
+    62: "".join("{0:04d}{1:03d}{2}".format(pds, 30, "Y" * 30) for pds in range(100, 140, 4)),
+    63: "MCC1234567890123",
+    71: "00000001",
+}
+
+
+# a handful of fields as used by filtering jobs
+FEW_FIELDS = frozenset(["DE2", "DE4", "PDS0023", "TAG9F26"])
+
+
+def build_record(bit_config, fields, encoding="ascii"):
+    """
+    Build a record from a dictionary of field values
+
+    mciutil.generator.build_message is not used as earlier versions do not
+    have it.
+
+    :param bit_config: dictionary of bit mapping configuration
+    :param fields: dictionary of bit number to field value
+    :param encoding: ascii or ebcdic
+    :return: the record
+    """
+    bitmap = 1 << 127   # secondary bitmap present
+    data = []
+    for bit in sorted(fields):
+        bitmap |= 1 << (128 - bit)
+        value = fields[bit]
+        binary = not isinstance(value, str)
+        value = value if binary else b(value)
+        length_size = {"LLVAR": 2, "LLLVAR": 3}.get(bit_config[bit]["field_type"], 0)
+        if length_size:
+            data.append(_encode(b("{0:0{1}d}".format(len(value), length_size)), encoding))
+        data.append(value if binary else _encode(value, encoding))
+
+    bitmap_bytes = struct.pack(">QQ", bitmap >> 64, bitmap & 0xFFFFFFFFFFFFFFFF)
+    return _encode(b("1240"), encoding) + bitmap_bytes + b("").join(data)
+
+
+def _encode(value, encoding):
+    return _convert_text_asc2eb(value) if encoding == "ebcdic" else value
+
+
+def _get_lazy_fields(message):
+    return message["MTI"], message.get("PDS0023")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--number", type=int, default=20000, help="records per timing run")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="timing runs, best is reported")
+    args = parser.parse_args()
+
+    config_filename = os.path.join(
+        os.path.dirname(mciutil.__file__), "cli", "mideu.yml")
+    with open(config_filename) as config_file:
+        config = yaml.safe_load(config_file)
+    raw_bit_config = bit_config = config["bit_config"]
+    output_fields = frozenset(config["output_data_elements"])
+
+    # compile the config once when this version of mciutil supports it
+    if hasattr(mciutil, "compile_bit_config"):
+        bit_config = mciutil.compile_bit_config(bit_config)
+
+    for encoding in ("ascii", "ebcdic"):
+        record = build_record(raw_bit_config, WIDE_RECORD_FIELDS, encoding)
+        benchmarks = (
+            ("get_message_elements", lambda: get_message_elements(record, bit_config, encoding)),
+            ("flip_message_encoding", lambda: flip_message_encoding(record, bit_config, encoding)),
+        )
+        if "fields" in get_message_elements.__code__.co_varnames:
+            benchmarks += (
+                ("get_message_elements(fields=output)",
+                 lambda: get_message_elements(record, bit_config, encoding, fields=output_fields)),
+                ("get_message_elements(fields=few)",
+                 lambda: get_message_elements(record, bit_config, encoding, fields=FEW_FIELDS)),
+            )
+        if "lazy" in get_message_elements.__code__.co_varnames:
+            benchmarks += (
+                ("get_message_elements(lazy) 2 fields",
+                 lambda: _get_lazy_fields(get_message_elements(record, bit_config, encoding, lazy=True))),
+            )
+        for name, function in benchmarks:
+            best = min(timeit.repeat(function, number=args.number, repeat=args.repeat))
+            print("{0:<36} {1:<6} len={2:<4} {3:>10.0f} records/sec".format(
+                name, encoding, len(record), args.number / best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark for cli startup time
+
+Imports the mideu cli module in a new interpreter using python -X importtime
+and prints the total import time and the slowest imports, then times
+complete mideu --version runs. Needs python 3.7 or later.
+
+Run from the project root::
+
+    python -m benchmarks.bench_startup
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def get_import_times(module_name):
+    """
+    Import a module in a new interpreter and get the import times
+
+    :param module_name: the module to import
+    :return: list of (cumulative microseconds, self microseconds, module name)
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-c", "import " + module_name],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    _, importtime_output = process.communicate()
+
+    import_times = []
+    for line in importtime_output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative_time, name = line[len("import time:"):].split("|")
+        import_times.append((int(cumulative_time), int(self_time), name.rstrip()))
+    return import_times
+
+
+def time_command(command, runs):
+    """
+    Run a command several times and get the elapsed time of each run
+
+    :param command: the command arguments
+    :param runs: the number of runs
+    :return: sorted list of elapsed seconds
+    """
+    elapsed_times = []
+    with open(os.devnull, "w") as null_file:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.check_call(command, stdout=null_file, stderr=null_file)
+            elapsed_times.append(time.time() - start)
+    return sorted(elapsed_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-m", "--module", default="mciutil.cli.mideu", help="module to import")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="mideu --version runs")
+    parser.add_argument("-t", "--top", type=int, default=15, help="slowest imports to show")
+    args = parser.parse_args()
+
+    # first import writes the bytecode cache
+    get_import_times(args.module)
+    import_times = get_import_times(args.module)
+    total_time = [item for item in import_times if item[2].strip() == args.module][-1][0]
+    print("import {0}: {1:.1f}ms".format(args.module, total_time / 1000.0))
+    print("{0:>10} {1:>10}  module".format("cumul ms", "self ms"))
+    for cumulative_time, self_time, name in sorted(import_times, reverse=True)[:args.top]:
+        print("{0:>10.1f} {1:>10.1f}  {2}".format(cumulative_time / 1000.0, self_time / 1000.0, name))
+
+    elapsed_times = time_command([sys.executable, "-m", "mciutil.cli.mideu", "--version"], args.runs)
+    print("mideu --version: min {0:.1f}ms median {1:.1f}ms over {2} runs".format(
+        elapsed_times[0] * 1000, elapsed_times[len(elapsed_times) // 2] * 1000, args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Benchmark suite for record and field processing
+
+Generates synthetic IPM files (see benchmarks.synthetic) for each
+combination of encoding, file format and field mix requested, then runs
+each benchmark against each file in a new python process and reports the
+records per second and the peak memory (RSS) of that process. The peak
+memory includes loading the benchmark input, e.g. the file data for unblock.
+
+Results can be saved as json and compared with an earlier run to check a
+release for regressions.
+
+Run from the project root::
+
+    python -m benchmarks.bench_suite --records 50000 --json results.json
+    python -m benchmarks.bench_suite --compare results.json
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+# benchmark name and the file formats it runs for
+BENCHMARKS = (
+    ("unblock", ("1014",)),
+    ("vbs_unpack", ("vbs",)),
+    ("iter_records", ("1014", "vbs")),
+    ("block", ("1014",)),
+    ("get_message_elements", ("1014",)),
+    ("flip_message_encoding", ("1014",)),
+    ("add_to_csv", ("1014",)),
+    ("mideu_extract", ("1014", "vbs")),
+    ("mideu_convert", ("1014", "vbs")),
+)
+
+
+def get_peak_rss_mb():
+    """
+    Get the peak resident memory of this process
+
+    :return: peak RSS in MB, None when not available on this platform
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak_rss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+
+
+def run_benchmark(name, filename, encoding, file_format):
+    """
+    Run a benchmark in this process
+
+    :param name: the benchmark name
+    :param filename: the synthetic IPM file name
+    :param encoding: ascii or ebcdic
+    :param file_format: 1014 or vbs
+    :return: tuple of record count and elapsed seconds
+    """
+    import mciutil
+    from mciutil.cli.common import add_to_csv, get_config_filename, load_config
+
+    blocked = file_format == "1014"
+    config = load_config(get_config_filename("mideu.yml"))
+    bit_config = config["bit_config"]
+    output_filename = filename + ".bench"
+
+    if name in ("mideu_extract", "mideu_convert"):
+        from mciutil.cli.mideu import _get_cli_parser, _main
+        command = name.split("_")[1]
+        output_option = "--csvoutputfile" if command == "extract" else "--output"
+        cli_args = [command, "-s", encoding, output_option, output_filename, filename]
+        if not blocked:
+            cli_args.insert(1, "--no1014blocking")
+        start = time.time()
+        _main(_get_cli_parser().parse_args(cli_args))
+        elapsed = time.time() - start
+        os.remove(output_filename)
+        with mciutil.open_ipm(filename) as input_file:
+            return sum(1 for _ in mciutil.iter_records(input_file, blocked)), elapsed
+
+    with open(filename, "rb") as input_file:
+        data = input_file.read()
+
+    if name == "unblock":
+        start = time.time()
+        records = mciutil.unblock(data)
+        return len(records), time.time() - start
+    if name == "vbs_unpack":
+        start = time.time()
+        records = mciutil.vbs_unpack(data)
+        return len(records), time.time() - start
+    if name == "iter_records":
+        start = time.time()
+        with open(filename, "rb") as input_file:
+            record_count = sum(1 for _ in mciutil.iter_records(input_file, blocked))
+        return record_count, time.time() - start
+
+    records = mciutil.unblock(data) if blocked else mciutil.vbs_unpack(data)
+    del data
+
+    if name == "block":
+        start = time.time()
+        mciutil.block(records)
+        return len(records), time.time() - start
+    if name == "get_message_elements":
+        start = time.time()
+        for record in records:
+            mciutil.get_message_elements(record, bit_config, encoding)
+        return len(records), time.time() - start
+    if name == "flip_message_encoding":
+        start = time.time()
+        for record in records:
+            mciutil.flip_message_encoding(record, bit_config, encoding)
+        return len(records), time.time() - start
+    if name == "add_to_csv":
+        output_fields = frozenset(config["output_data_elements"])
+        messages = [mciutil.get_message_elements(record, bit_config, encoding, fields=output_fields)
+                    for record in records]
+        start = time.time()
+        add_to_csv(messages, config["output_data_elements"], output_filename)
+        elapsed = time.time() - start
+        os.remove(output_filename)
+        return len(messages), elapsed
+    raise ValueError("Unknown benchmark {0}".format(name))
+
+
+def run_benchmark_process(name, filename, encoding, file_format):
+    """
+    Run a benchmark in a new python process
+
+    :return: dictionary of records, seconds and peak_rss_mb
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_suite", "--run", name,
+         "--encodings", encoding, "--formats", file_format, filename],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    output, error_output = process.communicate()
+    for line in output.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError("{0} failed\n{1}".format(name, error_output))
+
+
+def get_synthetic_filename(data_dir, records, mix, encoding, file_format, seed):
+    return os.path.join(data_dir, "synthetic-{0}-{1}-{2}-{3}-{4}.ipm".format(
+        mix, encoding, file_format, records, seed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--records", type=int, default=50000, help="records per file")
+    parser.add_argument("--encodings", default="ascii,ebcdic", help="comma separated encodings")
+    parser.add_argument("--formats", default="1014,vbs", help="comma separated file formats")
+    parser.add_argument("--mixes", default="plain,full,clearing", help="comma separated field mixes")
+    parser.add_argument("-b", "--benchmarks", help="comma separated benchmarks, default is all")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the synthetic files")
+    parser.add_argument("--data-dir", help="directory to keep the synthetic files in for later runs")
+    parser.add_argument("--json", help="save the results to this json file")
+    parser.add_argument("--compare", help="compare with the results in this json file")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("filename", nargs="?", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        record_count, elapsed = run_benchmark(args.run, args.filename, args.encodings, args.formats)
+        print(RESULT_PREFIX + json.dumps(
+            {"records": record_count, "seconds": elapsed, "peak_rss_mb": get_peak_rss_mb()}))
+        return
+
+    from benchmarks.synthetic import MIXES, load_bit_config, write_synthetic_file
+
+    benchmark_names = args.benchmarks.split(",") if args.benchmarks else [name for name, _ in BENCHMARKS]
+    earlier_results = {}
+    if args.compare:
+        with open(args.compare) as compare_file:
+            for result in json.load(compare_file):
+                earlier_results[tuple(result[key] for key in ("benchmark", "encoding", "format", "mix"))] = result
+
+    data_dir = args.data_dir or tempfile.mkdtemp()
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    bit_config = load_bit_config()
+    results = []
+    print("{0:<22} {1:<7} {2:<5} {3:<6} {4:>12} {5:>10} {6:>8}".format(
+        "benchmark", "encode", "fmt", "mix", "records/sec", "peak MB", "change"))
+    try:
+        for mix in args.mixes.split(","):
+            if mix not in MIXES:
+                parser.error("Unknown mix {0}, use one of {1}".format(mix, ", ".join(sorted(MIXES))))
+            for encoding in args.encodings.split(","):
+                for file_format in args.formats.split(","):
+                    filename = get_synthetic_filename(
+                        data_dir, args.records, mix, encoding, file_format, args.seed)
+                    if not os.path.exists(filename):
+                        write_synthetic_file(filename, bit_config, args.records, mix, encoding,
+                                             file_format == "1014", args.seed)
+                    for name, file_formats in BENCHMARKS:
+                        if name not in benchmark_names or file_format not in file_formats:
+                            continue
+                        result = run_benchmark_process(name, filename, encoding, file_format)
+                        result.update(benchmark=name, encoding=encoding, format=file_format, mix=mix,
+                                      records_per_sec=result["records"] / max(result["seconds"], 1e-9))
+                        results.append(result)
+
+                        earlier_result = earlier_results.get((name, encoding, file_format, mix))
+                        change = ""
+                        if earlier_result:
+                            change = "{0:+.0%}".format(
+                                result["records_per_sec"] / earlier_result["records_per_sec"] - 1)
+                        print("{0:<22} {1:<7} {2:<5} {3:<6} {4:>12.0f} {5:>10} {6:>8}".format(
+                            name, encoding, file_format, mix, result["records_per_sec"],
+                            "-" if result["peak_rss_mb"] is None else "{0:.1f}".format(result["peak_rss_mb"]),
+                            change))
+                        sys.stdout.flush()
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark for EBCDIC/ASCII conversion
+
+Checks that the translate tables give the same result as the cp500 and
+latin-1 codecs for all 256 byte values, then times both approaches on
+typical field lengths.
+
+Run from the project root::
+
+    python -m benchmarks.bench_translate
+"""
+from __future__ import print_function
+
+import argparse
+import codecs
+import timeit
+
+from mciutil.mciutil import (
+    _convert_text_eb2asc, _convert_text_asc2eb, EBCDIC_TO_ASCII, ASCII_TO_EBCDIC,
+)
+
+ALL_BYTES = bytes(bytearray(range(256)))
+
+
+def codecs_eb2asc(value):
+    return codecs.encode(codecs.decode(value, "cp500"), "latin-1")
+
+
+def codecs_asc2eb(value):
+    return codecs.encode(codecs.decode(value, "latin-1"), "cp500")
+
+
+def check_equivalence():
+    """
+    Check translate tables against the codecs for every byte value
+
+    :return: None
+    :raises AssertionError: when a byte value converts differently
+    """
+    for codecs_function, function, table in ((codecs_eb2asc, _convert_text_eb2asc, EBCDIC_TO_ASCII),
+                                             (codecs_asc2eb, _convert_text_asc2eb, ASCII_TO_EBCDIC)):
+        expected = codecs_function(ALL_BYTES)
+        assert function(ALL_BYTES) == expected
+        assert function(memoryview(ALL_BYTES)) == expected
+        assert bytearray(ALL_BYTES).translate(table) == bytearray(expected)
+        for byte_value in range(256):
+            assert function(ALL_BYTES[byte_value:byte_value + 1]) == expected[byte_value:byte_value + 1]
+    print("translate tables match codecs for all 256 byte values")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--number", type=int, default=200000, help="conversions per timing run")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="timing runs, best is reported")
+    args = parser.parse_args()
+
+    check_equivalence()
+
+    for length in (4, 16, 100, 999):
+        value = (ALL_BYTES * 4)[:length]
+        for name, function in (("codecs", codecs_eb2asc), ("translate", _convert_text_eb2asc)):
+            best = min(timeit.repeat(lambda: function(value), number=args.number, repeat=args.repeat))
+            print("eb2asc {0:<10} len={1:<4} {2:>12.0f} conversions/sec".format(
+                name, length, args.number / best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Synthetic IPM file generator for the benchmarks
+
+Builds clearing files with :func:`mciutil.generator.iter_generated_records`,
+a 1644 header and trailer around 1240 first presentment messages. The mix
+sets which of the larger fields are present:
+
+plain
+    a few PDS in DE48 and no DE55
+de55
+    a few PDS in DE48 and ICC data in DE55
+pds
+    around 30 PDS in DE48 and 10 in DE62, no DE55
+full
+    around 30 PDS in DE48 and 10 in DE62 and ICC data in DE55
+clearing
+    the generator defaults, 1240 and 1740 messages with ICC data in most
+    of the 1240 messages
+
+Run from the project root::
+
+    python -m benchmarks.synthetic --records 100000 --mix full <filename>
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+
+from mciutil.generator import iter_generated_records, write_generated_file
+from mciutil.cli.common import get_config_filename, load_config
+
+# iter_generated_records arguments for each mix
+MIXES = {
+    "plain": {"fee_collection_ratio": 0, "icc_ratio": 0, "pds_count": 0},
+    "de55": {"fee_collection_ratio": 0, "icc_ratio": 1, "pds_count": 0},
+    "pds": {"fee_collection_ratio": 0, "icc_ratio": 0, "pds_count": 25,
+            "de62_pds_count": 10},
+    "full": {"fee_collection_ratio": 0, "icc_ratio": 1, "pds_count": 25,
+             "de62_pds_count": 10},
+    "clearing": {},
+}
+
+# fixed file date so the files depend only on the seed
+FILE_DATE = datetime.date(2017, 3, 15)
+
+
+def load_bit_config():
+    """
+    Load the bit config used to build the records, see
+    :func:`mciutil.cli.common.get_config_filename`
+
+    :return: CompiledBitConfig
+    """
+    return load_config(get_config_filename("mideu.yml"))["bit_config"]
+
+
+def iter_synthetic_records(bit_config, record_count, mix="full",
+                           encoding="ascii", seed=0):
+    """
+    Build synthetic records
+
+    :param bit_config: dictionary of bit mapping configuration
+    :param record_count: number of records to build, including the file
+        header and trailer
+    :param mix: one of the MIXES names
+    :param encoding: ascii or ebcdic
+    :param seed: random seed, the same seed gives the same records
+    :return: generator yielding the records
+    """
+    return iter_generated_records(
+        max(record_count - 2, 0), bit_config, encoding, seed, FILE_DATE,
+        **MIXES[mix])
+
+
+def write_synthetic_file(output_filename, bit_config, record_count,
+                         mix="full", encoding="ascii", blocked=True, seed=0):
+    """
+    Write a synthetic IPM file
+
+    :param output_filename: the output IPM file name
+    :param bit_config: dictionary of bit mapping configuration
+    :param record_count: number of records to write, including the file
+        header and trailer
+    :param mix: one of the MIXES names
+    :param encoding: ascii or ebcdic
+    :param blocked: True for 1014 blocked, False for VBS format
+    :param seed: random seed, the same seed gives the same file
+    :return: number of bytes written
+    """
+    with open(output_filename, "wb") as output_file:
+        writer = write_generated_file(
+            output_file, max(record_count - 2, 0), bit_config, encoding,
+            blocked, seed, FILE_DATE, **MIXES[mix])
+    return writer.byte_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("output", help="output IPM file name")
+    parser.add_argument("-n", "--records", type=int, default=100000, help="records to write")
+    parser.add_argument("-m", "--mix", choices=sorted(MIXES), default="full", help="field mix")
+    parser.add_argument("-e", "--encoding", choices=("ascii", "ebcdic"), default="ebcdic")
+    parser.add_argument("--vbs", action="store_true", help="write VBS instead of 1014 blocked")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    byte_count = write_synthetic_file(args.output, load_bit_config(), args.records, args.mix,
+                                      args.encoding, not args.vbs, args.seed)
+    print("{0} records, {1} bytes written to {2}".format(args.records, byte_count, args.output))
+
+
+if __name__ == "__main__":
+    main()
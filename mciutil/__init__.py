@@ -4,9 +4,11 @@ mciutil
 =======
 Shared functions for working with MasterCard files
 """
-from .mciutil import (
-    block, unblock, vbs_pack, vbs_unpack, get_message_elements,
-    flip_message_encoding, b,
+from .mciutil import (  # noqa: F401
+    block, unblock, vbs_pack, vbs_unpack, open_ipm, get_compression,
+    iter_records, iter_mapped_records, iter_record_views, iter_record_chunks,
+    map_file, get_message_elements, flip_message_encoding,
+    compile_bit_config, Message, VbsWriter, BlockedWriter, b,
 )
 
 import warnings
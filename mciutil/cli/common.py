@@ -3,21 +3,61 @@ mciutil.cli.common
 
 provides common functions for cli tools
 """
+from __future__ import print_function
 
+import io
 import os
 import sys
 import logging
+import collections
 import csv
-from pkg_resources import resource_filename
+import glob
+import itertools
+
+from mciutil import (
+    open_ipm, get_compression, iter_records, iter_mapped_records,
+    iter_record_views, compile_bit_config, map_file, __version__,
+)
+from mciutil.mciutil import STDIO_FILENAME
 
 LOGGER = logging.getLogger(__name__)
 # this module gets loaded by all the CLI programs so will emit message
-# for all cli programs.
+# for all cli programs. Written to stderr as stdout may be piped data
 print("""!!! WARINING !!!
 mciutil module has been deprecated
 Please consider using module cardutil instead
 see https://cardutil.readthedocs.io
-""")
+""", file=sys.stderr)
+
+# records given to each worker task
+RECORDS_PER_CHUNK = 5000
+
+# per process state for record workers, set by _init_record_worker
+_WORKER_STATE = {}
+
+# change when the cached config contents change
+CONFIG_CACHE_VERSION = 2
+
+# os.rename does not replace an existing file on windows in python 2
+_replace_file = getattr(os, "replace", os.rename)
+
+# csv module needs bytes in python 2 and text in python 3
+try:
+    _CSV_TEXT_TYPE = unicode
+    _CSV_FILE_MODE = "wb"
+
+    def _get_csv_value(value):
+        if isinstance(value, _CSV_TEXT_TYPE):
+            return value.encode('utf-8')
+        return value
+except NameError:
+    _CSV_TEXT_TYPE = str
+    _CSV_FILE_MODE = "w"
+
+    def _get_csv_value(value):
+        if isinstance(value, _CSV_TEXT_TYPE):
+            return value
+        return value.decode('latin1')
 
 
 def update_cli_progress(current_val, end_val, bar_length=20):
@@ -60,6 +100,38 @@ def add_source_format_arg(parser):
     )
 
 
+def add_workers_arg(parser):
+    """
+    Adds worker process count option to parser
+
+    :param parser: the parser to add the workers option to
+    :return: None
+    """
+    parser.add_argument(
+        "--workers",
+        help="number of processes used to process the records, "
+             "0 for one per cpu",
+        type=int,
+        default=1
+    )
+
+
+def add_jobs_arg(parser):
+    """
+    Adds job process count option to parser
+
+    :param parser: the parser to add the jobs option to
+    :return: None
+    """
+    parser.add_argument(
+        "--jobs",
+        help="number of input files processed at the same time, "
+             "0 for one per cpu",
+        type=int,
+        default=1
+    )
+
+
 def add_logging_arg_group(parser):
     """
     Adds logging options to parser
@@ -98,56 +170,457 @@ def get_config_filename(config_filename):
     elif os.path.isfile(user_home_dir + "/." + config_filename):
         config_filename = user_home_dir + "/." + config_filename
     else:
-        module_dir = resource_filename("mciutil", "cli")
-        config_filename = module_dir + "/" + config_filename
+        config_filename = _get_package_config_filename(config_filename)
     LOGGER.info("Using {0} config file".format(config_filename))
     return config_filename
 
 
+def _get_package_config_filename(config_filename):
+    """
+    Get the full path and filename of a config file installed with the package
+
+    :param config_filename: the config filename
+    :return: the full path and filename of config
+    """
+    return os.path.join(os.path.dirname(__file__), config_filename)
+
+
+def load_config(config_filename):
+    """
+    Load a mideu config file with the bit config compiled
+
+    The loaded config is cached in the user cache directory and used while
+    the config file path, modification time and size and the mciutil version
+    are unchanged. The cache is only read when the cache directory and file
+    belong to the current user and cannot be written by other users.
+
+    :param config_filename: the config filename to load
+    :return: config dictionary, bit_config is a CompiledBitConfig
+    """
+    # only imported when a config is loaded as they add to startup time
+    import pickle
+
+    config_stat = os.stat(config_filename)
+    cache_key = (CONFIG_CACHE_VERSION, __version__,
+                 os.path.abspath(config_filename), config_stat.st_mtime,
+                 config_stat.st_size)
+    cache_filename = get_config_cache_filename(config_filename)
+
+    try:
+        # unpickling a file written by another user can run their code
+        for cache_path in (os.path.dirname(cache_filename), cache_filename):
+            if not _is_private_path(cache_path):
+                raise ValueError(
+                    "{0} is not private to this user".format(cache_path))
+        with open(cache_filename, "rb") as cache_file:
+            cached_key, config = pickle.load(cache_file)
+        if cached_key == cache_key:
+            LOGGER.debug("Using cached config %s", cache_filename)
+            return config
+    except Exception as ex:  # missing, unreadable or from another version
+        LOGGER.debug("Config cache %s not used: %s", cache_filename, ex)
+
+    # yaml is only needed when the cache cannot be used
+    import yaml
+    # libyaml loader is much faster when pyyaml was built with it
+    yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(config_filename, "r") as config_file:
+        config = yaml.load(config_file, Loader=yaml_loader)
+    config["bit_config"] = compile_bit_config(config["bit_config"])
+
+    try:
+        _write_config_cache(cache_filename, (cache_key, config))
+    except (IOError, OSError) as ex:
+        LOGGER.debug("Config cache %s not written: %s", cache_filename, ex)
+    return config
+
+
+def get_config_cache_filename(config_filename):
+    """
+    Get the cache filename for a config file
+
+    The cache directory is $XDG_CACHE_HOME/mciutil, defaulting to
+    ~/.cache/mciutil.
+
+    :param config_filename: the config filename
+    :return: the full path and filename of the config cache
+    """
+    import hashlib
+
+    cache_dir = (os.environ.get("XDG_CACHE_HOME")
+                 or os.path.join(os.path.expanduser("~"), ".cache"))
+    path_hash = hashlib.sha1(
+        os.path.abspath(config_filename).encode("utf-8")).hexdigest()
+    return os.path.join(
+        cache_dir, "mciutil", "config-py{0}{1}-{2}.pickle".format(
+            sys.version_info[0], sys.version_info[1], path_hash))
+
+
+def _is_private_path(path):
+    """
+    Check that a file or directory belongs to the current user and cannot be
+    written by other users
+
+    Always True on platforms without file owners, e.g. windows.
+
+    :param path: the file or directory path
+    :return: True when only the current user can write to path
+    :raises OSError: when path does not exist
+    """
+    path_stat = os.stat(path)
+    if not hasattr(os, "getuid"):
+        return True
+    return path_stat.st_uid == os.getuid() and not path_stat.st_mode & 0o022
+
+
+def _write_config_cache(cache_filename, cache_data):
+    """
+    Write the config cache, replacing any existing cache file in one step
+    """
+    import pickle
+    import tempfile
+
+    cache_dir = os.path.dirname(cache_filename)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, 0o700)
+    file_handle, temp_filename = tempfile.mkstemp(dir=cache_dir)
+    try:
+        with os.fdopen(file_handle, "wb") as temp_file:
+            pickle.dump(cache_data, temp_file, pickle.HIGHEST_PROTOCOL)
+        _replace_file(temp_filename, cache_filename)
+    except Exception:
+        os.remove(temp_filename)
+        raise
+
+
 def add_to_csv(data_list, field_list, output_filename):
     """
     Writes data to CSV file
 
-    :param data_list: list of dictionaries that contain the data to be loaded
+    Rows are written as they are taken from data_list, so a generator can
+    be used to stream records to the file.
+
+    :param data_list: iterable of dictionaries that contain the data to be
+        loaded
     :param field_list: list of fields in the dictionary to be loaded
     :param output_filename: filename for output CSV file
+    :return: number of rows written
+    """
+    with open_csv_file(output_filename) as output_file:
+        write_csv_header(output_file, field_list)
+        row_count = write_csv_rows(output_file, data_list, field_list)
+
+    LOGGER.info("%s records written", row_count)
+    return row_count
+
+
+def open_csv_file(output_filename):
+    """
+    Opens a file for CSV output in the mode the csv module needs
+
+    :param output_filename: filename for output CSV file, - for stdout
+    :return: file object
+    """
+    if output_filename == STDIO_FILENAME:
+        sys.stdout.flush()
+        return io.open(sys.stdout.fileno(), _CSV_FILE_MODE, closefd=False)
+    return open(output_filename, _CSV_FILE_MODE)
+
+
+def write_csv_header(output_file, field_list):
+    """
+    Writes the CSV header row
+
+    :param output_file: file object to write to
+    :param field_list: list of fields to be loaded
     :return: None
     """
+    # python 2.6 does not support writeheader() so skip
+    if sys.version_info[0] == 2 and sys.version_info[1] == 6:
+        return
+    csv.writer(output_file, lineterminator="\n").writerow(field_list)
+
+
+def write_csv_rows(output_file, data_list, field_list):
+    """
+    Writes data to CSV file object without a header row
+
+    :param output_file: file object to write to
+    :param data_list: iterable of dictionaries that contain the data to be
+        loaded
+    :param field_list: list of fields in the dictionary to be loaded
+    :return: number of rows written
+    """
+    writer = csv.writer(output_file, lineterminator="\n")
+    field_list = tuple(field_list)
+    row_count = 0
+
+    for item in data_list:
+        writer.writerow(map(_get_csv_value, get_row_values(item, field_list)))
+        row_count += 1
+
+    return row_count
+
+
+def imap_record_chunks(input_filename, blocked, worker_count, chunk_function,
+                       worker_config):
+    """
+    Processes the records of a file in chunks using a pool of worker processes
+
+    The record lengths are walked once to split the file into chunks of
+    records, or the record index is used when the file has an up to date
+    index. Each worker memory maps the file and calls chunk_function for
+    the chunks it is given. Compressed files cannot be mapped, so their
+    records are read here and sent to the workers.
+
+    Only a few chunks per worker are in progress at a time, so memory use
+    does not depend on the file size.
+
+    :param input_filename: the input IPM file name
+    :param blocked: True if file is 1014 blocked, False if VBS format
+    :param worker_count: number of worker processes, 0 for one per cpu
+    :param chunk_function: module level function called with an iterator of
+        the chunk records and the worker state dictionary
+    :param worker_config: dictionary of values copied to the worker state
+    :return: generator yielding the chunk_function results in record order
+    """
+    # only imported when workers are used as they add to startup time
+    import multiprocessing
+    from mciutil.index import iter_indexed_chunks
+
+    worker_count = worker_count or multiprocessing.cpu_count()
+    LOGGER.info("Processing with %s worker processes", worker_count)
+
+    if (input_filename != STDIO_FILENAME
+            and get_compression(input_filename) is None):
+        mapped_filename = input_filename
+        task_function = _process_record_chunk
+        tasks = iter_indexed_chunks(input_filename, blocked, RECORDS_PER_CHUNK)
+    else:
+        mapped_filename = None
+        task_function = _process_record_batch
+        tasks = _iter_record_batches(input_filename, blocked)
+
+    pool = multiprocessing.Pool(
+        worker_count,
+        _init_record_worker,
+        (mapped_filename, blocked, chunk_function, worker_config)
+    )
     try:
-        instance_type = unicode
-        file_mode = "wb"
-    except NameError:
-        instance_type = str
-        file_mode = "w"
-
-    filtered_data_list = filter_data_list(data_list, field_list)
-
-    with open(output_filename, file_mode) as output_file:
-        writer = csv.DictWriter(output_file,
-                                fieldnames=field_list,
-                                extrasaction="ignore",
-                                lineterminator="\n")
-
-        # python 2.6 does not support writeheader() so skip
-        if sys.version_info[0] == 2 and sys.version_info[1] == 6:
-            pass
+        pending_results = collections.deque()
+        for task in tasks:
+            pending_results.append(pool.apply_async(task_function, (task,)))
+            if len(pending_results) >= worker_count * 2:
+                yield pending_results.popleft().get()
+        while pending_results:
+            yield pending_results.popleft().get()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def expand_input_filenames(input_patterns):
+    """
+    Expands input file names and glob patterns to a list of file names
+
+    Patterns are expanded in sorted order. A pattern that does not match
+    any files is kept, so that the missing file can be reported.
+
+    :param input_patterns: list of file names and glob patterns
+    :return: list of file names without duplicates
+    """
+    input_filenames = []
+    for input_pattern in input_patterns:
+        if glob.has_magic(input_pattern):
+            pattern_filenames = (sorted(glob.glob(input_pattern))
+                                 or [input_pattern])
         else:
-            writer.writeheader()
+            pattern_filenames = [input_pattern]
+        input_filenames.extend(
+            filename for filename in pattern_filenames
+            if filename not in input_filenames)
+    return input_filenames
+
+
+def imap_files(file_function, file_args, job_count):
+    """
+    Processes files using a pool of job processes
+
+    :param file_function: module level function called once for each file
+    :param file_args: list of argument tuples for file_function, one for
+        each file
+    :param job_count: number of job processes, 0 for one per cpu or 1 to
+        process the files in this process
+    :return: generator yielding the file_function results in file_args order
+    """
+    if job_count == 1:
+        for args in file_args:
+            yield file_function(*args)
+        return
+
+    # only imported when jobs are used as it adds to startup time
+    import multiprocessing
+
+    job_count = job_count or multiprocessing.cpu_count()
+    LOGGER.info("Processing files with %s job processes", job_count)
+
+    pool = multiprocessing.Pool(min(job_count, len(file_args)) or 1)
+    try:
+        file_calls = [(file_function, args) for args in file_args]
+        for result in pool.imap(_call_file_function, file_calls):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _call_file_function(file_call):
+    """
+    Job process task, calls the file function for one file
+
+    :param file_call: tuple of file function and its arguments
+    :return: file function result
+    """
+    file_function, args = file_call
+    return file_function(*args)
+
+
+def _iter_record_batches(input_filename, blocked):
+    """
+    Reads the records of a file in lists of RECORDS_PER_CHUNK records
+
+    :param input_filename: the input IPM file name
+    :param blocked: True if file is 1014 blocked, False if VBS format
+    :return: generator yielding lists of records
+    """
+    with open_ipm(input_filename) as input_file:
+        records = iter_records(input_file, blocked)
+        while True:
+            record_batch = list(itertools.islice(records, RECORDS_PER_CHUNK))
+            if not record_batch:
+                break
+            yield record_batch
+
+
+def _init_record_worker(mapped_filename, blocked, chunk_function,
+                        worker_config):
+    """
+    Record worker process setup
+
+    :param mapped_filename: the input IPM file name to memory map, None when
+        records are sent to the worker
+    :param blocked: True if file is 1014 blocked, False if VBS format
+    :param chunk_function: function called for each chunk
+    :param worker_config: dictionary of values copied to the worker state
+    :return: None
+    """
+    _WORKER_STATE.update(worker_config)
+    _WORKER_STATE.update(
+        blocked=blocked,
+        chunk_function=chunk_function,
+    )
+    if mapped_filename is not None:
+        with open(mapped_filename, 'rb') as input_file:
+            _WORKER_STATE["mapped_file"] = map_file(input_file)
+
+
+def _process_record_chunk(chunk):
+    """
+    Record worker task, calls the chunk function for a range of records
+
+    :param chunk: tuple of start offset and record count
+    :return: chunk function result
+    """
+    chunk_start, chunk_record_count = chunk
+    records = iter_record_views(
+        _WORKER_STATE["mapped_file"], _WORKER_STATE["blocked"], chunk_start,
+        chunk_record_count)
+    return _WORKER_STATE["chunk_function"](records, _WORKER_STATE)
+
 
-        for item in filtered_data_list:
-            if file_mode == "w":
-                row = dict(
-                    (k, v.decode('latin1') if not isinstance(v, instance_type) else v)
-                    for k, v in item.items()
-                )
-            else:
-                row = dict(
-                    (k, v.encode('utf-8') if isinstance(v, instance_type) else v)
-                    for k, v in item.items()
-                )
-            writer.writerow(row)
+def _process_record_batch(records):
+    """
+    Record worker task, calls the chunk function for a list of records
+
+    :param records: list of records
+    :return: chunk function result
+    """
+    return _WORKER_STATE["chunk_function"](records, _WORKER_STATE)
 
-    LOGGER.info("%s records written", len(data_list))
+
+def iter_input_records(input_filename, blocked):
+    """
+    Iterates the records of an IPM file
+
+    Uncompressed files are memory mapped. Compressed files and stdin are
+    read as a stream.
+
+    :param input_filename: the input IPM file name, - for stdin
+    :param blocked: True if file is 1014 blocked, False if VBS format
+    :return: generator yielding each record in the file
+    """
+    if (input_filename != STDIO_FILENAME
+            and get_compression(input_filename) is None):
+        with open(input_filename, 'rb') as input_file:
+            for record in iter_mapped_records(input_file, blocked):
+                yield record
+    else:
+        with open_ipm(input_filename) as input_file:
+            for record in iter_records(input_file, blocked):
+                yield record
+
+
+def get_output_filename(input_filename, extension):
+    """
+    Get the default output filename for an input file
+
+    The extension is added before the compression suffix of compressed
+    files, so the output is compressed the same way. Output for stdin is
+    written to stdout.
+
+    :param input_filename: the input file name
+    :param extension: the extension to add, e.g. .out
+    :return: output file name
+    """
+    if input_filename == STDIO_FILENAME:
+        return STDIO_FILENAME
+    base_filename, suffix = os.path.splitext(input_filename)
+    if suffix.lower() in (".gz", ".bz2", ".xz"):
+        return base_filename + extension + suffix
+    return input_filename + extension
+
+
+def is_same_file(input_filename, output_filename):
+    """
+    Check if the output file is the input file
+
+    Records are streamed from the input to the output, so writing to the
+    input file would truncate it before it is read.
+
+    :param input_filename: the input file name
+    :param output_filename: the output file name
+    :return: True when both names are the same existing file
+    """
+    if STDIO_FILENAME in (input_filename, output_filename):
+        return False
+    return (os.path.exists(output_filename)
+            and os.path.samefile(input_filename, output_filename))
+
+
+def get_status_file(output_filename):
+    """
+    Get the file for status messages
+
+    :param output_filename: the output file name of the command
+    :return: stderr when output is written to stdout, otherwise stdout
+    """
+    return sys.stderr if output_filename == STDIO_FILENAME else sys.stdout
 
 
 def filter_data_list(data_list, field_list):
@@ -172,12 +645,21 @@ def filter_dictionary(dictionary, field_list):
     :param field_list: list containing keys to keep
     :return: dictionary with just keys from list. All values decoded
     """
-    return_dictionary = {}
-    for item in dictionary:
-        if item in field_list:
-            return_dictionary[item] = dictionary[item]
+    return dict((field, dictionary[field])
+                for field in field_list if field in dictionary)
 
-    return return_dictionary
+
+def get_row_values(dictionary, field_list):
+    """
+    Takes dictionary and list of elements and returns tuple of the element
+    values in field_list order. Missing elements are returned as empty strings
+
+    :param dictionary: the dictionary to get values from
+    :param field_list: list containing keys to return
+    :return: tuple of values
+    """
+    get_value = dictionary.get
+    return tuple(get_value(field, "") for field in field_list)
 
 
 # The following code works in py2.7 and up.. just not 2.6
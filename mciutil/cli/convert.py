@@ -6,11 +6,19 @@ provides functionality for mideu subcommand convert
 
 from __future__ import print_function
 
+import itertools
 import logging
-import yaml
+import os
 
-from mciutil import flip_message_encoding, unblock, block, vbs_unpack, vbs_pack
-from mciutil.cli.common import get_config_filename
+from mciutil import (
+    flip_message_encoding, open_ipm, iter_records, compile_bit_config,
+    VbsWriter, BlockedWriter,
+)
+from mciutil.mciutil import STDIO_FILENAME
+from mciutil.cli.common import (
+    get_config_filename, load_config, get_output_filename, get_status_file,
+    imap_files, imap_record_chunks, is_same_file,
+)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -19,44 +27,141 @@ def convert_command(args):
     """
     convert command
     :param args: arg object
-    :return:
+    :return: output filename, list of output filenames when several input
+             files are converted
     """
 
-    # Read input file
-    with open(args.input, 'rb') as input_file:
-        input_data = input_file.read()
-    LOGGER.info("%s bytes read from %s", len(input_data), args.input)
-
-    # Unblock input
-    if args.no_1014_blocking:
-        input_data = vbs_unpack(input_data)
-    else:
-        input_data = unblock(input_data)
-
     # get config filename
     config_filename = get_config_filename("mideu.yml")
     LOGGER.info("Config file: %s", config_filename)
 
-    # load the config from yaml file
-    with open(config_filename, 'r') as config_file:
-        config = yaml.load(config_file)
+    config = load_config(config_filename)
 
-    output_records = [
-        flip_message_encoding(
-            record,
-            config["bit_config"],
-            args.sourceformat
-        ) for record in input_data
+    input_filenames = args.input
+    if len(input_filenames) > 1 and args.output:
+        print("The output file name can only be given for a single input file")
+        exit(8)
+
+    settings = {
+        "source_format": args.sourceformat,
+        "blocked": not args.no_1014_blocking,
+        "workers": args.workers,
+        "bit_config": config["bit_config"],
+        "validate": args.validate,
+    }
+    output_filenames = [
+        args.output or get_output_filename(input_filename, ".out")
+        for input_filename in input_filenames
     ]
+    file_names = list(zip(input_filenames, output_filenames))
+    for input_filename, output_filename in file_names:
+        if is_same_file(input_filename, output_filename):
+            print("Output file cannot be the input file - {0}".format(
+                output_filename))
+            exit(8)
+    record_counts = list(imap_files(
+        _convert_file,
+        [(settings, input_filename, output_filename)
+         for input_filename, output_filename in file_names],
+        args.jobs
+    ))
+
+    status_file = get_status_file(output_filenames[0])
+    if len(input_filenames) > 1:
+        for output_filename, record_count in zip(output_filenames,
+                                                 record_counts):
+            print("{0} records written to {1}".format(
+                record_count, output_filename), file=status_file)
+
+    print("\nCompleted processing {0} records".format(sum(record_counts)),
+          file=status_file)
+    if len(input_filenames) == 1:
+        return output_filenames[0]
+    return output_filenames
 
-    if args.no_1014_blocking:
-        output_data = vbs_pack(output_records)
+
+def _convert_file(settings, input_filename, output_filename):
+    """
+    Convert the records of an input file to an output file
+
+    :param settings: dictionary of convert settings
+    :param input_filename: the input IPM file name
+    :param output_filename: the output IPM file name
+    :return: number of records written
+    """
+    if settings["workers"] == 1:
+        output_records = _convert_records(settings, input_filename)
     else:
-        output_data = block(output_records)
+        output_records = _convert_records_parallel(settings, input_filename)
 
-    print("\nCompleted processing {0} records".format(len(input_data)))
+    # stream the converted records to the output file
+    writer_class = BlockedWriter if settings["blocked"] else VbsWriter
+    try:
+        with open_ipm(output_filename, "wb") as output_file:
+            with writer_class(output_file) as writer:
+                writer.write_records(output_records)
+    except Exception:
+        if (output_filename != STDIO_FILENAME
+                and os.path.exists(output_filename)):
+            os.remove(output_filename)
+        raise
+    LOGGER.info("%s records written to %s",
+                writer.record_count, output_filename)
+    return writer.record_count
 
-    # save to file
-    output_filename = args.input + ".out"
-    with open(output_filename, "wb") as output_file:
-        output_file.write(output_data)
+
+def _convert_records(settings, input_filename):
+    """
+    Convert records in this process
+
+    :param settings: dictionary of convert settings
+    :param input_filename: the input IPM file name
+    :return: generator yielding the converted records
+    """
+    bit_config = compile_bit_config(settings["bit_config"])
+
+    # Read and convert each record from the input file
+    with open_ipm(input_filename) as input_file:
+        for record in iter_records(input_file, blocked=settings["blocked"]):
+            yield flip_message_encoding(
+                record,
+                bit_config,
+                settings["source_format"],
+                validate=settings["validate"]
+            )
+    LOGGER.info("Parse plan cache: %s", bit_config.plan_cache_info())
+    LOGGER.info("Binary plan cache: %s", bit_config.binary_plan_cache_info())
+
+
+def _convert_records_parallel(settings, input_filename):
+    """
+    Convert records using a pool of worker processes
+
+    Each worker converts a chunk of records. The chunks are returned in the
+    original record order.
+
+    :param settings: dictionary of convert settings
+    :param input_filename: the input IPM file name
+    :return: generator yielding the converted records
+    """
+    return itertools.chain.from_iterable(imap_record_chunks(
+        input_filename, settings["blocked"], settings["workers"],
+        _convert_chunk, settings))
+
+
+def _convert_chunk(records, worker_state):
+    """
+    Convert worker task, flips the encoding of a chunk of records
+
+    :param records: iterator of the chunk records
+    :param worker_state: dictionary of worker settings
+    :return: list of converted records
+    """
+    return [
+        flip_message_encoding(
+            record,
+            worker_state["bit_config"],
+            worker_state["source_format"],
+            validate=worker_state["validate"]
+        ) for record in records
+    ]
@@ -7,61 +7,284 @@ provides functionality for mideu sub-command extract
 from __future__ import print_function
 
 import logging
-import yaml
+import os
+import shutil
+import tempfile
 
-from mciutil import unblock, vbs_unpack, get_message_elements
+from mciutil import get_message_elements, compile_bit_config
+from mciutil.mciutil import STDIO_FILENAME
 from mciutil.cli.common import (
     get_config_filename,
-    add_to_csv,
+    load_config,
+    get_status_file,
+    imap_files,
+    imap_record_chunks,
+    iter_input_records,
+    open_csv_file,
+    write_csv_header,
+    write_csv_rows,
 )
 
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 LOGGER = logging.getLogger(__name__)
 
+# csv column holding the input file name of each record in merged output
+SOURCE_FILE_FIELD = "SOURCE_FILE"
+
 
 def extract_command(args):
     """
     extract command
     :param args: arg object
-    :return:
+    :return: output filename, list of output filenames when several input
+             files are extracted to their own csv files
     """
 
-    # Read input file
-    with open(args.input, 'rb') as infile:
-        input_file = infile.read()
-    LOGGER.info("%s bytes read from %s", len(input_file), args.input)
-
-    # Unpack input
-    if args.no_1014_blocking:
-        input_file = vbs_unpack(input_file)
-    else:
-        input_file = unblock(input_file)
-
     # get config filename
     config_filename = get_config_filename("mideu.yml")
     LOGGER.info("Config file: %s", config_filename)
 
-    # load the config from yaml file
-    with open(config_filename, 'r') as config_file:
-        config = yaml.load(config_file)
+    config = load_config(config_filename)
 
-    # parse the records
-    output_list = [
-        get_message_elements(
-            record,
-            config["bit_config"],
-            args.sourceformat
-        ) for record in input_file
-    ]
+    input_filenames = args.input
+    if len(input_filenames) > 1 and args.csvoutputfile and not args.merge:
+        print("Use --merge to extract several input files to one csv file")
+        exit(8)
+    if args.merge and not args.csvoutputfile:
+        print("--merge needs the merged csv file name in --csvoutputfile")
+        exit(8)
 
-    print("\nCompleted processing {0} records".format(len(input_file)))
+    settings = {
+        "source_format": args.sourceformat,
+        "blocked": not args.no_1014_blocking,
+        "workers": args.workers,
+        "bit_config": config["bit_config"],
+        "field_list": config["output_data_elements"],
+        "output_fields": frozenset(config["output_data_elements"]),
+        "source_field": None,
+    }
 
-    # write to csv - utf-8 encoded
-    if args.csvoutputfile:
+    if args.merge:
+        settings["source_field"] = SOURCE_FILE_FIELD
         csv_output_filename = args.csvoutputfile
+        record_counts = _extract_merged(
+            settings, input_filenames, csv_output_filename, args.jobs)
     else:
-        csv_output_filename = args.input + ".csv"
-    add_to_csv(
-        output_list,
-        config['output_data_elements'],
-        csv_output_filename
+        # write to csv - utf-8 encoded
+        csv_output_filenames = [
+            args.csvoutputfile or (
+                STDIO_FILENAME if input_filename == STDIO_FILENAME
+                else input_filename + ".csv")
+            for input_filename in input_filenames
+        ]
+        record_counts = list(imap_files(
+            _extract_file,
+            [(settings, input_filename, csv_output_filename, True)
+             for input_filename, csv_output_filename
+             in zip(input_filenames, csv_output_filenames)],
+            args.jobs
+        ))
+        if len(input_filenames) == 1:
+            csv_output_filename = csv_output_filenames[0]
+        else:
+            csv_output_filename = csv_output_filenames
+
+    status_file = get_status_file(csv_output_filename)
+    total_record_count = 0
+    for input_filename, record_count in zip(input_filenames, record_counts):
+        LOGGER.info("%s records read from %s", record_count, input_filename)
+        if len(input_filenames) > 1:
+            print("{0} records read from {1}".format(
+                record_count, input_filename), file=status_file)
+        total_record_count += record_count
+
+    print("\nCompleted processing {0} records".format(total_record_count),
+          file=status_file)
+    return csv_output_filename
+
+
+def _extract_merged(settings, input_filenames, csv_output_filename, job_count):
+    """
+    Extract the records of several input files to one csv file
+
+    :param settings: dictionary of extract settings
+    :param input_filenames: list of input IPM file names
+    :param csv_output_filename: filename for output CSV file
+    :param job_count: number of files extracted at the same time
+    :return: list of the number of records written for each input file
+    """
+    with open_csv_file(csv_output_filename) as output_file:
+        write_csv_header(
+            output_file, [settings["source_field"]] + settings["field_list"])
+
+        if job_count == 1:
+            return [_write_file_rows(settings, input_filename, output_file)
+                    for input_filename in input_filenames]
+
+        # each job writes the rows for a file to a temporary file, these are
+        # copied to the merged file in input file order
+        temp_filenames = []
+        record_counts = []
+        try:
+            for _ in input_filenames:
+                file_handle, temp_filename = tempfile.mkstemp(suffix=".csv")
+                os.close(file_handle)
+                temp_filenames.append(temp_filename)
+            file_record_counts = imap_files(
+                _extract_file,
+                [(settings, input_filename, temp_filename, False)
+                 for input_filename, temp_filename
+                 in zip(input_filenames, temp_filenames)],
+                job_count
+            )
+            for file_index, record_count in enumerate(file_record_counts):
+                temp_filename = temp_filenames[file_index]
+                with open(temp_filename, "r") as temp_file:
+                    shutil.copyfileobj(temp_file, output_file)
+                os.remove(temp_filename)
+                record_counts.append(record_count)
+        finally:
+            for temp_filename in temp_filenames:
+                if os.path.exists(temp_filename):
+                    os.remove(temp_filename)
+    return record_counts
+
+
+def _extract_file(settings, input_filename, csv_output_filename, header):
+    """
+    Extract the records of an input file to a csv file
+
+    :param settings: dictionary of extract settings
+    :param input_filename: the input IPM file name
+    :param csv_output_filename: filename for output CSV file
+    :param header: True to write the csv header row
+    :return: number of records written
+    """
+    with open_csv_file(csv_output_filename) as output_file:
+        if header:
+            write_csv_header(output_file, settings["field_list"])
+        record_count = _write_file_rows(settings, input_filename, output_file)
+    LOGGER.info("%s records written to %s", record_count, csv_output_filename)
+    return record_count
+
+
+def _write_file_rows(settings, input_filename, output_file):
+    """
+    Write the csv rows for the records of an input file
+
+    :param settings: dictionary of extract settings
+    :param input_filename: the input IPM file name
+    :param output_file: csv file object to write to
+    :return: number of records written
+    """
+    if settings["workers"] == 1:
+        return _extract_records(settings, input_filename, output_file)
+    return _extract_records_parallel(settings, input_filename, output_file)
+
+
+def _extract_records(settings, input_filename, output_file):
+    """
+    Extract records to csv in this process
+
+    :param settings: dictionary of extract settings
+    :param input_filename: the input IPM file name
+    :param output_file: csv file object to write to
+    :return: number of records written
+    """
+    bit_config = compile_bit_config(settings["bit_config"])
+
+    # parse the records straight from the input file and stream each one
+    # to the csv file
+    record_count = write_csv_rows(
+        output_file,
+        _iter_messages(
+            iter_input_records(input_filename, settings["blocked"]),
+            bit_config,
+            settings,
+            input_filename
+        ),
+        _get_row_fields(settings)
+    )
+    LOGGER.info("Parse plan cache: %s", bit_config.plan_cache_info())
+    return record_count
+
+
+def _extract_records_parallel(settings, input_filename, output_file):
+    """
+    Extract records to csv using a pool of worker processes
+
+    Each worker parses a chunk of records and returns the formatted csv
+    rows, which are written in the original record order.
+
+    :param settings: dictionary of extract settings
+    :param input_filename: the input IPM file name
+    :param output_file: csv file object to write to
+    :return: number of records written
+    """
+    worker_config = dict(settings, input_filename=input_filename)
+    record_count = 0
+    for chunk_record_count, chunk_rows in imap_record_chunks(
+            input_filename, settings["blocked"], settings["workers"],
+            _extract_chunk, worker_config):
+        output_file.write(chunk_rows)
+        record_count += chunk_record_count
+
+    return record_count
+
+
+def _iter_messages(records, bit_config, settings, input_filename):
+    """
+    Parse records into dictionaries of the output fields
+
+    :param records: iterable of records
+    :param bit_config: compiled bit config
+    :param settings: dictionary of extract settings
+    :param input_filename: the input IPM file name, added to each message
+        when the settings have a source field
+    :return: generator yielding the message dictionaries
+    """
+    source_field = settings["source_field"]
+    for record in records:
+        message = get_message_elements(
+            record,
+            bit_config,
+            settings["source_format"],
+            fields=settings["output_fields"]
+        )
+        if source_field:
+            message[source_field] = input_filename
+        yield message
+
+
+def _get_row_fields(settings):
+    """
+    Get the csv row fields, with the source field first when set
+
+    :param settings: dictionary of extract settings
+    :return: list of fields
+    """
+    if settings["source_field"]:
+        return [settings["source_field"]] + settings["field_list"]
+    return settings["field_list"]
+
+
+def _extract_chunk(records, worker_state):
+    """
+    Extract worker task, parses a chunk of records into csv rows
+
+    :param records: iterator of the chunk records
+    :param worker_state: dictionary of worker settings
+    :return: tuple of record count and csv rows
+    """
+    output_file = StringIO()
+    record_count = write_csv_rows(
+        output_file,
+        _iter_messages(records, worker_state["bit_config"], worker_state,
+                       worker_state["input_filename"]),
+        _get_row_fields(worker_state)
     )
+    return record_count, output_file.getvalue()
@@ -0,0 +1,65 @@
+"""
+mciutil.cli.generate
+
+provides functionality for mideu subcommand generate
+"""
+
+from __future__ import print_function
+
+import datetime
+import logging
+import os
+
+from mciutil import open_ipm
+from mciutil.mciutil import STDIO_FILENAME
+from mciutil.generator import write_generated_file
+from mciutil.cli.common import (
+    get_config_filename, load_config, get_status_file,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def generate_command(args):
+    """
+    generate command
+    :param args: arg object
+    :return: output filename
+    """
+
+    # get config filename
+    config_filename = get_config_filename("mideu.yml")
+    LOGGER.info("Config file: %s", config_filename)
+
+    config = load_config(config_filename)
+
+    file_date = None
+    if args.date:
+        try:
+            file_date = datetime.datetime.strptime(
+                args.date, "%Y-%m-%d").date()
+        except ValueError:
+            print("Invalid file date {0}, use YYYY-MM-DD".format(args.date))
+            exit(8)
+
+    try:
+        with open_ipm(args.output, "wb") as output_file:
+            writer = write_generated_file(
+                output_file,
+                args.records,
+                config["bit_config"],
+                encoding=args.encoding,
+                blocked=not args.no_1014_blocking,
+                seed=args.seed,
+                file_date=file_date,
+                fee_collection_ratio=args.fee_collection_ratio
+            )
+    except Exception:
+        if args.output != STDIO_FILENAME and os.path.exists(args.output):
+            os.remove(args.output)
+        raise
+
+    print("{0} records, {1} bytes written to {2}".format(
+        writer.record_count, writer.byte_count, args.output),
+        file=get_status_file(args.output))
+    return args.output
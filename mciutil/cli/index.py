@@ -0,0 +1,52 @@
+"""
+mciutil.cli.index
+
+provides functionality for mideu subcommand index
+"""
+
+from __future__ import print_function
+
+import logging
+
+from mciutil.mciutil import STDIO_FILENAME
+from mciutil.index import write_index, write_value_index, get_index_filename
+from mciutil.cli.common import get_config_filename, load_config
+
+LOGGER = logging.getLogger(__name__)
+
+
+def index_command(args):
+    """
+    index command
+    :param args: arg object
+    :return: index filename
+    """
+    if args.input == STDIO_FILENAME:
+        print("Cannot index stdin, an input file name is required")
+        exit(8)
+
+    index_filename = args.indexfile or get_index_filename(args.input)
+    try:
+        record_count = write_index(args.input, index_filename,
+                                   blocked=not args.no_1014_blocking)
+    except ValueError as ex:
+        print(ex)
+        exit(8)
+
+    print("\nIndexed {0} records to {1}".format(record_count, index_filename))
+
+    if args.field:
+        # get config filename
+        config_filename = get_config_filename("mideu.yml")
+        LOGGER.info("Config file: %s", config_filename)
+        config = load_config(config_filename)
+
+        try:
+            write_value_index(args.input, config["bit_config"], args.field,
+                              source_format=args.sourceformat,
+                              blocked=not args.no_1014_blocking)
+        except ValueError as ex:
+            print(ex)
+            exit(8)
+        print("Indexed {0} values".format(", ".join(args.field)))
+    return index_filename
@@ -0,0 +1,63 @@
+"""
+mciutil.cli.lookup
+
+provides functionality for mideu subcommand lookup
+"""
+
+from __future__ import print_function
+
+import logging
+import sys
+
+from mciutil import get_message_elements
+from mciutil.index import open_value_index, get_value_index_filename
+from mciutil.mciutil import STDIO_FILENAME
+from mciutil.cli.common import (
+    get_config_filename, load_config, open_csv_file, write_csv_header,
+    write_csv_rows,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def lookup_command(args):
+    """
+    lookup command
+    :param args: arg object
+    :return: output filename
+    """
+    index_filename = get_value_index_filename(args.input, args.field)
+    try:
+        value_index = open_value_index(args.input, args.field, index_filename)
+    except (IOError, OSError):
+        print("No {0} index found - {1}\n"
+              "Create using: mideu index --field {0} {2}".format(
+                  args.field, index_filename, args.input))
+        exit(8)
+    except ValueError as ex:
+        print(ex)
+        exit(8)
+
+    with value_index:
+        found_records = value_index.find(args.value)
+
+    # get config filename
+    config_filename = get_config_filename("mideu.yml")
+    LOGGER.info("Config file: %s", config_filename)
+
+    config = load_config(config_filename)
+
+    field_list = ["RECORD"] + config['output_data_elements']
+    output_fields = frozenset(config['output_data_elements'])
+
+    with open_csv_file(STDIO_FILENAME) as output_file:
+        write_csv_header(output_file, field_list)
+        for record_number, record in found_records:
+            message = get_message_elements(
+                record, config["bit_config"], value_index.source_format,
+                fields=output_fields)
+            message["RECORD"] = str(record_number)
+            write_csv_rows(output_file, [message], field_list)
+
+    print("\nFound {0} records".format(len(found_records)), file=sys.stderr)
+    return STDIO_FILENAME
@@ -8,15 +8,42 @@ from __future__ import print_function
 import os.path
 import logging
 import argparse
+import importlib
 
-from mciutil import _version
-from mciutil.cli.common import add_logging_arg_group, add_source_format_arg
-from mciutil.cli.extract import extract_command
-from mciutil.cli.convert import convert_command
+from mciutil import __version__
+from mciutil.mciutil import STDIO_FILENAME
+from mciutil.cli.common import (
+    add_logging_arg_group, add_source_format_arg, add_workers_arg,
+    add_jobs_arg, get_status_file, expand_input_filenames,
+)
 
 LOGGER = logging.getLogger(__name__)
 
 
+def _get_command(module_name, function_name):
+    """
+    Get a subcommand function that imports its module when first called
+
+    Subcommand modules are only imported for the subcommand being run.
+
+    :param module_name: module providing the subcommand
+    :param function_name: name of the subcommand function in the module
+    :return: subcommand function
+    """
+    def command(args):
+        module = importlib.import_module(module_name)
+        return getattr(module, function_name)(args)
+    command.__name__ = function_name
+    return command
+
+
+extract_command = _get_command("mciutil.cli.extract", "extract_command")
+convert_command = _get_command("mciutil.cli.convert", "convert_command")
+index_command = _get_command("mciutil.cli.index", "index_command")
+lookup_command = _get_command("mciutil.cli.lookup", "lookup_command")
+generate_command = _get_command("mciutil.cli.generate", "generate_command")
+
+
 def cli_entry():
     """
     mideu main cli entry
@@ -35,7 +62,7 @@ def _main(args):
     :return: exit code
     """
     if not hasattr(args, "loglevel"):
-        print(__name__ + " ("+_version.get_versions()['version']+")")
+        print(__name__ + " ("+__version__+")")
         print("try --help for information")
         return
 
@@ -44,15 +71,33 @@ def _main(args):
         format="%(asctime)s:%(name)s:%(lineno)s:%(levelname)s:%(message)s"
     )
 
+    # extract and convert take several input files and glob patterns
+    if isinstance(getattr(args, "input", None), list):
+        args.input = expand_input_filenames(args.input)
+        input_filenames = args.input
+        if len(input_filenames) > 1 and STDIO_FILENAME in input_filenames:
+            print("stdin cannot be used with other input files")
+            exit(8)
+        if len(input_filenames) > 1 and args.jobs != 1 and args.workers != 1:
+            print("Use either --jobs or --workers when processing several "
+                  "input files")
+            exit(8)
+    elif hasattr(args, "input"):
+        input_filenames = [args.input]
+    else:
+        input_filenames = []
+
     # exit if input file does not exist
-    if not os.path.isfile(args.input):
-        print("Input file not found - {0}".format(args.input))
-        exit(8)
+    for input_filename in input_filenames:
+        if (input_filename != STDIO_FILENAME and
+                not os.path.isfile(input_filename)):
+            print("Input file not found - {0}".format(input_filename))
+            exit(8)
 
     # do command level processing
-    args.func(args)
+    output_filename = args.func(args)
 
-    print("Done!")
+    print("Done!", file=get_status_file(output_filename))
 
 
 def _get_cli_parser():
@@ -63,10 +108,10 @@ def _get_cli_parser():
     """
     parser = argparse.ArgumentParser(
         description="MasterCard IPM file formatter ({version})".format(
-            version=_version.get_versions()['version'])
+            version=__version__)
     )
     parser.add_argument("--version", action="version",
-                        version="%(prog)s ("+_version.get_versions()['version']+")",
+                        version="%(prog)s ("+__version__+")",
                         help="Get version information")
 
     subparsers = parser.add_subparsers(help="Sub-command help")
@@ -81,6 +126,28 @@ def _get_cli_parser():
     convert_parser = subparsers.add_parser("convert", help="Convert help")
     convert_parser.set_defaults(func=convert_command)
     _add_common_args(convert_parser)
+    _add_convert_args(convert_parser)
+
+    # Index command
+    index_parser = subparsers.add_parser("index", help="Index help")
+    index_parser.set_defaults(func=index_command)
+    index_parser.add_argument("input", help="Input IPM file name")
+    add_source_format_arg(index_parser)
+    add_logging_arg_group(index_parser)
+    _add_index_args(index_parser)
+
+    # Lookup command
+    lookup_parser = subparsers.add_parser("lookup", help="Lookup help")
+    lookup_parser.set_defaults(func=lookup_command)
+    # the encoding and blocking of the file are read from the value index
+    _add_lookup_args(lookup_parser)
+    add_logging_arg_group(lookup_parser)
+
+    # Generate command
+    generate_parser = subparsers.add_parser("generate", help="Generate help")
+    generate_parser.set_defaults(func=generate_command)
+    _add_generate_args(generate_parser)
+    add_logging_arg_group(generate_parser)
 
     return parser
 
@@ -92,8 +159,14 @@ def _add_common_args(parser):
     :param parser: the argparse parser
     :return: None
     """
-    parser.add_argument("input", help="Input IPM file name")
+    parser.add_argument(
+        "input",
+        help="Input IPM file names or glob patterns, - for stdin",
+        nargs="+"
+    )
     add_source_format_arg(parser)
+    add_workers_arg(parser)
+    add_jobs_arg(parser)
     add_logging_arg_group(parser)
 
 
@@ -105,7 +178,112 @@ def _add_extract_args(parser):
     :return: None
     """
     csv_arg_group = parser.add_argument_group("csv output options")
-    csv_arg_group.add_argument("--csvoutputfile", help="Output filename")
+    csv_arg_group.add_argument("--csvoutputfile",
+                               help="Output filename, - for stdout")
+    csv_arg_group.add_argument(
+        "--merge",
+        help="write the records of all the input files to the "
+             "--csvoutputfile file with the input file name in the "
+             "SOURCE_FILE column",
+        action="store_true"
+    )
+
+
+def _add_convert_args(parser):
+    """
+    mideu add convert subcommand arguments
+
+    :param parser: the argparse parser
+    :return: None
+    """
+    parser.add_argument(
+        "-o", "--output",
+        help="Output IPM file name, - for stdout. "
+             "Default is input file name plus .out"
+    )
+    parser.add_argument(
+        "--validate",
+        help="convert each field separately and check that the fields "
+             "match the record length. Slower",
+        action="store_true"
+    )
+
+
+def _add_index_args(parser):
+    """
+    mideu add index subcommand arguments
+
+    :param parser: the argparse parser
+    :return: None
+    """
+    parser.add_argument(
+        "--indexfile",
+        help="Index filename, default is input filename plus .idx"
+    )
+    parser.add_argument(
+        "--field",
+        help="also index the values of this field, e.g. DE31. Can be repeated",
+        action="append"
+    )
+
+
+def _add_lookup_args(parser):
+    """
+    mideu add lookup subcommand arguments
+
+    :param parser: the argparse parser
+    :return: None
+    """
+    parser.add_argument("--field", help="field to search, e.g. DE31",
+                        required=True)
+    parser.add_argument("value", help="field value to find")
+    parser.add_argument("input", help="Input IPM file name")
+
+
+def _add_generate_args(parser):
+    """
+    mideu add generate subcommand arguments
+
+    :param parser: the argparse parser
+    :return: None
+    """
+    parser.add_argument(
+        "output",
+        help="Output IPM file name, - for stdout. Compressed when the "
+             "name ends with .gz, .bz2 or .xz"
+    )
+    parser.add_argument(
+        "-n", "--records",
+        help="number of messages to generate",
+        type=int,
+        default=1000
+    )
+    parser.add_argument(
+        "--seed",
+        help="random seed, the same seed and date give the same file",
+        type=int
+    )
+    parser.add_argument(
+        "-e", "--encoding",
+        help="encoding format of the output file",
+        choices=["ebcdic", "ascii"],
+        default="ebcdic"
+    )
+    parser.add_argument(
+        "--no1014blocking",
+        help="do not use 1014 block format. Just vbs type record",
+        dest="no_1014_blocking",
+        action="store_true"
+    )
+    parser.add_argument("--date",
+                        help="file date as YYYY-MM-DD, default is today")
+    parser.add_argument(
+        "--fee-collection-ratio",
+        help="share of the messages that are 1740 fee collections, "
+             "default 0.01",
+        type=float,
+        default=0.01
+    )
 
 
 if __name__ == "__main__":
@@ -11,9 +11,16 @@ import logging
 
 from hexdump import hexdump
 
-from mciutil import block, unblock, vbs_unpack, vbs_pack, _version
-from mciutil.mciutil import _convert_text_eb2asc, _convert_text_asc2eb
-from mciutil.cli.common import add_logging_arg_group, add_source_format_arg
+from mciutil import (
+    open_ipm, iter_records, VbsWriter, BlockedWriter, __version__,
+)
+from mciutil.mciutil import (
+    _convert_text_eb2asc, _convert_text_asc2eb, STDIO_FILENAME,
+)
+from mciutil.cli.common import (
+    add_logging_arg_group, add_source_format_arg, get_output_filename,
+    get_status_file, is_same_file,
+)
 
 
 def cli_entry():
@@ -34,12 +41,14 @@ def _get_cli_parser():
     """
     parser = argparse.ArgumentParser(
         description="MasterCard parameter file conversion utility ({version})".format(
-            version=_version.get_versions()['version'])
+            version=__version__)
     )
-    parser.add_argument("input", help="MasterCard parameter file name")
-    parser.add_argument("-o", "--output", help="Converted parameter file name")
+    parser.add_argument("input",
+                        help="MasterCard parameter file name, - for stdin")
+    parser.add_argument("-o", "--output",
+                        help="Converted parameter file name, - for stdout")
     parser.add_argument("--version", action="version",
-                        version="%(prog)s ("+_version.get_versions()['version']+")",
+                        version="%(prog)s ("+__version__+")",
                         help="Get version information")
 
     add_source_format_arg(parser)
@@ -62,57 +71,61 @@ def _main(args):
     )
 
     # exit if input file does not exist
-    if not os.path.isfile(args.input):
+    if args.input != STDIO_FILENAME and not os.path.isfile(args.input):
         print("Input file not found - {0}".format(args.input))
         exit(8)
 
     input_filename = args.input
     output_filename = args.output
     if not args.output:
-        output_filename = input_filename + ".out"
-
-    # read file to string
-    with open(input_filename, 'rb') as infile:
-        input_file = infile.read()
-
-    print("{0} bytes read from {1}".format(len(input_file), input_filename))
-
-    # unpack the file
-    if args.no_1014_blocking:
-        input_file = vbs_unpack(input_file)
-    else:
-        input_file = unblock(input_file)
-
-    # convert the file
-    output_list = [
-        _convert(record, args.sourceformat) for record in input_file
-    ]
-
-    # re-pack the data
-    if args.no_1014_blocking:
-        output_data = vbs_pack(output_list)
-    else:
-        output_data = block(output_list)
-
-    # save to file
-    with open(output_filename, "wb") as output_file:
-        output_file.write(output_data)
-
-    print("{0} bytes written to {1}".format(len(output_data), output_filename))
-    print("{0} records".format(len(output_list)))
-
-    if args.loglevel == logging.DEBUG:
-        print("DEBUG:Input first 5000 bytes")
-        hexdump(input_file[:5000])
-        print("DEBUG:Output first 5000 bytes")
-        hexdump(output_data[:5000])
-
-        print("DEBUG:Input last 5000 bytes")
-        hexdump(input_file[len(output_data)-5000:len(input_file)])
-        print("DEBUG:Output last 5000 bytes")
-        hexdump(output_data[len(output_data)-5000:len(output_data)])
+        output_filename = get_output_filename(input_filename, ".out")
+    if is_same_file(input_filename, output_filename):
+        print("Output file cannot be the input file - {0}".format(
+            output_filename))
+        exit(8)
 
-    print("Done!")
+    # convert each record as it is read from the input file and stream it
+    # to the output file
+    writer_class = VbsWriter if args.no_1014_blocking else BlockedWriter
+    with open_ipm(input_filename) as input_file:
+        input_file = _ReadCounter(input_file)
+        with open_ipm(output_filename, "wb") as output_file:
+            with writer_class(output_file) as writer:
+                for record in iter_records(
+                        input_file, blocked=not args.no_1014_blocking):
+                    writer.write_record(_convert(record, args.sourceformat))
+
+    status_file = get_status_file(output_filename)
+    print("{0} bytes read from {1}".format(
+        input_file.byte_count, input_filename), file=status_file)
+    print("{0} bytes written to {1}".format(
+        writer.byte_count, output_filename), file=status_file)
+    print("{0} records".format(writer.record_count), file=status_file)
+
+    if (args.loglevel == logging.DEBUG and
+            STDIO_FILENAME not in (input_filename, output_filename)):
+        with open_ipm(input_filename) as input_file:
+            print("DEBUG:Input first 5000 bytes")
+            hexdump(input_file.read(5000))
+        with open_ipm(output_filename) as output_file:
+            print("DEBUG:Output first 5000 bytes")
+            hexdump(output_file.read(5000))
+
+    print("Done!", file=status_file)
+
+
+class _ReadCounter(object):
+    """
+    Counts the bytes read from a file object
+    """
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.byte_count = 0
+
+    def read(self, size=-1):
+        data = self.input_file.read(size)
+        self.byte_count += len(data)
+        return data
 
 
 def _convert(record, source_format):
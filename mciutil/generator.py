@@ -0,0 +1,423 @@
+"""
+mciutil.generator
+
+Synthetic IPM clearing files for testing and load testing.
+
+Generated files start with a 1644 file header message, hold 1240 first
+presentment and 1740 fee collection messages and end with a 1644 file
+trailer message holding the message count and amount checksum. DE71
+numbers the messages from 1::
+
+    with open_ipm("test.ipm", "wb") as output_file:
+        write_generated_file(output_file, 100000, bit_config, seed=42)
+
+Each message is made from one of a pool of templates built with random
+values for the other fields, DE43 name and location, PDS in DE48 and ICC
+data in DE55, so the bitmaps and field lengths vary between messages. A new
+PAN, amount, acquirer reference, retrieval reference and message number are
+filled into the template for each message, which is much faster than
+building each message field by field.
+
+Use :func:`build_message` to build single messages from field values.
+"""
+from __future__ import print_function
+
+import datetime
+import operator
+import random
+import struct
+
+from .mciutil import (
+    ASCII_TO_EBCDIC, VbsWriter, BlockedWriter, compile_bit_config, b,
+)
+
+# number of message templates, a power of 2 so the template can be picked
+# from the random bits of each message
+TEMPLATE_COUNT = 256
+
+# random digits filled into the templates for each message, as the field
+# they replace the end of, the number of digits and the offset in the digits
+_SLOTS = (
+    ("DE2", 10, 0),
+    ("DE4", 8, 10),
+    ("DE31", 12, 18),
+    ("DE37", 12, 30),
+)
+_RANDOM_DIGITS = 42
+_RANDOM_BITS = 140
+_TEMPLATE_BITS = 8
+# the message number follows the random digits
+_MESSAGE_NUMBER_SLOT = ("DE71", 8, _RANDOM_DIGITS)
+# the amount is digits 10 to 17 of the random digits
+_AMOUNT_DIVISOR = 10 ** (_RANDOM_DIGITS - 18)
+
+_PROCESSOR_ID = "00000012345"
+_ACQUIRER_IDS = ("000012", "000034", "000056")
+_ISSUER_BINS = ("512345", "535310", "542418", "552033", "222300")
+_BUSINESS_CODES = (
+    "5411", "5812", "5541", "5942", "4111", "7011", "5999", "5732",
+)
+_MERCHANTS = (
+    ("BIG BOBS SUPERMARKET", "70 FERNDALE ST", "ANNERLEY", "4103", "QLD",
+     "AUS"),
+    ("CORNER CAFE", "1 MAIN RD", "FITZROY", "3065", "VIC", "AUS"),
+    ("PETROL PLUS 123", "455 PACIFIC HWY", "ST LEONARDS", "2065", "NSW",
+     "AUS"),
+    ("ONLINE BOOKS", "PO BOX 12", "PERTH", "6000", "WA", "AUS"),
+    ("CITY HOTEL", "8 QUEEN ST", "AUCKLAND", "1010", "AUK", "NZL"),
+    ("TECH WORLD", "250 ORCHARD RD", "SINGAPORE", "238873", "SG", "SGP"),
+)
+
+
+def build_message(message, bit_config, encoding="ebcdic"):
+    """
+    Build an IPM message record from its field values
+
+    The secondary bitmap is always included, as in IPM files.
+
+    :param message: dictionary with the MTI and field values keyed DE2 to
+        DE127. Values are text, except ICC data (DE55) which is bytes
+    :param bit_config: dictionary of bit mapping configuration or
+        CompiledBitConfig
+    :param encoding: ascii or ebcdic
+    :return: the record
+    :raises ValueError: when a field is not configured or its value does not
+        fit the field
+    """
+    return b("").join(_get_message_parts(
+        message, compile_bit_config(bit_config), encoding))
+
+
+def build_pds(pds_values):
+    """
+    Build PDS field data, e.g. for DE48
+
+    :param pds_values: dictionary of PDS number to text value
+    :return: the field text with the PDS in number order
+    """
+    return "".join(
+        "{0:04d}{1:03d}{2}".format(int(pds_number),
+                                   len(pds_values[pds_number]),
+                                   pds_values[pds_number])
+        for pds_number in sorted(pds_values, key=int)
+    )
+
+
+def build_icc_data(tags):
+    """
+    Build ICC field data (DE55) from EMV tags
+
+    :param tags: list of (hex tag, bytes value) tuples,
+        e.g. ("9F26", cryptogram)
+    :return: the field bytes
+    """
+    return b("").join(
+        bytes(bytearray.fromhex(tag)) + struct.pack(">B", len(value)) + value
+        for tag, value in tags
+    )
+
+
+def iter_generated_records(record_count, bit_config, encoding="ebcdic",
+                           seed=None, file_date=None,
+                           fee_collection_ratio=0.01, icc_ratio=0.7,
+                           pds_count=None, de62_pds_count=0):
+    """
+    Generate the records of an IPM clearing file
+
+    :param record_count: number of 1240 and 1740 messages, the header and
+        trailer messages are added to these
+    :param bit_config: dictionary of bit mapping configuration or
+        CompiledBitConfig
+    :param encoding: ascii or ebcdic
+    :param seed: random seed, the same seed and file_date give the same records
+    :param file_date: datetime.date of the file, default is today
+    :param fee_collection_ratio: share of the messages that are 1740 fee
+        collections
+    :param icc_ratio: share of the 1240 messages with ICC data in DE55
+    :param pds_count: number of PDS added to DE48 of the 1240 messages,
+        default is a random 0 to 8
+    :param de62_pds_count: number of PDS in DE62 of the 1240 messages,
+        DE62 is left out when 0
+    :return: generator yielding the records
+    """
+    bit_config = compile_bit_config(bit_config)
+    rng = random.Random(seed)
+    file_date = file_date or datetime.date.today()
+    file_id = "002{0:%y%m%d}{1}{2:05d}".format(
+        file_date, _PROCESSOR_ID, rng.randint(1, 99999))
+
+    fee_collection_count = int(round(TEMPLATE_COUNT * fee_collection_ratio))
+    templates = [
+        _get_template(
+            _get_fee_collection_fields(rng, file_date)
+            if template_number < fee_collection_count
+            else _get_presentment_fields(
+                rng, file_date, icc_ratio, pds_count, de62_pds_count),
+            bit_config, encoding)
+        for template_number in range(TEMPLATE_COUNT)
+    ]
+    rng.shuffle(templates)
+    translate_table = ASCII_TO_EBCDIC if encoding == "ebcdic" else None
+
+    yield build_message(_get_file_fields("697", file_id, {"0122": "T"}, 1),
+                        bit_config, encoding)
+
+    getrandbits = rng.getrandbits
+    random_modulus = 10 ** _RANDOM_DIGITS
+    digits_format = b("%0{0}d%08d".format(_RANDOM_DIGITS))
+    amount_total = 0
+    for message_number in range(2, record_count + 2):
+        random_bits = getrandbits(_RANDOM_BITS + _TEMPLATE_BITS)
+        random_number = random_bits % random_modulus
+        digits = digits_format % (random_number, message_number)
+        if translate_table is not None:
+            digits = digits.translate(translate_table)
+        template, get_slot_values, has_amount = \
+            templates[random_bits >> _RANDOM_BITS]
+        if has_amount:
+            amount_total += random_number // _AMOUNT_DIVISOR % 100000000
+        yield template % get_slot_values(digits)
+
+    yield build_message(_get_file_fields("695", file_id, {
+        "0301": "{0:016d}".format(amount_total % 10 ** 16),
+        "0306": "{0:08d}".format(record_count + 2),
+    }, record_count + 2), bit_config, encoding)
+
+
+def write_generated_file(output_file, record_count, bit_config,
+                         encoding="ebcdic", blocked=True, seed=None,
+                         file_date=None, fee_collection_ratio=0.01,
+                         icc_ratio=0.7, pds_count=None, de62_pds_count=0):
+    """
+    Write a generated IPM clearing file
+
+    :param output_file: binary file object to write to, see
+        :func:`mciutil.open_ipm`
+    :param record_count: number of 1240 and 1740 messages
+    :param bit_config: dictionary of bit mapping configuration or
+        CompiledBitConfig
+    :param encoding: ascii or ebcdic
+    :param blocked: True for 1014 blocked, False for VBS format
+    :param seed: random seed, the same seed and file_date give the same file
+    :param file_date: datetime.date of the file, default is today
+    :param fee_collection_ratio: share of the messages that are 1740 fee
+        collections
+    :param icc_ratio: share of the 1240 messages with ICC data in DE55
+    :param pds_count: number of PDS added to DE48 of the 1240 messages,
+        default is a random 0 to 8
+    :param de62_pds_count: number of PDS in DE62 of the 1240 messages
+    :return: the writer, with record_count and byte_count of the file
+    """
+    writer_class = BlockedWriter if blocked else VbsWriter
+    with writer_class(output_file) as writer:
+        writer.write_records(iter_generated_records(
+            record_count, bit_config, encoding, seed, file_date,
+            fee_collection_ratio, icc_ratio, pds_count, de62_pds_count))
+    return writer
+
+
+def _get_message_parts(message, bit_config, encoding):
+    """
+    Get the parts of a message record
+
+    :param message: dictionary with the MTI and field values
+    :param bit_config: CompiledBitConfig
+    :param encoding: ascii or ebcdic
+    :return: list of the MTI and bitmap followed by the length prefix and
+        data of each field in bit order
+    """
+    bitmap = 1 << 127   # secondary bitmap present
+    parts = []
+    for bit in sorted(int(key[2:]) for key in message if key.startswith("DE")):
+        if bit not in bit_config or not 2 <= bit <= 127:
+            raise ValueError("DE{0} is not configured".format(bit))
+        field_spec = bit_config.fields[bit]
+        value = message["DE" + str(bit)]
+        if not field_spec.binary:
+            value = _encode_text(value, encoding)
+        if field_spec.length_size:
+            if len(value) >= 10 ** field_spec.length_size:
+                raise ValueError("DE{0} is too long, {1} bytes".format(
+                    bit, len(value)))
+            parts.append(_encode_text("{0:0{1}d}".format(
+                len(value), field_spec.length_size), encoding))
+        elif len(value) != field_spec.field_length:
+            raise ValueError("DE{0} must be {1} bytes, not {2}".format(
+                bit, field_spec.field_length, len(value)))
+        parts.append(value)
+        bitmap |= 1 << (128 - bit)
+
+    bitmap_bytes = struct.pack(
+        ">QQ", bitmap >> 64, bitmap & 0xFFFFFFFFFFFFFFFF)
+    return [_encode_text(message["MTI"], encoding) + bitmap_bytes] + parts
+
+
+def _encode_text(value, encoding):
+    value = value if isinstance(value, bytes) else b(value)
+    return value.translate(ASCII_TO_EBCDIC) if encoding == "ebcdic" else value
+
+
+def _get_template(message, bit_config, encoding):
+    """
+    Get a message template with slots for the generated digits
+
+    The slot fields hold placeholder digits in message, which are replaced
+    by the generated digits.
+
+    :param message: dictionary with the MTI and field values
+    :param bit_config: CompiledBitConfig
+    :param encoding: ascii or ebcdic
+    :return: tuple of the record format, function returning the slot values
+        from the generated digits and True when the message has an amount
+    """
+    slots = dict((slot[0], slot) for slot in _SLOTS + (_MESSAGE_NUMBER_SLOT,))
+    bits = sorted(int(key[2:]) for key in message if key.startswith("DE"))
+    parts = _get_message_parts(message, bit_config, encoding)
+
+    record_format = [parts[0].replace(b("%"), b("%%"))]
+    slot_values = []
+    part_number = 1
+    for bit in bits:
+        if bit_config.fields[bit].length_size:
+            record_format.append(parts[part_number].replace(b("%"), b("%%")))
+            part_number += 1
+        field_data = parts[part_number]
+        part_number += 1
+        slot = slots.get("DE" + str(bit))
+        if slot is None:
+            record_format.append(field_data.replace(b("%"), b("%%")))
+            continue
+        _, slot_length, slot_offset = slot
+        record_format.append(
+            field_data[:-slot_length].replace(b("%"), b("%%")) + b("%s"))
+        slot_values.append(slice(slot_offset, slot_offset + slot_length))
+
+    return (b("").join(record_format), operator.itemgetter(*slot_values),
+            "DE4" in message)
+
+
+def _get_file_fields(function_code, file_id, pds_values, message_number):
+    """
+    Get the fields of a 1644 file header or trailer message
+    """
+    pds_values = dict(pds_values, **{"0105": file_id})
+    return {
+        "MTI": "1644",
+        "DE24": function_code,
+        "DE48": build_pds(pds_values),
+        "DE71": "{0:08d}".format(message_number),
+    }
+
+
+def _get_presentment_fields(rng, file_date, icc_ratio=0.7, pds_count=None,
+                            de62_pds_count=0):
+    """
+    Get random fields for a 1240 first presentment template
+
+    The slot fields are filled with placeholder digits. See
+    :func:`iter_generated_records` for the ICC and PDS parameters.
+    """
+    transaction_time = datetime.datetime.combine(
+        file_date - datetime.timedelta(days=rng.randint(1, 5)), datetime.time()
+    ) + datetime.timedelta(seconds=rng.randrange(86400))
+    acquirer_id = rng.choice(_ACQUIRER_IDS)
+    name, street, suburb, postcode, state, country = rng.choice(_MERCHANTS)
+    chip = rng.random() < icc_ratio
+    pds_values = {
+        "0023": rng.choice(("POI", "CT6", "CT1")),
+        "0052": "210" if not chip and rng.random() < 0.5 else "910",
+        "0148": "0362",
+        "0158": "MCC{0:02d}A{1:06d}    {2:%y%m%d}01".format(
+            rng.randrange(100), rng.randrange(10 ** 6),
+            transaction_time.date())[:30],
+        "0165": "M",
+    }
+    if pds_count is None:
+        pds_count = rng.randint(0, 8)
+    for pds_number in rng.sample(range(170, 999), pds_count):
+        pds_values["{0:04d}".format(pds_number)] = "X" * rng.randint(1, 20)
+    fields = {
+        "MTI": "1240",
+        "DE2": rng.choice(_ISSUER_BINS) + "0" * 10,
+        "DE3": rng.choice(("000000", "003000", "001000")),
+        "DE4": "0000" + "0" * 8,
+        "DE12": "{0:%y%m%d%H%M%S}".format(transaction_time),
+        "DE14": "{0:02d}{1:02d}".format(
+            (file_date.year + rng.randint(1, 4)) % 100, rng.randint(1, 12)),
+        "DE22": "M" + ("5" if chip else "2") + "0101" +
+                rng.choice(("M", "9")) + "00100",
+        "DE24": "200",
+        "DE25": "1401",
+        "DE26": rng.choice(_BUSINESS_CODES),
+        "DE31": "7{0}{1}{2:03d}{3}".format(
+            acquirer_id, file_date.year % 10, file_date.timetuple().tm_yday,
+            "0" * 12),
+        "DE33": acquirer_id,
+        "DE37": "0" * 12,
+        "DE38": "{0:06d}".format(rng.randrange(10 ** 6)),
+        "DE40": "201" if chip else "101",
+        "DE41": "T{0:07d}".format(rng.randrange(10 ** 7)),
+        "DE42": "{0:015d}".format(rng.randrange(10 ** 15)),
+        "DE43": "{0}\\{1}\\{2}\\{3:<10}{4:<3}{5}".format(
+            name, street, suburb, postcode, state, country),
+        "DE48": build_pds(pds_values),
+        "DE49": "036",
+        "DE50": "036",
+        "DE63": "MCC{0:013d}".format(rng.randrange(10 ** 13)),
+        "DE71": "0" * 8,
+        "DE94": acquirer_id,
+    }
+    if de62_pds_count:
+        fields["DE62"] = build_pds(dict(
+            ("{0:04d}".format(pds_number), "Y" * rng.randint(1, 30))
+            for pds_number in rng.sample(range(1000, 9999), de62_pds_count)))
+    if chip:
+        fields["DE23"] = "001"
+        fields["DE55"] = build_icc_data([
+            ("9F26", struct.pack(">Q", rng.getrandbits(64))),
+            ("9F27", b("\x80")),
+            ("9F10", struct.pack(
+                ">QQ", rng.getrandbits(64), rng.getrandbits(64)
+            )[:rng.choice((7, 16))]),
+            ("9F37", struct.pack(">I", rng.getrandbits(32))),
+            ("9F36", struct.pack(">H", rng.getrandbits(16))),
+            ("95", b("\x00\x00\x00\x80\x00")),
+            ("9A", bytes(bytearray.fromhex(
+                "{0:%y%m%d}".format(transaction_time)))),
+            ("9C", b("\x00")),
+            ("9F02", b("\x00") * 6),
+            ("5F2A", b("\x00\x36")),
+            ("82", b("\x39\x00")),
+            ("9F1A", b("\x00\x36")),
+            ("9F34", b("\x1f\x03\x02")),
+            ("9F33", b("\xe0\xf0\xc8")),
+        ])
+    return fields
+
+
+def _get_fee_collection_fields(rng, file_date):
+    """
+    Get random fields for a 1740 fee collection template
+
+    The slot fields are filled with placeholder digits.
+    """
+    return {
+        "MTI": "1740",
+        "DE2": rng.choice(_ISSUER_BINS) + "0" * 10,
+        "DE3": "190000",
+        "DE4": "0000" + "0" * 8,
+        "DE24": "700",
+        "DE25": rng.choice(("7600", "7601", "7602", "7612")),
+        "DE33": rng.choice(_ACQUIRER_IDS),
+        "DE48": build_pds({
+            "0137": "{0:020d}".format(rng.randrange(10 ** 20)),
+            "0148": "0362",
+            "0165": "M",
+        }),
+        "DE49": "036",
+        "DE71": "0" * 8,
+        "DE72": "FEE COLLECTION {0:06d}".format(rng.randrange(10 ** 6)),
+        "DE73": "{0:%y%m%d}".format(file_date),
+        "DE93": rng.choice(_ACQUIRER_IDS),
+        "DE94": rng.choice(_ACQUIRER_IDS),
+    }
@@ -0,0 +1,682 @@
+"""
+mciutil.index
+
+Record boundary index files for random access into IPM files.
+
+The index is a sidecar file holding the offset and length of every record,
+so a record can be read without walking the record lengths before it::
+
+    write_index("ipm_file")
+    with open_indexed("ipm_file") as indexed_file:
+        print(len(indexed_file))
+        record = indexed_file.record(1000)
+
+The index file has a header with a magic string, the blocking flag, the
+record count and the size of the indexed file followed by one entry per
+record. Entries hold the logical VBS offset of the record data, the record
+length and the physical offset of the record data in the file.
+
+Field value indexes find the records holding a value of a field, such as
+the acquirer reference number in DE31::
+
+    write_value_index("ipm_file", bit_config, ["DE31"])
+    with open_value_index("ipm_file", "DE31") as value_index:
+        found_records = value_index.find(b"75432121234567890123456")
+        for record_number, record in found_records:
+            print(record_number)
+
+Value index files hold the values sorted and null padded to the longest
+value, each followed by the record number, logical offset and length. The
+header holds the blocking and encoding of the file and its size and
+modification time when indexed. Values are sorted in runs of
+VALUE_INDEX_RUN_SIZE, spilled to temporary files and merged, so memory use
+does not depend on the file size.
+"""
+from __future__ import print_function
+
+import heapq
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+from .mciutil import (
+    BLOCK_SIZE, BLOCK_DATA_SIZE, iter_record_chunks, get_message_elements,
+    compile_bit_config, get_compression, map_file,
+    _iter_record_spans,
+    _check_block_marker, _get_physical_offset, _get_logical_data, b,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b("MCIIDX01")
+INDEX_HEADER = struct.Struct(">8sBQQ")
+INDEX_ENTRY = struct.Struct(">QIQ")
+
+VALUE_INDEX_MAGIC = b("MCIVIX02")
+VALUE_INDEX_HEADER = struct.Struct(">8sB6sQQQI")
+
+# values sorted in memory before a run is written to a temporary file
+VALUE_INDEX_RUN_SIZE = 500000
+
+# record number, logical offset and length following each value
+_VALUE_ENTRY_TAIL = struct.Struct(">QQI")
+_RUN_ENTRY_LENGTH = struct.Struct(">H")
+
+
+def get_index_filename(input_filename):
+    """
+    Get the default index filename for a file
+
+    :param input_filename: the IPM file name
+    :return: index file name
+    """
+    return input_filename + INDEX_SUFFIX
+
+
+def write_index(input_filename, index_filename=None, blocked=True):
+    """
+    Writes the record index for a 1014 blocked or VBS file
+
+    :param input_filename: the IPM file name
+    :param index_filename: the index file name, defaults to input filename
+        plus .idx
+    :param blocked: True if file is 1014 blocked, False if VBS format
+    :return: number of records indexed
+    :raises ValueError: when the file is compressed
+    """
+    _check_not_compressed(input_filename)
+    if index_filename is None:
+        index_filename = get_index_filename(input_filename)
+
+    with open(input_filename, 'rb') as input_file:
+        mapped_file = map_file(input_file)
+
+    record_count = 0
+    data_view = memoryview(mapped_file)
+    try:
+        if blocked:
+            _check_block_marker(data_view)
+
+        with open(index_filename, 'wb') as index_file:
+            # header is rewritten with the record count at the end
+            index_file.write(INDEX_HEADER.pack(
+                INDEX_MAGIC, blocked, 0, len(data_view)))
+            pack_entry = INDEX_ENTRY.pack
+            for record_offset, record_length in _iter_record_spans(
+                    data_view, blocked):
+                index_file.write(pack_entry(
+                    record_offset, record_length,
+                    _get_physical_offset(record_offset, blocked)))
+                record_count += 1
+            index_file.seek(0)
+            index_file.write(INDEX_HEADER.pack(
+                INDEX_MAGIC, blocked, record_count, len(data_view)))
+    finally:
+        data_view.release()
+        if isinstance(mapped_file, mmap.mmap):
+            mapped_file.close()
+
+    LOGGER.info("%s records indexed in %s", record_count, index_filename)
+    return record_count
+
+
+def open_indexed(input_filename, index_filename=None):
+    """
+    Opens an IPM file using its record index
+
+    :param input_filename: the IPM file name
+    :param index_filename: the index file name, defaults to input filename
+        plus .idx
+    :return: IndexedFile
+    :raises ValueError: when the index is not valid for the file
+    """
+    if index_filename is None:
+        index_filename = get_index_filename(input_filename)
+    return IndexedFile(input_filename, index_filename)
+
+
+class IndexedFile(object):
+    """
+    IPM file with random access to its records using a record index
+
+    Create using :func:`open_indexed`. Close when finished, or use as a
+    context manager.
+    """
+    def __init__(self, input_filename, index_filename):
+        """
+        :param input_filename: the IPM file name
+        :param index_filename: the index file name
+        :raises ValueError: when the index is not valid for the file
+        """
+        with open(index_filename, 'rb') as index_file:
+            self.index_data = map_file(index_file)
+        with open(input_filename, 'rb') as input_file:
+            self.mapped_file = map_file(input_file)
+
+        try:
+            if len(self.index_data) < INDEX_HEADER.size:
+                raise ValueError(
+                    "Index file {0} is not valid".format(index_filename))
+            magic, blocked, record_count, file_size = \
+                INDEX_HEADER.unpack_from(self.index_data)
+            if magic != INDEX_MAGIC:
+                raise ValueError(
+                    "Index file {0} is not valid".format(index_filename))
+            if file_size != len(self.mapped_file):
+                raise ValueError(
+                    "Index file {0} does not match {1}, "
+                    "rebuild the index".format(index_filename, input_filename))
+        except ValueError:
+            self.close()
+            raise
+
+        self.blocked = bool(blocked)
+        self.record_count = record_count
+        self.data_view = memoryview(self.mapped_file)
+
+    def __len__(self):
+        return self.record_count
+
+    def __iter__(self):
+        for record_number in range(self.record_count):
+            yield self.record(record_number)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record_span(self, record_number):
+        """
+        Get the index entry for a record
+
+        :param record_number: the record number, starting at 0
+        :return: tuple of logical offset, length and physical offset of the
+            record data
+        :raises IndexError: when the record number is out of range
+        """
+        if record_number < 0:
+            record_number += self.record_count
+        if not 0 <= record_number < self.record_count:
+            raise IndexError("record number out of range")
+        return INDEX_ENTRY.unpack_from(
+            self.index_data,
+            INDEX_HEADER.size + record_number * INDEX_ENTRY.size)
+
+    def record(self, record_number):
+        """
+        Get a record
+
+        :param record_number: the record number, starting at 0
+        :return: the record data
+        :raises IndexError: when the record number is out of range
+        """
+        logical_offset, record_length, physical_offset = \
+            self.record_span(record_number)
+
+        # records within a block are read straight from the file
+        if (not self.blocked or
+                physical_offset % BLOCK_SIZE + record_length <=
+                BLOCK_DATA_SIZE):
+            return self.data_view[
+                physical_offset:physical_offset + record_length].tobytes()
+
+        return _get_logical_data(
+            self.data_view, logical_offset, logical_offset + record_length,
+            True)
+
+    def chunks(self, chunk_size):
+        """
+        Splits the records into ranges without reading the IPM file
+
+        :param chunk_size: number of records in each range
+        :return: generator yielding tuple of start offset and record count
+            as returned by :func:`mciutil.iter_record_chunks`
+        """
+        for first_record in range(0, self.record_count, chunk_size):
+            yield (self.record_span(first_record)[0] - 4,
+                   min(chunk_size, self.record_count - first_record))
+
+    def close(self):
+        """
+        Close the index and IPM file
+
+        :return: None
+        """
+        data_view = getattr(self, "data_view", None)
+        if data_view is not None:
+            data_view.release()
+            self.data_view = None
+        for mapped_file in (self.index_data, self.mapped_file):
+            if isinstance(mapped_file, mmap.mmap):
+                mapped_file.close()
+
+
+def iter_indexed_chunks(input_filename, blocked, chunk_size):
+    """
+    Splits a file into ranges of records using its index when up to date
+
+    Falls back to walking the record lengths when there is no usable index.
+
+    :param input_filename: the IPM file name
+    :param blocked: True if file is 1014 blocked, False if VBS format
+    :param chunk_size: number of records in each range
+    :return: generator yielding tuple of start offset and record count
+    """
+    index_filename = get_index_filename(input_filename)
+    if os.path.isfile(index_filename) and \
+            os.path.getmtime(index_filename) >= \
+            os.path.getmtime(input_filename):
+        try:
+            indexed_file = open_indexed(input_filename, index_filename)
+        except ValueError as ex:
+            LOGGER.info("Not using index: %s", ex)
+        else:
+            with indexed_file:
+                if indexed_file.blocked == blocked:
+                    LOGGER.info("Using index %s", index_filename)
+                    for chunk in indexed_file.chunks(chunk_size):
+                        yield chunk
+                    return
+
+    with open(input_filename, 'rb') as input_file:
+        mapped_file = map_file(input_file)
+    try:
+        for chunk in iter_record_chunks(mapped_file, blocked, chunk_size):
+            yield chunk
+    finally:
+        if isinstance(mapped_file, mmap.mmap):
+            mapped_file.close()
+
+
+def _check_not_compressed(input_filename):
+    """
+    Indexes hold offsets into the file, so compressed files cannot be indexed
+
+    :param input_filename: the IPM file name
+    :return: None
+    :raises ValueError: when the file is compressed
+    """
+    compression = get_compression(input_filename)
+    if compression is not None:
+        raise ValueError(
+            "{0} is {1} compressed, decompress the file to index it".format(
+                input_filename, compression))
+
+
+def get_value_index_filename(input_filename, field):
+    """
+    Get the default field value index filename for a file
+
+    :param input_filename: the IPM file name
+    :param field: the field key, e.g. DE31
+    :return: index file name
+    """
+    return ".".join([input_filename, field]) + INDEX_SUFFIX
+
+
+def write_value_index(input_filename, bit_config, fields,
+                      source_format="ebcdic", blocked=True):
+    """
+    Writes field value indexes for a 1014 blocked or VBS file
+
+    Each record is parsed once with :func:`mciutil.get_message_elements` and
+    a sorted index of the values of each field is written to the input
+    filename plus field key plus .idx, e.g. ipm_file.DE31.idx
+
+    :param input_filename: the IPM file name
+    :param bit_config: dictionary of bit mapping configuration
+    :param fields: list of field keys to index, e.g. DE31, DE63 or PDS0023
+    :param source_format: encoding of the file, ascii or ebcdic
+    :param blocked: True if file is 1014 blocked, False if VBS format
+    :return: number of records read
+    :raises ValueError: when the file is compressed or a field is converted
+        to a python type
+    """
+    _check_not_compressed(input_filename)
+    bit_config = compile_bit_config(bit_config)
+    fields = list(fields)
+    for field in fields:
+        _check_value_field(bit_config, field)
+    selected_fields = frozenset(fields)
+    field_runs = dict((field, _ValueRuns()) for field in fields)
+
+    with open(input_filename, 'rb') as input_file:
+        file_mtime = _get_mtime_ns(os.fstat(input_file.fileno()))
+        mapped_file = map_file(input_file)
+
+    record_number = -1
+    data_view = memoryview(mapped_file)
+    try:
+        if blocked:
+            _check_block_marker(data_view)
+
+        for record_number, (record_offset, record_length) in enumerate(
+                _iter_record_spans(data_view, blocked)):
+            message = get_message_elements(
+                _get_logical_data(data_view, record_offset,
+                                  record_offset + record_length, blocked),
+                bit_config, source_format, fields=selected_fields)
+            for field in fields:
+                value = message.get(field)
+                if value is not None:
+                    field_runs[field].add(
+                        value, record_number, record_offset, record_length)
+        file_size = len(data_view)
+    finally:
+        data_view.release()
+        if isinstance(mapped_file, mmap.mmap):
+            mapped_file.close()
+
+    for field in fields:
+        index_filename = get_value_index_filename(input_filename, field)
+        with field_runs[field] as value_runs:
+            value_count = _write_value_index_file(
+                index_filename, value_runs, blocked, source_format,
+                file_size, file_mtime)
+        LOGGER.info("%s %s values indexed in %s",
+                    value_count, field, index_filename)
+
+    return record_number + 1
+
+
+def _check_value_field(bit_config, field):
+    """
+    Value indexes hold the field bytes, so fields converted to int, decimal or
+    datetime by python_field_type cannot be indexed
+
+    :param bit_config: CompiledBitConfig
+    :param field: the field key, e.g. DE31
+    :return: None
+    :raises ValueError: when the field is converted
+    """
+    if not (field.startswith("DE") and field[2:].isdigit()):
+        return
+    bit = int(field[2:])
+    if bit in bit_config and bit_config.fields[bit].converter is not None:
+        raise ValueError(
+            "{0} values are converted by python_field_type and cannot be "
+            "indexed".format(field))
+
+
+def _get_mtime_ns(file_stat):
+    """
+    Get the modification time of a file in nanoseconds
+
+    :param file_stat: os.stat result
+    :return: int
+    """
+    mtime_ns = getattr(file_stat, "st_mtime_ns", None)
+    if mtime_ns is None:  # python 2
+        mtime_ns = int(file_stat.st_mtime * 1000000000)
+    return mtime_ns
+
+
+class _ValueRuns(object):
+    """
+    Values of a field sorted in runs
+
+    Each value is kept as one byte string of the value, a null and the
+    packed record number, offset and length, so the entries sort by value
+    then record number. Every VALUE_INDEX_RUN_SIZE entries are sorted and
+    written to a temporary file.
+    """
+    def __init__(self, run_size=None):
+        self.run_size = run_size or VALUE_INDEX_RUN_SIZE
+        self.entries = []
+        self.run_files = []
+        self.key_size = 0
+        self.value_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, value, record_number, record_offset, record_length):
+        """
+        Add a field value
+
+        :param value: the field value bytes
+        :param record_number: the record number
+        :param record_offset: logical offset of the record data
+        :param record_length: length of the record
+        :return: None
+        """
+        self.entries.append(value + b("\x00") + _VALUE_ENTRY_TAIL.pack(
+            record_number, record_offset, record_length))
+        self.key_size = max(self.key_size, len(value))
+        self.value_count += 1
+        if len(self.entries) >= self.run_size:
+            self._write_run()
+
+    def __iter__(self):
+        """
+        Iterate the sorted values
+
+        :return: generator yielding tuple of value, record number, record
+            offset and record length
+        """
+        self.entries.sort()
+        tail_size = _VALUE_ENTRY_TAIL.size
+        runs = [self.entries] + [_iter_run(run_file)
+                                 for run_file in self.run_files]
+        for entry in heapq.merge(*runs):
+            yield (entry[:-tail_size - 1],) + \
+                _VALUE_ENTRY_TAIL.unpack(entry[-tail_size:])
+
+    def close(self):
+        """
+        Remove the temporary run files
+
+        :return: None
+        """
+        for run_file in self.run_files:
+            run_file.close()
+        self.run_files = []
+        self.entries = []
+
+    def _write_run(self):
+        self.entries.sort()
+        run_file = tempfile.TemporaryFile()
+        pack_length = _RUN_ENTRY_LENGTH.pack
+        for entry in self.entries:
+            run_file.write(pack_length(len(entry)))
+            run_file.write(entry)
+        run_file.seek(0)
+        self.run_files.append(run_file)
+        self.entries = []
+
+
+def _iter_run(run_file):
+    """
+    Read the entries of a run file written by _ValueRuns
+
+    :param run_file: binary file object
+    :return: generator yielding the entries
+    """
+    length_size = _RUN_ENTRY_LENGTH.size
+    while True:
+        entry_length = run_file.read(length_size)
+        if not entry_length:
+            break
+        yield run_file.read(_RUN_ENTRY_LENGTH.unpack(entry_length)[0])
+
+
+def _write_value_index_file(index_filename, value_runs, blocked, source_format,
+                            file_size, file_mtime):
+    """
+    Writes sorted field values to a value index file
+
+    :param index_filename: the index file name
+    :param value_runs: _ValueRuns holding the field values
+    :param blocked: True if file is 1014 blocked, False if VBS format
+    :param source_format: encoding of the file, ascii or ebcdic
+    :param file_size: size of the indexed file
+    :param file_mtime: modification time of the indexed file in nanoseconds
+    :return: number of values written
+    """
+    value_entry = _get_value_entry(value_runs.key_size)
+
+    with open(index_filename, 'wb') as index_file:
+        index_file.write(VALUE_INDEX_HEADER.pack(
+            VALUE_INDEX_MAGIC, blocked, b(source_format),
+            value_runs.value_count, file_size, file_mtime,
+            value_runs.key_size))
+        for value, record_number, record_offset, record_length in value_runs:
+            index_file.write(value_entry.pack(
+                value, record_number, record_offset, record_length))
+    return value_runs.value_count
+
+
+def _get_value_entry(key_size):
+    """
+    Get the struct for value index entries
+
+    Values are padded with nulls to key_size.
+
+    :param key_size: the length of the longest value
+    :return: struct.Struct
+    """
+    return struct.Struct(">{0}sQQI".format(key_size))
+
+
+def open_value_index(input_filename, field, index_filename=None):
+    """
+    Opens a field value index of an IPM file
+
+    :param input_filename: the IPM file name
+    :param field: the field key, e.g. DE31
+    :param index_filename: the index file name, defaults to input filename
+        plus field key plus .idx
+    :return: ValueIndex
+    :raises ValueError: when the index is not valid for the file
+    """
+    if index_filename is None:
+        index_filename = get_value_index_filename(input_filename, field)
+    return ValueIndex(input_filename, index_filename)
+
+
+class ValueIndex(object):
+    """
+    Sorted index of the values of a field in an IPM file
+
+    Create using :func:`open_value_index`. Close when finished, or use as a
+    context manager.
+    """
+    def __init__(self, input_filename, index_filename):
+        """
+        :param input_filename: the IPM file name
+        :param index_filename: the value index file name
+        :raises ValueError: when the index is not valid for the file
+        """
+        with open(index_filename, 'rb') as index_file:
+            self.index_data = map_file(index_file)
+        with open(input_filename, 'rb') as input_file:
+            file_mtime = _get_mtime_ns(os.fstat(input_file.fileno()))
+            self.mapped_file = map_file(input_file)
+
+        try:
+            if len(self.index_data) < VALUE_INDEX_HEADER.size:
+                raise ValueError(
+                    "Index file {0} is not valid".format(index_filename))
+            (magic, blocked, source_format, value_count, index_file_size,
+             index_file_mtime, key_size) = \
+                VALUE_INDEX_HEADER.unpack_from(self.index_data)
+            if magic != VALUE_INDEX_MAGIC:
+                raise ValueError(
+                    "Index file {0} is not valid".format(index_filename))
+            if index_file_size != len(self.mapped_file) or \
+                    index_file_mtime != file_mtime:
+                raise ValueError(
+                    "Index file {0} does not match {1}, rebuild the "
+                    "index".format(index_filename, input_filename))
+        except ValueError:
+            self.close()
+            raise
+
+        self.blocked = bool(blocked)
+        self.source_format = source_format.rstrip(b("\x00")).decode("ascii")
+        self.value_count = value_count
+        self.key_size = key_size
+        self.value_entry = _get_value_entry(key_size)
+        self.data_view = memoryview(self.mapped_file)
+
+    def __len__(self):
+        return self.value_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def find(self, value):
+        """
+        Find the records with a field value
+
+        :param value: the field value
+        :return: list of tuple of record number and record data, in record
+            number order
+        """
+        if not isinstance(value, bytes):
+            value = value.encode("latin-1")
+        if len(value) > self.key_size:
+            return []
+
+        key = value.ljust(self.key_size, b("\x00"))
+        entry_number = self._find_first_entry(key)
+        found_records = []
+        while entry_number < self.value_count:
+            entry_key, record_number, record_offset, record_length = \
+                self._get_entry(entry_number)
+            if entry_key != key:
+                break
+            record = _get_logical_data(
+                self.data_view, record_offset, record_offset + record_length,
+                self.blocked)
+            if isinstance(record, memoryview):
+                record = record.tobytes()
+            found_records.append((record_number, record))
+            entry_number += 1
+        return found_records
+
+    def _find_first_entry(self, key):
+        """
+        Binary search for the first entry with a key not less than key
+
+        :param key: null padded key
+        :return: entry number
+        """
+        low, high = 0, self.value_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _get_entry(self, entry_number):
+        return self.value_entry.unpack_from(
+            self.index_data,
+            VALUE_INDEX_HEADER.size + entry_number * self.value_entry.size)
+
+    def close(self):
+        """
+        Close the index and IPM file
+
+        :return: None
+        """
+        data_view = getattr(self, "data_view", None)
+        if data_view is not None:
+            data_view.release()
+            self.data_view = None
+        for mapped_file in (self.index_data, self.mapped_file):
+            if isinstance(mapped_file, mmap.mmap):
+                mapped_file.close()
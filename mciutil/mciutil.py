@@ -6,73 +6,115 @@ Contains functions to work with MasterCard formatted files
 from __future__ import print_function
 
 import binascii
+import bz2
 import codecs
 import datetime
 import decimal
+import gzip
+import io
+import itertools
 import logging
+import mmap
+import os
 import re
 import struct
 import sys
-from array import array
+from collections import namedtuple
 
-import hexdump
-
-LOGGER = logging.getLogger(__name__)
+try:
+    from functools import lru_cache
+except ImportError:  # python 2 has no lru_cache, bitmaps are decoded each time
+    def lru_cache(maxsize=128):
+        def decorate(function):
+            return function
+        return decorate
 
+try:
+    import lzma
+except ImportError:  # python 2 has no lzma so xz files are not supported
+    lzma = None
 
-class BitArray:
-    """
-    This is a minimal native python replacement for the bitarray module that was used to interpret
-    the file bitmap. The bitarray module is written in c and does not provide binary wheels so
-    forces users to have compilers installed just to install mciutil.
-    This small class provides the required functions from that library.
-    """
-    endian = 'big'
-    bytes = b''
-
-    def __init__(self, endian='big'):
-        self.endian = endian
+import hexdump
 
-    def frombytes(self, array_bytes):
-        self.bytes = array_bytes
+LOGGER = logging.getLogger(__name__)
 
-    def tolist(self):
-        swap_bytes = array('B', self.bytes)
-        if self.endian == 'little':
-            for i, n in enumerate(swap_bytes):
-                swap_bytes[i] = int('{:08b}'.format(n)[::-1], 2)
-        width = len(self.bytes)*8
-        try:
-            swapped_bytes = swap_bytes.tobytes()
-        except AttributeError:  # 2.7 does not recognise .tobytes method. 2.6 does!
-            swapped_bytes = swap_bytes.tostring()
-        bit_list = '{bytes:0{width}b}'.format(bytes=int(binascii.hexlify(swapped_bytes), 16), width=width)
-        return [bit == '1' for bit in bit_list]
+# translate tables between EBCDIC (cp500) and ASCII (latin-1). Usable with
+# bytes.translate and bytearray.translate
+_ALL_BYTES = bytes(bytearray(range(256)))
+EBCDIC_TO_ASCII = codecs.encode(codecs.decode(_ALL_BYTES, "cp500"), "latin-1")
+ASCII_TO_EBCDIC = codecs.encode(codecs.decode(_ALL_BYTES, "latin-1"), "cp500")
+
+# 1014 blocked files carry 1012 bytes of VBS data followed by 2 marker bytes
+BLOCK_SIZE = 1014
+BLOCK_DATA_SIZE = 1012
+# filename used for stdin and stdout
+STDIO_FILENAME = "-"
+# VBS record length prefix
+_RECORD_LENGTH = struct.Struct(">i")
+# the marker bytes, also used to fill the last block
+BLOCK_PAD_CHAR = bytes(bytearray([0x40]))
+BLOCK_MARKER = BLOCK_PAD_CHAR * 2
+# number of 1014 byte blocks requested from the file object on each read
+BLOCKS_PER_READ = 64
+
+# field processing modes when only some fields are requested
+_SKIP_FIELD = 0
+_VALUE_FIELD = 1
+_EXPAND_FIELD = 2
 
 
 def unblock(blocked_data):
     """
     Unblocks a 1014 byte blocked string
 
+    The record lengths are read across the block boundaries, so each record
+    is copied once from blocked_data. Records that span a block boundary are
+    joined without the block markers.
+
     :param blocked_data: String containing 1014 blocked data or file
     :return: list of records in file
     """
-    block_warning_triggered = False
-    file_pointer = 0
-    unblock_data = []
+    data_view = memoryview(blocked_data)
+    _check_block_markers(data_view)
+
+    logical_size = _get_logical_size(len(data_view), True)
+    debug_enabled = LOGGER.isEnabledFor(logging.DEBUG)
+    records = []
+    vbs_pointer = 0
 
-    while file_pointer <= len(blocked_data):
-        unblock_data.append(blocked_data[file_pointer:file_pointer+1012])
-        LOGGER.debug("Block chars [%s]", blocked_data[file_pointer+1012:file_pointer+1014])
-        if not block_warning_triggered and (
-                blocked_data[file_pointer+1012:file_pointer+1014] not in (b(''), b("\x40\x40"))):
-            LOGGER.warn("File may not be in 1014 blocked format - found unusual EOB marker %s, usually x'40'x'40'\n"
-                        "Consider using --no1014blocking option if file is VBS format",
-                        blocked_data[file_pointer+1012:file_pointer+1014])
-            block_warning_triggered = True
-        file_pointer += 1014
+    while vbs_pointer + 4 <= logical_size:
+        block_number, block_pointer = divmod(vbs_pointer, BLOCK_DATA_SIZE)
+        file_pointer = block_number * BLOCK_SIZE + block_pointer
 
-    return vbs_unpack(b("").join(unblock_data))
+        # get record length
+        if block_pointer + 4 <= BLOCK_DATA_SIZE:
+            record_length = _RECORD_LENGTH.unpack_from(
+                blocked_data, file_pointer)[0]
+        else:
+            record_length = _RECORD_LENGTH.unpack(_get_logical_data(
+                data_view, vbs_pointer, vbs_pointer + 4, True))[0]
+        if debug_enabled:
+            LOGGER.debug("record_length=%s", record_length)
+
+        # exit if last record (length=0)
+        if record_length == 0:
+            break
+
+        vbs_pointer += 4
+        block_pointer += 4
+        file_pointer += 4
+        record_length = min(record_length, logical_size - vbs_pointer)
+
+        # slice records within a block, only join records that span blocks
+        if block_pointer + record_length <= BLOCK_DATA_SIZE:
+            records.append(
+                blocked_data[file_pointer:file_pointer + record_length])
+        else:
+            records.append(_get_logical_data(
+                data_view, vbs_pointer, vbs_pointer + record_length, True))
+        vbs_pointer += record_length
+
+    return records
 
 
 def vbs_unpack(vbs_data):
@@ -115,6 +157,427 @@ def vbs_unpack(vbs_data):
     return line_data
 
 
+def open_ipm(filename, mode="rb"):
+    """
+    Opens an IPM file, compressing or decompressing gzip, bz2 and xz files
+
+    Files opened for reading are checked for the gzip, bz2 or xz magic
+    bytes. Files opened for writing are compressed when the filename ends
+    with .gz, .bz2 or .xz. The returned file object reads or writes the
+    uncompressed data as a stream, so large files are never decompressed in
+    full.
+
+    A filename of - opens stdin or stdout. Closing the returned file object
+    does not close stdin or stdout.
+
+    :param filename: the file name, or - for stdin/stdout
+    :param mode: rb to read or wb to write
+    :return: binary file object
+    :raises ValueError: when the compression is not supported by this python
+    """
+    if mode not in ("rb", "wb"):
+        raise ValueError("mode must be rb or wb")
+
+    if filename == STDIO_FILENAME:
+        return _open_stdio(mode)
+
+    if mode == "rb":
+        compression = get_compression(filename)
+    else:
+        compression = _COMPRESSION_SUFFIXES.get(
+            os.path.splitext(filename)[1].lower())
+
+    if compression is None:
+        return open(filename, mode)
+
+    LOGGER.info("Opening %s as %s compressed file", filename, compression)
+    if compression == "gzip":
+        return gzip.open(filename, mode, compresslevel=6)
+    if compression == "bz2":
+        return bz2.BZ2File(filename, mode)
+    if lzma is None:
+        raise ValueError(
+            "xz compressed files are not supported by this python version")
+    return lzma.open(filename, mode)
+
+
+def _open_stdio(mode):
+    """
+    Opens stdin or stdout as a binary stream, decompressing stdin
+
+    :param mode: rb for stdin or wb for stdout
+    :return: binary file object that does not close stdin/stdout
+    """
+    if mode == "wb":
+        sys.stdout.flush()
+        return io.open(sys.stdout.fileno(), mode, closefd=False)
+
+    stdin_file = io.open(sys.stdin.fileno(), mode, closefd=False)
+    compression = _get_header_compression(stdin_file.peek(6)[:6])
+    if compression is None:
+        return stdin_file
+
+    LOGGER.info("Reading stdin as %s compressed data", compression)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=stdin_file, mode=mode)
+    if compression == "bz2" and sys.version_info >= (3, 3):
+        return bz2.BZ2File(stdin_file, mode)
+    if compression == "xz" and lzma is not None:
+        return lzma.LZMAFile(stdin_file, mode)
+    raise ValueError(
+        "{0} compressed stdin is not supported by this python "
+        "version".format(compression))
+
+
+def get_compression(filename):
+    """
+    Get the compression of a file from its magic bytes
+
+    :param filename: the file name
+    :return: gzip, bz2, xz or None when the file is not compressed
+    """
+    with open(filename, "rb") as input_file:
+        return _get_header_compression(input_file.read(6))
+
+
+def _get_header_compression(file_header):
+    """
+    Get the compression from the first bytes of a file
+
+    :param file_header: the first 6 bytes of the file
+    :return: gzip, bz2, xz or None when the data is not compressed
+    """
+    for magic, compression in _COMPRESSION_MAGIC:
+        if file_header.startswith(magic):
+            return compression
+    return None
+
+
+def iter_records(input_file, blocked=True):
+    """
+    Iterates the records contained in a 1014 blocked or VBS file
+
+    Data is read from the file object incrementally, so only the current
+    read buffer and the record being assembled are held in memory.
+    Records that span a block boundary are stitched back together.
+
+    :param input_file: binary file object to read records from
+    :param blocked: True if file is 1014 blocked, False if VBS format
+    :return: generator yielding each record in the file
+    """
+    if blocked:
+        data_chunks = _iter_unblocked_data(input_file)
+    else:
+        data_chunks = iter(
+            lambda: _read_fully(input_file, BLOCK_SIZE * BLOCKS_PER_READ),
+            b(""))
+
+    vbs_buffer = bytearray()
+    vbs_pointer = 0
+
+    for data_chunk in data_chunks:
+        vbs_buffer += data_chunk
+
+        while len(vbs_buffer) - vbs_pointer >= 4:
+            record_length = struct.unpack(
+                ">i", bytes(vbs_buffer[vbs_pointer:vbs_pointer+4]))[0]
+            LOGGER.debug("record_length=%s", record_length)
+
+            # exit if last record (length=0)
+            if record_length == 0:
+                return
+
+            # wait for more data if record not complete
+            if len(vbs_buffer) - vbs_pointer - 4 < record_length:
+                break
+
+            yield bytes(vbs_buffer[vbs_pointer+4:vbs_pointer+4+record_length])
+            vbs_pointer += 4 + record_length
+
+        # drop the records already returned
+        del vbs_buffer[:vbs_pointer]
+        vbs_pointer = 0
+
+    # file ended without zero length record -- return what is left like
+    # vbs_unpack
+    if len(vbs_buffer) >= 4:
+        record_length = struct.unpack(">i", bytes(vbs_buffer[:4]))[0]
+        if record_length != 0:
+            yield bytes(vbs_buffer[4:4+record_length])
+
+
+def _iter_unblocked_data(input_file):
+    """
+    Reads 1014 blocked data from a file object removing the block markers
+
+    :param input_file: binary file object containing 1014 blocked data
+    :return: generator yielding chunks of VBS data
+    """
+    block_warning_triggered = False
+
+    while True:
+        blocked_data = _read_fully(input_file, BLOCK_SIZE * BLOCKS_PER_READ)
+        if not blocked_data:
+            break
+
+        unblock_data = []
+        for file_pointer in range(0, len(blocked_data), BLOCK_SIZE):
+            block_end = file_pointer + BLOCK_DATA_SIZE
+            unblock_data.append(blocked_data[file_pointer:block_end])
+            if not block_warning_triggered:
+                block_warning_triggered = not _check_block_end(
+                    blocked_data[block_end:file_pointer + BLOCK_SIZE])
+
+        yield b("").join(unblock_data)
+
+
+def _read_fully(input_file, size):
+    """
+    Reads data from a file object until size bytes read or end of file
+
+    Streams such as pipes may return less data than requested, which would
+    break the alignment of 1014 byte blocks.
+
+    :param input_file: binary file object to read
+    :param size: number of bytes to read
+    :return: bytes read, shorter than size only at end of file
+    """
+    data = input_file.read(size)
+    if len(data) == size or not data:
+        return data
+
+    data_list = [data]
+    data_length = len(data)
+    while data_length < size:
+        data = input_file.read(size - data_length)
+        if not data:
+            break
+        data_list.append(data)
+        data_length += len(data)
+    return b("").join(data_list)
+
+
+def iter_mapped_records(input_file, blocked=True, start=0, count=None):
+    """
+    Iterates the records of a 1014 blocked or VBS file using a memory map
+
+    The file is mapped read-only and records are returned as memoryview
+    objects pointing into the map, so only the pages holding the record
+    lengths and the data actually used are read from disk.
+
+    :param input_file: binary file object of a file that can be memory mapped
+    :param blocked: True if file is 1014 blocked, False if VBS format
+    :param start: logical offset of the first record length to read
+    :param count: maximum number of records to return, None for all
+    :return: generator yielding each record in the file
+    """
+    mapped_file = map_file(input_file)
+
+    # the map is released when the last record view is released
+    for record in iter_record_views(mapped_file, blocked, start, count):
+        yield record
+
+
+def map_file(input_file):
+    """
+    Memory map a file read-only
+
+    :param input_file: binary file object
+    :return: mmap of the file, or empty bytes for an empty file
+    """
+    try:
+        return mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:  # empty files cannot be mapped
+        return b("")
+
+
+def iter_record_views(data, blocked=True, start=0, count=None):
+    """
+    Iterates the records in 1014 blocked or VBS data without copying
+
+    :param data: bytes, mmap or other buffer containing the file data
+    :param blocked: True if data is 1014 blocked, False if VBS format
+    :param start: logical offset of the first record length to read,
+                  as returned by iter_record_chunks
+    :param count: maximum number of records to return, None for all
+    :return: generator yielding each record as a memoryview into data.
+             Records that span a 1014 block boundary are joined into bytes.
+    """
+    data_view = memoryview(data)
+    if blocked and not start:
+        _check_block_marker(data_view)
+
+    record_spans = _iter_record_spans(data_view, blocked, start)
+    if count is not None:
+        record_spans = itertools.islice(record_spans, count)
+
+    for record_offset, record_length in record_spans:
+        yield _get_logical_data(
+            data_view, record_offset, record_offset + record_length, blocked)
+
+
+def iter_record_chunks(data, blocked=True, chunk_size=5000):
+    """
+    Splits 1014 blocked or VBS data into ranges of records
+
+    Only the record lengths are read, so this is a cheap way of handing
+    parts of a large file to separate processes.
+
+    :param data: bytes, mmap or other buffer containing the file data
+    :param blocked: True if data is 1014 blocked, False if VBS format
+    :param chunk_size: number of records in each range
+    :return: generator yielding tuple of start offset and record count for
+             use with iter_record_views or iter_mapped_records
+    """
+    data_view = memoryview(data)
+    if blocked:
+        _check_block_marker(data_view)
+
+    chunk_start = 0
+    chunk_count = 0
+    for record_offset, record_length in _iter_record_spans(data_view, blocked):
+        if chunk_count == chunk_size:
+            yield chunk_start, chunk_count
+            chunk_start = record_offset - 4
+            chunk_count = 0
+        chunk_count += 1
+
+    if chunk_count:
+        yield chunk_start, chunk_count
+
+
+def _iter_record_spans(data_view, blocked, start=0):
+    """
+    Walks the VBS record lengths in file data
+
+    Offsets are logical VBS offsets, which exclude the 1014 block markers.
+
+    :param data_view: memoryview of the file data
+    :param blocked: True if data is 1014 blocked, False if VBS format
+    :param start: logical offset of the first record length
+    :return: generator yielding tuple of record offset and record length
+    """
+    logical_size = _get_logical_size(len(data_view), blocked)
+    vbs_pointer = start
+
+    while vbs_pointer + 4 <= logical_size:
+
+        # get record length
+        record_length = struct.unpack(">i", _get_logical_data(
+            data_view, vbs_pointer, vbs_pointer + 4, blocked))[0]
+        LOGGER.debug("record_length=%s", record_length)
+
+        # exit if last record (length=0)
+        if record_length == 0:
+            break
+
+        vbs_pointer += 4
+        yield vbs_pointer, min(record_length, logical_size - vbs_pointer)
+        vbs_pointer += record_length
+
+
+def _get_logical_size(physical_size, blocked):
+    """
+    Get the size of the VBS data held in a file
+
+    :param physical_size: size of file data
+    :param blocked: True if data is 1014 blocked, False if VBS format
+    :return: size of VBS data
+    """
+    if not blocked:
+        return physical_size
+    block_count, block_remainder = divmod(physical_size, BLOCK_SIZE)
+    return (block_count * BLOCK_DATA_SIZE
+            + min(block_remainder, BLOCK_DATA_SIZE))
+
+
+def _get_physical_offset(logical_offset, blocked):
+    """
+    Get the file offset of a logical VBS offset
+
+    :param logical_offset: offset in the VBS data
+    :param blocked: True if data is 1014 blocked, False if VBS format
+    :return: offset in the file data
+    """
+    if not blocked:
+        return logical_offset
+    block_number, block_pointer = divmod(logical_offset, BLOCK_DATA_SIZE)
+    return block_number * BLOCK_SIZE + block_pointer
+
+
+def _get_logical_data(data_view, start, end, blocked):
+    """
+    Get VBS data between logical offsets
+
+    :param data_view: memoryview of the file data
+    :param start: logical start offset
+    :param end: logical end offset
+    :param blocked: True if data is 1014 blocked, False if VBS format
+    :return: memoryview of the data when contiguous in the file,
+             otherwise bytes with the 1014 block markers removed
+    """
+    if not blocked:
+        return data_view[start:end]
+
+    start_block, start_pointer = divmod(start, BLOCK_DATA_SIZE)
+    end_block = (end - 1) // BLOCK_DATA_SIZE if end > start else start_block
+    physical_start = start_block * BLOCK_SIZE + start_pointer
+
+    if start_block == end_block:
+        return data_view[physical_start:physical_start + end - start]
+
+    # data spans block boundary, so join the pieces from each block
+    data_pieces = []
+    while start < end:
+        piece_length = min(BLOCK_DATA_SIZE - start_pointer, end - start)
+        data_pieces.append(
+            data_view[physical_start:physical_start + piece_length])
+        start += piece_length
+        physical_start += piece_length + BLOCK_SIZE - BLOCK_DATA_SIZE
+        start_pointer = 0
+    return _join_views(data_pieces)
+
+
+def _check_block_markers(data_view):
+    """
+    Warn once if any block of the data does not end with the 1014 block marker
+
+    :param data_view: memoryview of the file data
+    :return: None
+    """
+    for file_pointer in range(BLOCK_DATA_SIZE, len(data_view), BLOCK_SIZE):
+        block_marker = data_view[file_pointer:file_pointer + 2].tobytes()
+        if not _check_block_end(block_marker):
+            return
+
+
+def _check_block_marker(data_view):
+    """
+    Warn if the first block of the data does not end with the 1014 block marker
+
+    :param data_view: memoryview of the file data
+    :return: None
+    """
+    _check_block_end(data_view[BLOCK_DATA_SIZE:BLOCK_SIZE].tobytes())
+
+
+def _check_block_end(block_marker):
+    """
+    Warn if a block does not end with the 1014 block marker
+
+    :param block_marker: the last 2 bytes of the block, empty for data that
+        ends before the block marker
+    :return: True when the block marker is valid
+    """
+    if block_marker in (b(''), BLOCK_MARKER):
+        return True
+    LOGGER.warning("File may not be in 1014 blocked format - found unusual "
+                   "EOB marker %s, usually x'40'x'40'\n"
+                   "Consider using --no1014blocking option if file is VBS "
+                   "format", block_marker)
+    return False
+
+
 def block(unblocked_data):
     """
     Blocks a list of records to 1014 byte blocked VBS records
@@ -123,25 +586,135 @@ def block(unblocked_data):
     :return: string containing repeating binary length(4) + data records in a
         single string including 1014 block markers
     """
+    blocked_file = io.BytesIO()
+    with BlockedWriter(blocked_file) as writer:
+        writer.write_records(unblocked_data)
+    return blocked_file.getvalue()
+
+
+class VbsWriter(object):
+    """
+    Writes records to a binary file object in VBS format
+
+    Records are written to the file as they are given, so a file of any
+    size can be written without holding it in memory::
+
+        with open("ipm_file", "wb") as output_file:
+            with VbsWriter(output_file) as writer:
+                for record in records:
+                    writer.write_record(record)
 
-    unblocked_data = vbs_pack(unblocked_data)
+    :meth:`close` writes the zero length end record. It does not close the
+    file object. ``record_count`` and ``byte_count`` hold the number of
+    records and bytes written. When used as a context manager,
+    :meth:`close` is only called
+    if no exception was raised.
+    """
+    def __init__(self, output_file):
+        """
+        :param output_file: binary file object to write to
+        """
+        self.output_file = output_file
+        self.record_count = 0
+        self.byte_count = 0
+        self.closed = False
 
-    pad_char = b("\x40")
-    blocked_data = []
-    block_count = 0
+    def __enter__(self):
+        return self
 
-    while block_count <= len(unblocked_data):
-        blocked_data.append(unblocked_data[block_count:block_count+1012])
-        blocked_data.append(pad_char*2)
-        block_count += 1012
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
 
-    # add the pad characters
-    pad_count = block_count - len(unblocked_data)
-    print(str(pad_count) + " pad characters added")
-    blocked_data.append(pad_char * pad_count)
+    def write_record(self, record):
+        """
+        Write a record
 
-    # return blocked_data
-    return b("").join(blocked_data)
+        :param record: the record data
+        :return: None
+        """
+        if self.closed:
+            raise ValueError("write to closed writer")
+        self._write_data(struct.pack(">i", len(record)))
+        self._write_data(record)
+        self.record_count += 1
+
+    def write_records(self, records):
+        """
+        Write records
+
+        :param records: iterable of records
+        :return: None
+        """
+        for record in records:
+            self.write_record(record)
+
+    def close(self):
+        """
+        Write the end of file. Does not close the file object
+
+        :return: None
+        """
+        if self.closed:
+            return
+        self._write_data(struct.pack(">i", 0))
+        self.closed = True
+
+    def _write_data(self, data):
+        self.output_file.write(data)
+        self.byte_count += len(data)
+
+
+class BlockedWriter(VbsWriter):
+    """
+    Writes records to a binary file object in 1014 blocked format
+
+    Each 1014 byte block is written to the file when it is full, so at most
+    one block is held in memory. On close, the last block is filled with
+    x'40' characters. Use like :class:`VbsWriter`.
+    """
+    def __init__(self, output_file):
+        """
+        :param output_file: binary file object to write to
+        """
+        super(BlockedWriter, self).__init__(output_file)
+        self.block_data = bytearray()
+
+    def close(self):
+        """
+        Write the end of file and the last block. Does not close the file
+        object
+
+        :return: None
+        """
+        if self.closed:
+            return
+        super(BlockedWriter, self).close()
+
+        # add the pad characters
+        pad_count = BLOCK_DATA_SIZE - len(self.block_data)
+        LOGGER.debug("%s pad characters added", pad_count)
+        self.output_file.write(bytes(self.block_data) + BLOCK_MARKER
+                               + BLOCK_PAD_CHAR * pad_count)
+        self.byte_count += BLOCK_SIZE
+        self.block_data = bytearray()
+
+    def _write_data(self, data):
+        self.block_data += data
+        block_data_length = len(self.block_data)
+        if block_data_length < BLOCK_DATA_SIZE:
+            return
+
+        full_blocks_length = (block_data_length
+                              - block_data_length % BLOCK_DATA_SIZE)
+        blocks = []
+        for block_pointer in range(0, full_blocks_length, BLOCK_DATA_SIZE):
+            blocks.append(bytes(self.block_data[
+                block_pointer:block_pointer + BLOCK_DATA_SIZE]))
+            blocks.append(BLOCK_MARKER)
+        self.output_file.write(b("").join(blocks))
+        self.byte_count += full_blocks_length // BLOCK_DATA_SIZE * BLOCK_SIZE
+        del self.block_data[:full_blocks_length]
 
 
 def vbs_pack(records):
@@ -171,82 +744,362 @@ def vbs_pack(records):
     return b("").join(vbs_data)
 
 
-def flip_message_encoding(message, bit_config, source_format):
+class FieldSpec(object):
     """
-    Flip the encoding of an ISO8583 style file between ASCII and EBCDIC
+    Compiled configuration for a single data element
+
+    Holds everything needed to process the element so that parsing does not
+    need to look up and compare strings in the bit configuration dictionary.
+    """
+    __slots__ = ('bit', 'key', 'field_name', 'field_processor', 'length_size',
+                 'field_length', 'binary', 'masker', 'converter', 'processor')
+
+    def __init__(self, bit, bit_config):
+        self.bit = bit
+        self.key = "DE" + str(bit)
+        self.field_name = _set_parameter(bit_config, 'field_name')
+        self.field_processor = _set_parameter(bit_config, 'field_processor')
+        self.length_size = _get_field_length(bit_config)
+        self.field_length = bit_config['field_length']
+        # ICC data is binary so is never converted between encodings
+        self.binary = self.field_processor == 'ICC'
+        self.masker = _FIELD_MASKERS.get(self.field_processor)
+        self.converter = _TYPE_CONVERTERS.get(
+            _set_parameter(bit_config, 'python_field_type'))
+        self.processor = _FIELD_PROCESSORS.get(self.field_processor)
+
+    def __repr__(self):
+        return "FieldSpec({0}, {1!r})".format(self.bit, self.field_name)
+
+
+PlanCacheInfo = namedtuple('PlanCacheInfo', ['hits', 'misses', 'currsize'])
+
+# requested field keys and the processing mode for each of the 128 bits
+FieldSelection = namedtuple('FieldSelection', ['keys', 'modes'])
+
+
+class CompiledBitConfig(object):
+    """
+    Bit configuration compiled to a fixed table of :class:`FieldSpec`
+
+    Create using :func:`compile_bit_config`. ``fields[bit]`` holds the spec
+    for each bit or None when the bit is not configured.
+
+    Also caches a parse plan for each distinct bitmap seen, so records
+    sharing a bitmap do not decode the bitmap again.
+    """
+    __slots__ = ('fields', 'plans', 'binary_plans', 'selections',
+                 'plan_hits', 'plan_misses', 'binary_plan_hits',
+                 'binary_plan_misses')
+
+    # maximum number of bitmap plans to cache before starting again
+    max_plans = 1024
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.plans = {}
+        self.binary_plans = {}
+        self.selections = {}
+        self.plan_hits = 0
+        self.plan_misses = 0
+        self.binary_plan_hits = 0
+        self.binary_plan_misses = 0
+
+    def __contains__(self, bit):
+        return 0 <= bit < len(self.fields) and self.fields[bit] is not None
+
+    def get_plan(self, binary_bitmap, selection=None):
+        """
+        Get the field specs for the fields present in a bitmap
+
+        :param binary_bitmap: the 16 byte binary bitmap
+        :param selection: FieldSelection from :meth:`get_selection` or None
+        :return: tuple of FieldSpec in message order. When selection
+                 provided, tuple of (FieldSpec, field mode) in message order.
+        :raises KeyError: when a bit in the bitmap is not configured
+        """
+        if selection is None:
+            plan_key = binary_bitmap
+        else:
+            plan_key = (binary_bitmap, selection.keys)
+        plan = self.plans.get(plan_key)
+        if plan is not None:
+            self.plan_hits += 1
+            return plan
+
+        self.plan_misses += 1
+        plan = tuple(self._get_field_spec(bit)
+                     for bit in _get_bitmap_bits(binary_bitmap))
+        if selection is not None:
+            plan = tuple((field_spec, selection.modes[field_spec.bit])
+                         for field_spec in plan)
+        if len(self.plans) >= self.max_plans:
+            self.plans.clear()
+        self.plans[plan_key] = plan
+        return plan
+
+    def get_selection(self, fields):
+        """
+        Get the processing required for each bit to return the requested fields
+
+        :param fields: iterable of the keys to return, e.g. DE2, PDS0023 or
+            TAG9F26. Pass a frozenset to avoid building one each call.
+        :return: FieldSelection
+        """
+        keys = frozenset(fields)
+        selection = self.selections.get(keys)
+        if selection is None:
+            modes = tuple(
+                _SKIP_FIELD if field_spec is None
+                else _get_field_mode(field_spec, keys)
+                for field_spec in self.fields
+            )
+            selection = FieldSelection(keys, modes)
+            self.selections[keys] = selection
+        return selection
+
+    def get_binary_plan(self, binary_bitmap):
+        """
+        Get the field specs up to the last binary field present in a bitmap
+
+        These are the fields that need to be walked to find the binary
+        field data which must not be translated between encodings.
+
+        :param binary_bitmap: the 16 byte binary bitmap
+        :return: tuple of FieldSpec in message order, empty when there are
+                 no binary fields present
+        :raises KeyError: when a bit in the bitmap is not configured
+        """
+        binary_plan = self.binary_plans.get(binary_bitmap)
+        if binary_plan is not None:
+            self.binary_plan_hits += 1
+            return binary_plan
+
+        self.binary_plan_misses += 1
+        plan = self.get_plan(binary_bitmap)
+        binary_plan = ()
+        for plan_index, field_spec in enumerate(plan):
+            if field_spec.binary:
+                binary_plan = plan[:plan_index + 1]
+        if len(self.binary_plans) >= self.max_plans:
+            self.binary_plans.clear()
+        self.binary_plans[binary_bitmap] = binary_plan
+        return binary_plan
+
+    def plan_cache_info(self):
+        """
+        Get parse plan cache statistics
+
+        :return: PlanCacheInfo with hits, misses and currsize
+        """
+        return PlanCacheInfo(self.plan_hits, self.plan_misses, len(self.plans))
+
+    def binary_plan_cache_info(self):
+        """
+        Get binary plan cache statistics, see :meth:`get_binary_plan`
+
+        :return: PlanCacheInfo with hits, misses and currsize
+        """
+        return PlanCacheInfo(self.binary_plan_hits, self.binary_plan_misses,
+                             len(self.binary_plans))
+
+    def _get_field_spec(self, bit):
+        field_spec = self.fields[bit]
+        if field_spec is None:
+            raise KeyError(bit)
+        return field_spec
+
+
+def compile_bit_config(bit_config):
+    """
+    Compile bit configuration for use by the message functions
+
+    Compile the config once and pass the result to
+    :func:`get_message_elements` and :func:`flip_message_encoding`.
 
-    :param message: The data to be flipped
     :param bit_config: dictionary of bit mapping configuration
+    :return: CompiledBitConfig
+    """
+    if isinstance(bit_config, CompiledBitConfig):
+        return bit_config
+
+    fields = [None] * 128
+    for bit, field_config in bit_config.items():
+        fields[int(bit)] = FieldSpec(int(bit), field_config)
+    return CompiledBitConfig(tuple(fields))
+
+
+def _get_compiled_bit_config(bit_config):
+    """
+    Get compiled version of bit config, compiling dictionaries only once
+
+    :param bit_config: dictionary of bit mapping configuration or
+        CompiledBitConfig
+    :return: CompiledBitConfig
+    """
+    if isinstance(bit_config, CompiledBitConfig):
+        return bit_config
+
+    # keep a reference to the dictionary so that its id cannot be reused
+    cached_config = _COMPILED_BIT_CONFIGS.get(id(bit_config))
+    if cached_config is None or cached_config[0] is not bit_config:
+        if len(_COMPILED_BIT_CONFIGS) >= 16:
+            _COMPILED_BIT_CONFIGS.clear()
+        cached_config = (bit_config, compile_bit_config(bit_config))
+        _COMPILED_BIT_CONFIGS[id(bit_config)] = cached_config
+    return cached_config[1]
+
+
+def _get_field_mode(field_spec, keys):
+    """
+    Get the processing required for a field to return the requested keys
+
+    :param field_spec: FieldSpec of the field
+    :param keys: frozenset of keys requested
+    :return: _SKIP_FIELD when the field is not needed, _VALUE_FIELD when only
+             the field value is needed or _EXPAND_FIELD when the values it
+             breaks down into are also needed
+    """
+    subfield_prefixes = _FIELD_PROCESSOR_KEYS.get(field_spec.field_processor)
+    if subfield_prefixes and any(key.startswith(subfield_prefixes)
+                                 for key in keys):
+        return _EXPAND_FIELD
+    if field_spec.key in keys:
+        return _VALUE_FIELD
+    return _SKIP_FIELD
+
+
+def flip_message_encoding(message, bit_config, source_format, validate=False):
+    """
+    Flip the encoding of an ISO8583 style file between ASCII and EBCDIC
+
+    Only the message type, field length prefixes and non ICC field data
+    change encoding. By default the message is translated in bulk around
+    the bitmap and the ICC field data. When validate is set, each field is
+    converted separately and the fields must use all of the message data.
+
+    :param message: The data to be flipped. bytes or memoryview
+    :param bit_config: dictionary of bit mapping configuration or
+        CompiledBitConfig from :func:`compile_bit_config`
     :param source_format: The encoding of the source {ebcdic, ascii}
+    :param validate: check the message fields against the bitmap
     :return: message encoded
     """
-    message_length = len(message)-20
-    (message_type_indicator, binary_bitmap, message_data) \
-        = struct.unpack("4s16s" + str(message_length) + "s", message)
+    (message_type_indicator, binary_bitmap,
+     message_data) = _split_message(message)
+    bit_config = _get_compiled_bit_config(bit_config)
 
-    flipped_message = b("")
+    try:
+        if validate:
+            field_plan = bit_config.get_plan(binary_bitmap)
+        else:
+            field_plan = bit_config.get_binary_plan(binary_bitmap)
+    except KeyError as missing_bit:   # if config not available for bit
+        print("No config found for bit {0}".format(missing_bit))
+        raise Exception("Config missing for bit {0}".format(missing_bit))
+
+    if not validate:
+        return _flip_message_bulk(message_type_indicator, binary_bitmap,
+                                  message_data, field_plan, source_format)
 
     # add the message type
     if source_format == 'ebcdic':
-        flipped_message += _convert_text_eb2asc(message_type_indicator)
+        flipped_message = [_convert_text_eb2asc(message_type_indicator)]
     else:
-        flipped_message += _convert_text_asc2eb(message_type_indicator)
+        flipped_message = [_convert_text_asc2eb(message_type_indicator)]
 
     message_pointer = 0
-    bitmap_list = _get_bitmap_list(binary_bitmap)
 
     # add back the bitmap - no encoding
-    flipped_message += binary_bitmap
-
-    for bit in range(2, 128):   # cycle each bit
-        if bitmap_list[bit]:    # if bit is on for message
-            if bit in bit_config:   # if config available for bit
-                return_message, message_increment = \
-                    _flip_element_encoding(
-                        bit_config[bit],
-                        message_data[message_pointer:],
-                        source_format)
-            else:
-                print("No config found for bit {0}".format(bit))
-                raise Exception("Config missing for bit {0}".format(bit))
-
-            # Increment the message pointer and process next field
-            message_pointer += message_increment
-            flipped_message += return_message
+    flipped_message.append(binary_bitmap)
+
+    for field_spec in field_plan:   # cycle each bit on for message
+        # flip the field and get pointer to the next field
+        message_pointer = _flip_element_encoding(
+            field_spec, message_data, message_pointer, source_format,
+            flipped_message)
 
     # check that all of message has been consumed, otherwise raise exception
-    if message_pointer != len(message_data):
-        raise Exception(
-            "Message data not correct length. Bitmap indicates len={0}, message is len={1}\n{2}".format(
-                message_pointer,
-                len(message_data),
-                hexdump.hexdump(message_data, result="return")
-            )
-        )
-    return flipped_message
+    _check_message_consumed(message_data, message_pointer)
+
+    return b("").join(flipped_message)
 
 
-def _flip_element_encoding(bit_config, message_data, source_format):
+def _flip_message_bulk(message_type_indicator, binary_bitmap, message_data,
+                       binary_plan, source_format):
     """
-    Converts a field in an iso8583 style message from ascii to ebcdic
+    Flip the encoding of a message translating everything except binary data
 
-    :param bit_config: dict of field iso8583 bits mapping
-    :param message_data: the message containing the field
-    :param source_format: encoding of source -- ebcdic or ascii
-    :returns: converted string
-    :returns: pointer to next field in message
+    The fields in binary plan are walked only to find the binary (ICC)
+    field data. The data around them is translated in as few calls as
+    possible.
 
+    :param message_type_indicator: message type indicator
+    :param binary_bitmap: the binary bitmap, copied as is
+    :param message_data: memoryview of the message data after the bitmap
+    :param binary_plan: field specs up to the last binary field in message
+    :param source_format: The encoding of the source {ebcdic, ascii}
+    :return: message encoded
     """
+    if source_format == 'ebcdic':
+        translate_table = EBCDIC_TO_ASCII
+    else:
+        translate_table = ASCII_TO_EBCDIC
 
-    flipped_element = b("")
+    flipped_message = [message_type_indicator.translate(translate_table),
+                       binary_bitmap]
+    message_pointer = 0
+    translate_pointer = 0
+
+    for field_spec in binary_plan:
+        field_length = field_spec.field_length
+        length_size = field_spec.length_size
+
+        if length_size > 0:
+            field_length_string = message_data[
+                message_pointer:message_pointer+length_size].tobytes()
+            if source_format == 'ebcdic':
+                field_length_string = _convert_text_eb2asc(field_length_string)
+            field_length = int(field_length_string)
+            message_pointer += length_size
+
+        if field_spec.binary:
+            # translate data up to the field then add the field data as is
+            flipped_message.append(message_data[
+                translate_pointer:message_pointer].tobytes().translate(
+                    translate_table))
+            flipped_message.append(message_data[
+                message_pointer:message_pointer+field_length].tobytes())
+            translate_pointer = message_pointer + field_length
+
+        message_pointer += field_length
 
-    field_length = bit_config['field_length']
-    LOGGER.debug("processing field %s", bit_config["field_name"])
+    flipped_message.append(
+        message_data[translate_pointer:].tobytes().translate(translate_table))
 
-    length_size = _get_field_length(bit_config)
+    return b("").join(flipped_message)
+
+
+def _flip_element_encoding(field_spec, message_data, message_pointer,
+                           source_format, flipped_message):
+    """
+    Converts a field in an iso8583 style message from ascii to ebcdic
+
+    :param field_spec: FieldSpec of the field
+    :param message_data: memoryview of the message containing the field
+    :param message_pointer: offset of the field in message_data
+    :param source_format: encoding of source -- ebcdic or ascii
+    :param flipped_message: list the converted field parts are appended to
+    :returns: pointer to next field in message
+    """
+    field_length = field_spec.field_length
+    LOGGER.debug("processing field %s", field_spec.field_name)
+
+    length_size = field_spec.length_size
 
     if length_size > 0:
-        field_length_string = message_data[:length_size]
+        field_length_string = message_data[
+            message_pointer:message_pointer+length_size].tobytes()
         LOGGER.debug("field_length_string %s, %s", length_size, field_length_string)
         if source_format == 'ebcdic':
             field_length_string = _convert_text_eb2asc(field_length_string)
@@ -255,44 +1108,43 @@ def _flip_element_encoding(bit_config, message_data, source_format):
             field_length = int(field_length_string)
             field_length_string = _convert_text_asc2eb(field_length_string)
 
-        flipped_element += field_length_string
+        flipped_message.append(field_length_string)
+        message_pointer += length_size
 
-    field_data = message_data[length_size:length_size+field_length]
+    field_data = message_data[
+        message_pointer:message_pointer+field_length].tobytes()
 
-    field_processor = _set_parameter(bit_config,
-                                     'field_processor')
     # flip except for ICC field
-    if field_processor != 'ICC':
+    if not field_spec.binary:
         if source_format == 'ebcdic':
             converted_data = _convert_text_eb2asc(field_data)
         else:
             converted_data = _convert_text_asc2eb(field_data)
-        if len(field_data) != len(converted_data):
-            raise Exception(
-                "Conversion returned different lengths\n{0}\n{1}".format(
-                    hexdump.hexdump(field_data, result="return"),
-                    hexdump.hexdump(converted_data, result='return')
-                )
-            )
-        flipped_element += converted_data
+        flipped_message.append(converted_data)
     else:  # Add ICC data as is
-        flipped_element += field_data
+        flipped_message.append(field_data)
 
-    return flipped_element, field_length + length_size
+    return message_pointer + field_length
 
 
-def get_message_elements(message, bit_config, source_format):
+def get_message_elements(message, bit_config, source_format, fields=None,
+                         lazy=False):
     """
     Convert ISO8583 style message to dictionary
 
-    :param message: The message in ISO8583 based format
+    :param message: The message in ISO8583 based format. bytes or memoryview
 
     * Message Type indicator - 4 bytes
     * Binary bitmap - 16 bytes (Reads DE1 and DE2)
     * Message data - Remainder of record
 
-    :param bit_config: dictionary of bit mapping configuration
+    :param bit_config: dictionary of bit mapping configuration or
+        CompiledBitConfig from :func:`compile_bit_config`
     :param source_format: string indicating encoding of data (ascii|ebcdic)
+    :param fields: optional iterable of the keys to return. Fields not
+        requested are skipped without being decoded.
+    :param lazy: return a :class:`Message` that decodes each value when
+        first accessed. fields is ignored when lazy.
     :return: dictionary of message elements
 
     * key = 'MTI' message type indicator
@@ -301,112 +1153,329 @@ def get_message_elements(message, bit_config, source_format):
     * key = 'TAGxxxx' icc fields
 
     """
-    LOGGER.debug("Processing message: len=%s contents:\n%s", len(message), hexdump.hexdump(message, result="return"))
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("Processing message: len=%s contents:\n%s",
+                     len(message), hexdump.hexdump(
+                         memoryview(message).tobytes(), result="return"))
     # split raw message into components MessageType(4B), Bitmap(16B),
     # Message(l=*)
-    message_length = len(message)-20
-    (message_type_indicator, binary_bitmap, message_data) \
-        = struct.unpack("4s16s" + str(message_length) + "s", message)
+    (message_type_indicator, binary_bitmap,
+     message_data) = _split_message(message)
+    bit_config = _get_compiled_bit_config(bit_config)
+
+    if lazy:
+        return Message(message_type_indicator, message_data, source_format,
+                       _get_field_offsets(bit_config.get_plan(binary_bitmap),
+                                          message_data, source_format))
 
     return_values = dict()
 
-    # add the message type
-    if source_format == 'ebcdic':
-        return_values["MTI"] = _convert_text_eb2asc(message_type_indicator)
+    if fields is None:
+        keys = None
+        field_plan = ((field_spec, _EXPAND_FIELD)
+                      for field_spec in bit_config.get_plan(binary_bitmap))
     else:
-        return_values["MTI"] = message_type_indicator
+        selection = bit_config.get_selection(fields)
+        keys = selection.keys
+        field_plan = bit_config.get_plan(binary_bitmap, selection)
+
+    # add the message type
+    if keys is None or "MTI" in keys:
+        if source_format == 'ebcdic':
+            return_values["MTI"] = _convert_text_eb2asc(message_type_indicator)
+        else:
+            return_values["MTI"] = message_type_indicator
 
     message_pointer = 0
-    bitmap_list = _get_bitmap_list(binary_bitmap)
 
-    for bit in range(2, 128):
-        if bitmap_list[bit]:
-            LOGGER.debug("processing bit %s", bit)
-            return_message, message_increment = \
-                _process_element(bit,
-                                 bit_config[bit],
-                                 message_data[message_pointer:],
-                                 source_format)
+    for field_spec, field_mode in field_plan:
+        if field_mode == _SKIP_FIELD:
+            message_pointer = _skip_element(
+                field_spec, message_data, message_pointer, source_format)
+            continue
+        # add the field values and get pointer to the next field
+        message_pointer = _process_element(
+            field_spec, message_data, message_pointer, source_format,
+            return_values, field_mode, keys)
+
+    # check that all of message has been consumed, otherwise raise exception
+    _check_message_consumed(message_data, message_pointer)
+
+    return return_values
+
+
+class Message(object):
+    """
+    ISO8583 style message that decodes values when they are first accessed
+
+    Returned by :func:`get_message_elements` with ``lazy=True``. Only the
+    offsets of the fields are found when the message is created. Values
+    use the same keys as :func:`get_message_elements`::
+
+        message = get_message_elements(record, bit_config, 'ebcdic', lazy=True)
+        if message['MTI'] == b'1240':
+            print(message['DE2'], message.get('PDS0158'))
+    """
+    __slots__ = ('message_type_indicator', 'message_data', 'source_format',
+                 'field_offsets', 'values', 'expanded_fields')
+
+    def __init__(self, message_type_indicator, message_data, source_format,
+                 field_offsets):
+        """
+        :param message_type_indicator: raw message type indicator
+        :param message_data: memoryview of the message data after the bitmap
+        :param source_format: encoding of the data (ascii|ebcdic)
+        :param field_offsets: dictionary of DE key to tuple of FieldSpec,
+            start and end offset of field data in message_data
+        """
+        self.message_type_indicator = message_type_indicator
+        self.message_data = message_data
+        self.source_format = source_format
+        self.field_offsets = field_offsets
+        self.values = {}
+        self.expanded_fields = set()
+
+    def __getitem__(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+
+        if key == "MTI":
+            value = self.message_type_indicator
+            if self.source_format == 'ebcdic':
+                value = _convert_text_eb2asc(value)
+            self.values[key] = value
+            return value
+
+        if key in self.field_offsets:
+            return self._get_field_value(key)
+
+        # break down every field that can hold the value in message order, so
+        # a value in a later field replaces an earlier one as it does in
+        # get_message_elements, e.g. a PDS in both DE48 and DE62
+        for field_key in self._get_field_keys():
+            field_spec = self.field_offsets[field_key][0]
+            subfield_prefixes = _FIELD_PROCESSOR_KEYS.get(
+                field_spec.field_processor)
+            if (subfield_prefixes and key.startswith(subfield_prefixes)
+                    and field_key not in self.expanded_fields):
+                self.expanded_fields.add(field_key)
+                self.values.update(
+                    field_spec.processor(self._get_field_value(field_key)))
+
+        try:
+            return self.values[key]
+        except KeyError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        """
+        Get a message value
 
-            # Increment the message pointer and process next field
-            message_pointer += message_increment
-            return_values.update(return_message)
+        :param key: the value key, e.g. DE2, PDS0023 or TAG9F26
+        :param default: value returned when key not in message
+        :return: the value
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        """
+        Decode all message values
+
+        :return: dictionary of message elements, as returned by
+            :func:`get_message_elements`
+        """
+        return_values = {"MTI": self["MTI"]}
+        for field_key in self._get_field_keys():
+            field_spec = self.field_offsets[field_key][0]
+            return_values[field_key] = self._get_field_value(field_key)
+            if field_spec.processor is not None:
+                return_values.update(
+                    field_spec.processor(return_values[field_key]))
+        return return_values
+
+    def _get_field_keys(self):
+        """
+        Get the field keys in message order
+
+        :return: list of DE keys
+        """
+        return sorted(self.field_offsets,
+                      key=lambda field_key: self.field_offsets[field_key][1])
+
+    def _get_field_value(self, field_key):
+        try:
+            return self.values[field_key]
+        except KeyError:
+            pass
+        field_spec, field_start, field_end = self.field_offsets[field_key]
+        value = _decode_field(
+            field_spec, self.message_data[field_start:field_end].tobytes(),
+            self.source_format)
+        self.values[field_key] = value
+        return value
+
+
+def _get_field_offsets(field_plan, message_data, source_format):
+    """
+    Find the data of each field in a message without decoding it
+
+    :param field_plan: tuple of FieldSpec in message order
+    :param message_data: memoryview of the message data
+    :param source_format: EBCDIC or ASCII
+    :return: dictionary of DE key to tuple of FieldSpec, start and end
+             offset of the field data in message_data
+    """
+    field_offsets = {}
+    message_pointer = 0
+
+    for field_spec in field_plan:
+        field_end = _skip_element(
+            field_spec, message_data, message_pointer, source_format)
+        field_offsets[field_spec.key] = (
+            field_spec, message_pointer + field_spec.length_size, field_end)
+        message_pointer = field_end
 
     # check that all of message has been consumed, otherwise raise exception
+    _check_message_consumed(message_data, message_pointer)
+
+    return field_offsets
+
+
+def _check_message_consumed(message_data, message_pointer):
+    """
+    Check that the bitmap fields used all of the message data
+
+    :param message_data: memoryview of the message data
+    :param message_pointer: offset after the last field in message data
+    :return: None
+    :raises Exception: when message pointer is not at end of message data
+    """
     if message_pointer != len(message_data):
         raise Exception(
             "Message data not correct length. Bitmap indicates len={0}, message is len={1}\n{2}".format(
                 message_pointer,
                 len(message_data),
-                hexdump.hexdump(message_data, result="return")
+                hexdump.hexdump(message_data.tobytes(), result="return")
             )
         )
 
-    return return_values
+
+def _split_message(message):
+    """
+    Split raw message into components without copying the message data
+
+    :param message: The message in ISO8583 based format. bytes or memoryview
+    :return: tuple of message type indicator(4B), binary bitmap(16B) and
+             memoryview of the remaining message data
+    """
+    message = memoryview(message)
+    return message[:4].tobytes(), message[4:20].tobytes(), message[20:]
 
 
-def _process_element(bit, bit_config, message_data, source_format):
+def _process_element(field_spec, message_data, message_pointer, source_format,
+                     return_values, field_mode=_EXPAND_FIELD, keys=None):
     """
     Processes a message bit element
 
-    :param bit: DE bit
-    :param bit_config: message bit configuration
-    :param message_data: the data to be processed
+    :param field_spec: FieldSpec of the element
+    :param message_data: memoryview of the data to be processed
+    :param message_pointer: offset of the element in message_data
     :param source_format: EBCDIC or ASCII
-    :returns:
-        dictionary: field values
-        message incrementer: position of next message
+    :param return_values: dictionary the field values are added to
+    :param field_mode: _EXPAND_FIELD to also add the values a PDS, DE43 or
+        ICC field breaks down into, _VALUE_FIELD for the field value only
+    :param keys: frozenset of keys to add to return_values, None for all
+    :returns: pointer to next element in message
     """
 
-    field_length = bit_config['field_length']
+    field_length = field_spec.field_length
 
-    length_size = _get_field_length(bit_config)
+    length_size = field_spec.length_size
 
     if length_size > 0:
-        field_length_string = message_data[:length_size]
+        field_length_string = message_data[
+            message_pointer:message_pointer+length_size].tobytes()
         if source_format == 'ebcdic':
             field_length_string = _convert_text_eb2asc(field_length_string)
         field_length = int(field_length_string)
+        message_pointer += length_size
 
-    field_data = message_data[length_size:length_size+field_length]
+    field_data = _decode_field(
+        field_spec,
+        message_data[message_pointer:message_pointer+field_length].tobytes(),
+        source_format)
 
-    field_processor = _set_parameter(bit_config,
-                                     'field_processor')
+    # add value to return dictionary
+    if keys is None or field_spec.key in keys:
+        return_values[field_spec.key] = field_data
+
+    # if a PDS, DE43 or ICC field, break it down again and add to results
+    if field_spec.processor is not None and field_mode == _EXPAND_FIELD:
+        subfield_values = field_spec.processor(field_data)
+        if keys is None:
+            return_values.update(subfield_values)
+        else:
+            for key in keys.intersection(subfield_values):
+                return_values[key] = subfield_values[key]
 
-    # do ascii conversion except for ICC field
-    if field_processor != 'ICC':
-        if source_format == 'ebcdic':
-            field_data = _convert_text_eb2asc(field_data)
+    return message_pointer + field_length
 
-    # if field is PAN type, mask the card value
-    if field_processor == 'PAN':
-        field_data = _mask_pan(field_data)
+
+def _decode_field(field_spec, field_data, source_format):
+    """
+    Decode the raw data of a field
+
+    :param field_spec: FieldSpec of the field
+    :param field_data: raw field data
+    :param source_format: EBCDIC or ASCII
+    :return: field value
+    """
+    # do ascii conversion except for ICC field
+    if not field_spec.binary and source_format == 'ebcdic':
+        field_data = _convert_text_eb2asc(field_data)
 
     # if field is PAN type, mask the card value
-    if field_processor == 'PAN-PREFIX':
-        field_data = _mask_pan(field_data, prefix_only=True)
+    if field_spec.masker is not None:
+        field_data = field_spec.masker(field_data)
 
     # do field conversion to native python type
-    field_data = _convert_to_type(field_data, bit_config)
-
-    return_values = dict()
+    if field_spec.converter is not None:
+        field_data = field_spec.converter(field_data)
 
-    # add value to return dictionary
-    return_values["DE" + str(bit)] = field_data
+    return field_data
 
-    # if a PDS field, break it down again and add to results
-    if field_processor == 'PDS':
-        return_values.update(_get_pds_fields(field_data))
 
-    # if a DE43 field, break in down again and add to results
-    if field_processor == 'DE43':
-        return_values.update(_get_de43_fields(field_data))
+def _skip_element(field_spec, message_data, message_pointer, source_format):
+    """
+    Get the pointer to the next element without processing the element
 
-    # if ICC field, break into tags
-    if field_processor == 'ICC':
-        return_values.update(_get_icc_fields(field_data))
+    :param field_spec: FieldSpec of the element
+    :param message_data: memoryview of the message data
+    :param message_pointer: offset of the element in message_data
+    :param source_format: EBCDIC or ASCII
+    :returns: pointer to next element in message
+    """
+    length_size = field_spec.length_size
+    if length_size == 0:
+        return message_pointer + field_spec.field_length
 
-    return return_values, field_length + length_size
+    field_length_string = message_data[
+        message_pointer:message_pointer+length_size].tobytes()
+    if source_format == 'ebcdic':
+        field_length_string = _convert_text_eb2asc(field_length_string)
+    return message_pointer + length_size + int(field_length_string)
 
 
 def _set_parameter(config, parameter):
@@ -437,26 +1506,24 @@ def _mask_pan(field_data, prefix_only=False):
         return field_data[:6] + (b("*") * (len(field_data)-9)) + field_data[len(field_data)-3:len(field_data)]
 
 
-def _convert_to_type(field_data, bit_config):
+def _mask_pan_prefix(field_data):
     """
-    Field conversion to native python type
+    Mask a pan number string leaving only the prefix
 
-    :param field_data: Data to be converted
-    :param bit_config: Configuration for bit
-    :return: data in required type
+    :param field_data: unmasked pan
+    :return: masked pan
     """
-    field_python_type = _set_parameter(bit_config, 'python_field_type')
+    return _mask_pan(field_data, prefix_only=True)
 
-    if field_python_type == "int":
-        field_data = int(field_data)
-    if field_python_type == "decimal":
-        field_data = decimal.Decimal(field_data)
-    if field_python_type == "long":
-        field_data = int(field_data)
-    if field_python_type == "datetime":
-        field_data = datetime.datetime.strptime(
-            field_data, "%y%m%d%H%M%S")
-    return field_data
+
+def _convert_to_datetime(field_data):
+    """
+    Field conversion to datetime
+
+    :param field_data: Data to be converted in YYMMDDhhmmss format
+    :return: datetime
+    """
+    return datetime.datetime.strptime(field_data, "%y%m%d%H%M%S")
 
 
 def _get_field_length(bit_config):
@@ -480,45 +1547,47 @@ def _convert_text_eb2asc(value_to_convert):
     """
     Converts a string from ebcdic to ascii
 
-    :param value_to_convert: The ebcdic value to convert
+    :param value_to_convert: The ebcdic value to convert. bytes, bytearray
+        or memoryview
     :return: converted ascii text
     """
-
-    val = codecs.encode(codecs.decode(value_to_convert, "cp500"), "latin-1")
-    return val
+    if isinstance(value_to_convert, memoryview):
+        value_to_convert = value_to_convert.tobytes()
+    return value_to_convert.translate(EBCDIC_TO_ASCII)
 
 
 def _convert_text_asc2eb(value_to_convert):
     """
-    Converts a string from ebcdic to ascii
+    Converts a string from ascii to ebcdic
 
-    :param value_to_convert: The ascii value to convert
+    :param value_to_convert: The ascii value to convert. bytes, bytearray
+        or memoryview
     :return: converted ebcdic text
     """
+    if isinstance(value_to_convert, memoryview):
+        value_to_convert = value_to_convert.tobytes()
+    return value_to_convert.translate(ASCII_TO_EBCDIC)
 
-    return codecs.encode(codecs.decode(value_to_convert, "latin-1"), "cp500")
 
-
-def _get_bitmap_list(binary_bitmap):
-    """
-    Get list of bits from binary bitmap
-
-    :param binary_bitmap: the binary bitmap to be returned
-    :return: the list containing bit values. Bit 0 contains original binary
-             bitmap
+@lru_cache(maxsize=256)
+def _get_bitmap_bits(binary_bitmap):
     """
+    Get the data elements present in a binary bitmap
 
-    # working_bitmap_list = bitarray.bitarray(endian='big')
-    working_bitmap_list = BitArray(endian='big')
-    working_bitmap_list.frombytes(binary_bitmap)
+    Clearing files reuse a small number of distinct bitmaps so results are
+    cached on the raw bitmap bytes.
 
-    # Add bit 0 -> original binary bitmap
-    bitmap_list = [binary_bitmap]
-
-    # add bits from bitmap
-    bitmap_list.extend(working_bitmap_list.tolist())
-
-    return bitmap_list
+    :param binary_bitmap: the binary bitmap
+    :return: tuple of the data element numbers 2-127 present in bitmap in
+             ascending order. Bit 1 only flags the secondary bitmap.
+    """
+    return tuple(
+        bit for bit in (
+            byte_number * 8 + bit_offset
+            for byte_number, byte_value in enumerate(bytearray(binary_bitmap))
+            for bit_offset in _BYTE_BIT_OFFSETS[byte_value]
+        ) if 2 <= bit <= 127
+    )
 
 
 def _get_pds_fields(field_data):
@@ -532,20 +1601,22 @@ def _get_pds_fields(field_data):
 
     field_pointer = 0
     return_values = {}
+    debug = LOGGER.isEnabledFor(logging.DEBUG)
 
     while field_pointer < len(field_data):
         # get the pds tag id
         pds_field_tag = field_data[field_pointer:field_pointer+4]
-        LOGGER.debug("pds_field_tag=[%s]", pds_field_tag)
 
         # get the pds length
         pds_field_length = int(field_data[field_pointer+4:field_pointer+7])
-        LOGGER.debug("pds_field_length=[%i]", pds_field_length)
 
         # get the pds data
         pds_field_data = \
             field_data[field_pointer+7:field_pointer+7+pds_field_length]
-        LOGGER.debug("pds_field_data=[%s]", str(pds_field_data))
+        if debug:
+            LOGGER.debug("pds_field_tag=[%s], pds_field_length=[%i], "
+                         "pds_field_data=[%s]", pds_field_tag,
+                         pds_field_length, str(pds_field_data))
         return_values["PDS" + pds_field_tag.decode()] = pds_field_data
 
         # increment the fieldPointer
@@ -566,6 +1637,7 @@ def _get_icc_fields(field_data):
 
     field_pointer = 0
     return_values = {"ICC_DATA": binascii.b2a_hex(field_data)}
+    debug = LOGGER.isEnabledFor(logging.DEBUG)
 
     while field_pointer < len(field_data):
         # get the tag id (one byte)
@@ -578,20 +1650,19 @@ def _get_icc_fields(field_data):
             field_pointer += 1
 
         field_tag_display = binascii.b2a_hex(field_tag)
-        LOGGER.debug("field_tag_display=%s", field_tag_display)
         # stop processing de55 if low values tag found
         if field_tag_display == b('00'):
             break
         field_length_raw = field_data[field_pointer:field_pointer+1]
         field_length = struct.unpack(">B", field_length_raw)[0]
 
-        LOGGER.debug("%s", format(field_tag_display))
-        LOGGER.debug(field_length)
-
         # get the pds data
         de_field_data = field_data[field_pointer+1:field_pointer+field_length+1]
         de_field_data_display = binascii.b2a_hex(de_field_data)
-        LOGGER.debug("%s", de_field_data_display)
+        if debug:
+            LOGGER.debug(
+                "field_tag_display=%s, field_length=%s, field_data=%s",
+                field_tag_display, field_length, de_field_data_display)
         return_values["TAG" + field_tag_display.upper().decode()] = de_field_data_display
 
         # increment the fieldPointer
@@ -626,7 +1697,66 @@ def _get_de43_fields(de43_field):
     return field_dict
 
 
+# bit numbers (1 is the most significant bit) set in each possible byte value
+_BYTE_BIT_OFFSETS = tuple(
+    tuple(bit_offset + 1 for bit_offset in range(8)
+          if byte_value & (0x80 >> bit_offset))
+    for byte_value in range(256)
+)
+
+# field_processor values that mask the field value
+_FIELD_MASKERS = {
+    'PAN': _mask_pan,
+    'PAN-PREFIX': _mask_pan_prefix,
+}
+
+# field_processor values that break the field down into further values
+_FIELD_PROCESSORS = {
+    'PDS': _get_pds_fields,
+    'DE43': _get_de43_fields,
+    'ICC': _get_icc_fields,
+}
+
+# prefixes of the keys that each field_processor breaks a field down into
+_FIELD_PROCESSOR_KEYS = {
+    'PDS': ('PDS',),
+    'DE43': ('DE43_',),
+    'ICC': ('ICC_DATA', 'TAG'),
+}
+
+# python_field_type values and their conversion to native python type
+_TYPE_CONVERTERS = {
+    'int': int,
+    'long': int,
+    'decimal': decimal.Decimal,
+    'datetime': _convert_to_datetime,
+}
+
+# bit configs compiled by _get_compiled_bit_config keyed on dictionary id
+_COMPILED_BIT_CONFIGS = {}
+
+_COMPRESSION_MAGIC = (
+    (bytes(bytearray([0x1f, 0x8b])), "gzip"),
+    (bytes(bytearray([0x42, 0x5a, 0x68])), "bz2"),
+    (bytes(bytearray([0xfd, 0x37, 0x7a, 0x58, 0x5a, 0x00])), "xz"),
+)
+
+_COMPRESSION_SUFFIXES = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".xz": "xz",
+}
+
 if sys.version_info < (3,):
+    def _join_views(views):
+        """
+        Join memoryview objects into a byte string - Python 2.x
+
+        :param views: list of memoryview
+        :return: byte string
+        """
+        return b("").join(view.tobytes() for view in views)
+
     def b(string):
         """
         Create a byte string field - Python 2.x
@@ -636,6 +1766,15 @@ if sys.version_info < (3,):
         """
         return string
 else:
+    def _join_views(views):
+        """
+        Join memoryview objects into a byte string - Python 3.x
+
+        :param views: list of memoryview
+        :return: byte string
+        """
+        return b("").join(views)
+
     def b(string):
         """
         Create a byte string field - Python 3.x
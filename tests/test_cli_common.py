@@ -1,8 +1,32 @@
 from __future__ import absolute_import
 import unittest
 import os
+import pickle
+import shutil
+import sys
+import tempfile
 
-from mciutil.cli.common import get_config_filename
+from mciutil import __version__
+from mciutil.mciutil import CompiledBitConfig
+from mciutil.cli.common import (
+    get_config_filename, add_to_csv, get_output_filename, get_status_file,
+    load_config, get_config_cache_filename, expand_input_filenames,
+)
+
+CONFIG_TEXT = """
+output_data_elements:
+  - MTI
+  - {0}
+bit_config:
+  2:
+    field_name: PAN
+    field_type: LLVAR
+    field_length: 0
+"""
+
+
+def get_output_data_elements(config_filename):
+    return load_config(config_filename)["output_data_elements"]
 
 
 class CliCommonTests(unittest.TestCase):
@@ -20,5 +44,123 @@ class CliCommonTests(unittest.TestCase):
             print("Checking that config from site-packages")
             self.assertNotEqual(filename.find("site-packages"), -1)
 
+    def test_get_output_filename(self):
+        self.assertEqual(get_output_filename("in.ipm", ".out"), "in.ipm.out")
+        self.assertEqual(get_output_filename("in.ipm.gz", ".out"),
+                         "in.ipm.out.gz")
+        self.assertEqual(get_output_filename("-", ".out"), "-")
+
+    def test_get_status_file(self):
+        self.assertIs(get_status_file("out.csv"), sys.stdout)
+        self.assertIs(get_status_file("-"), sys.stderr)
+
+    def test_expand_input_filenames(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            filenames = [os.path.join(temp_dir, name)
+                         for name in ("b.ipm", "a.ipm", "c.txt")]
+            for filename in filenames:
+                open(filename, "w").close()
+            self.assertEqual(
+                expand_input_filenames(
+                    [filenames[2], os.path.join(temp_dir, "*.ipm"), "-"]),
+                [filenames[2], filenames[1], filenames[0], "-"])
+            self.assertEqual(
+                expand_input_filenames(
+                    [filenames[0], os.path.join(temp_dir, "*.ipm")]),
+                [filenames[0], filenames[1]])
+            missing_pattern = os.path.join(temp_dir, "*.csv")
+            self.assertEqual(expand_input_filenames([missing_pattern]),
+                             [missing_pattern])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_load_config(self):
+        """
+        config is cached until the config file changes
+        """
+        temp_dir = tempfile.mkdtemp()
+        xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = os.path.join(temp_dir, "cache")
+        try:
+            config_filename = os.path.join(temp_dir, "mideu.yml")
+            with open(config_filename, "w") as config_file:
+                config_file.write(CONFIG_TEXT.format("DE2"))
+
+            config = load_config(config_filename)
+            self.assertEqual(config["output_data_elements"], ["MTI", "DE2"])
+            self.assertTrue(
+                isinstance(config["bit_config"], CompiledBitConfig))
+            self.assertEqual(config["bit_config"].fields[2].field_name, "PAN")
+            self.assertTrue(
+                os.path.isfile(get_config_cache_filename(config_filename)))
+            self.assertEqual(get_output_data_elements(config_filename),
+                             ["MTI", "DE2"])
+
+            with open(config_filename, "w") as config_file:
+                config_file.write(CONFIG_TEXT.format("DE2, DE3"))
+            self.assertEqual(get_output_data_elements(config_filename),
+                             ["MTI", "DE2, DE3"])
+        finally:
+            if xdg_cache_home is None:
+                del os.environ["XDG_CACHE_HOME"]
+            else:
+                os.environ["XDG_CACHE_HOME"] = xdg_cache_home
+            shutil.rmtree(temp_dir)
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "needs file owners")
+    def test_load_config_shared_cache(self):
+        """
+        config cache is only read from a directory private to the user
+        """
+        temp_dir = tempfile.mkdtemp()
+        xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = os.path.join(temp_dir, "cache")
+        try:
+            config_filename = os.path.join(temp_dir, "mideu.yml")
+            with open(config_filename, "w") as config_file:
+                config_file.write(CONFIG_TEXT.format("DE2"))
+            load_config(config_filename)
+
+            cache_filename = get_config_cache_filename(config_filename)
+            with open(cache_filename, "rb") as cache_file:
+                cached_key, config = pickle.load(cache_file)
+            self.assertIn(__version__, cached_key)
+            config["output_data_elements"] = ["CACHED"]
+            with open(cache_filename, "wb") as cache_file:
+                pickle.dump((cached_key, config), cache_file)
+            self.assertEqual(get_output_data_elements(config_filename),
+                             ["CACHED"])
+
+            os.chmod(os.path.dirname(cache_filename), 0o777)
+            self.assertEqual(get_output_data_elements(config_filename),
+                             ["MTI", "DE2"])
+        finally:
+            if xdg_cache_home is None:
+                del os.environ["XDG_CACHE_HOME"]
+            else:
+                os.environ["XDG_CACHE_HOME"] = xdg_cache_home
+            shutil.rmtree(temp_dir)
+
+    def test_add_to_csv_generator(self):
+        """
+        rows are streamed from any iterable and the count written returned
+        """
+        file_handle, csv_filename = tempfile.mkstemp()
+        os.close(file_handle)
+        try:
+            row_count = add_to_csv(
+                ({"a": b"1", "b": "x" * item, "c": b"3"} for item in range(3)),
+                ["a", "b"],
+                csv_filename
+            )
+            with open(csv_filename, 'r') as csv_file:
+                csv_file_lines = csv_file.readlines()
+        finally:
+            os.remove(csv_filename)
+        self.assertEqual(row_count, 3)
+        self.assertEqual(csv_file_lines, ["a,b\n", "1,\n", "1,x\n", "1,xx\n"])
+
+
 if __name__ == '__main__':
     unittest.main()
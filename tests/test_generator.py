@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from unittest import TestCase
+import datetime
+import io
+
+import yaml
+
+import mciutil
+from mciutil.mciutil import b
+from mciutil.generator import (
+    build_message, build_pds, build_icc_data, iter_generated_records,
+    write_generated_file,
+)
+from mciutil.cli.common import get_config_filename
+
+with open(get_config_filename("mideu.yml")) as config_file:
+    BIT_CONFIG = mciutil.compile_bit_config(
+        yaml.safe_load(config_file)["bit_config"])
+
+FILE_DATE = datetime.date(2017, 3, 15)
+
+
+def generate_messages(record_count, encoding="ascii", seed=1):
+    return [
+        mciutil.get_message_elements(record, BIT_CONFIG, encoding)
+        for record in iter_generated_records(
+            record_count, BIT_CONFIG, encoding, seed=seed, file_date=FILE_DATE)
+    ]
+
+
+class TestGenerator(TestCase):
+    def test_file_messages(self):
+        messages = generate_messages(500)
+        self.assertEqual(len(messages), 502)
+        self.assertEqual(messages[0]["MTI"], b("1644"))
+        self.assertEqual(messages[0]["DE24"], b("697"))
+        self.assertEqual(messages[-1]["MTI"], b("1644"))
+        self.assertEqual(messages[-1]["DE24"], b("695"))
+        self.assertEqual(messages[-1]["PDS0306"], b("00000502"))
+        self.assertEqual(messages[0]["PDS0105"], messages[-1]["PDS0105"])
+        self.assertTrue(messages[0]["PDS0105"].startswith(b("002170315")))
+        self.assertEqual([int(message["DE71"]) for message in messages],
+                         list(range(1, 503)))
+        self.assertEqual(
+            sum(int(message["DE4"]) for message in messages[1:-1]),
+            int(messages[-1]["PDS0301"]))
+
+    def test_message_fields(self):
+        messages = generate_messages(500)[1:-1]
+        self.assertEqual(set(message["MTI"] for message in messages),
+                         set([b("1240"), b("1740")]))
+        self.assertTrue(any("TAG9F26" in message for message in messages))
+        self.assertTrue(any("DE55" not in message for message in messages))
+        retrieval_references = [
+            message["DE37"] for message in messages if "DE37" in message]
+        self.assertEqual(len(set(retrieval_references)),
+                         len(retrieval_references))
+        presentment = [
+            message for message in messages if message["MTI"] == b("1240")][0]
+        self.assertEqual(len(presentment["DE31"]), 23)
+        self.assertTrue(presentment["DE43_NAME"])
+        self.assertEqual(presentment["PDS0148"], b("0362"))
+
+    def test_message_mix(self):
+        messages = [
+            mciutil.get_message_elements(record, BIT_CONFIG, "ascii")
+            for record in iter_generated_records(
+                200, BIT_CONFIG, "ascii", seed=1, file_date=FILE_DATE,
+                fee_collection_ratio=0, icc_ratio=0, pds_count=20,
+                de62_pds_count=10)
+        ][1:-1]
+        self.assertEqual(set(message["MTI"] for message in messages),
+                         set([b("1240")]))
+        self.assertFalse(any("DE55" in message for message in messages))
+        for message in messages:
+            # 5 PDS always in DE48 plus the 20 added and 10 in DE62
+            self.assertEqual(
+                len([key for key in message if key.startswith("PDS")]), 35)
+            self.assertTrue(message["DE62"])
+
+    def test_same_seed(self):
+        self.assertEqual(generate_messages(100, seed=42),
+                         generate_messages(100, seed=42))
+        self.assertNotEqual(generate_messages(100, seed=42),
+                            generate_messages(100, seed=43))
+
+    def test_ebcdic(self):
+        ascii_records = list(iter_generated_records(
+            100, BIT_CONFIG, "ascii", seed=1, file_date=FILE_DATE))
+        ebcdic_records = list(iter_generated_records(
+            100, BIT_CONFIG, "ebcdic", seed=1, file_date=FILE_DATE))
+        for ascii_record, ebcdic_record in zip(ascii_records, ebcdic_records):
+            self.assertEqual(mciutil.flip_message_encoding(
+                ascii_record, BIT_CONFIG, "ascii"), ebcdic_record)
+
+    def test_write_generated_file(self):
+        for blocked in (True, False):
+            output_file = io.BytesIO()
+            writer = write_generated_file(
+                output_file, 1000, BIT_CONFIG, blocked=blocked, seed=1,
+                file_date=FILE_DATE)
+            self.assertEqual(writer.record_count, 1002)
+            self.assertEqual(writer.byte_count, len(output_file.getvalue()))
+            output_file.seek(0)
+            records = list(mciutil.iter_records(output_file, blocked))
+            self.assertEqual(len(records), 1002)
+
+    def test_build_message(self):
+        record = build_message({
+            "MTI": "1240",
+            "DE2": "5123456789012345",
+            "DE4": "000000001234",
+            "DE48": build_pds({"0165": "M", "0023": "POI"}),
+            "DE55": build_icc_data(
+                [("9F26", b("\x01\x02")), ("82", b("\x39\x00"))]),
+        }, BIT_CONFIG, "ascii")
+        message = mciutil.get_message_elements(record, BIT_CONFIG, "ascii")
+        self.assertEqual(message["DE4"], b("000000001234"))
+        self.assertEqual(message["DE48"], b("0023003POI0165001M"))
+        self.assertEqual(message["TAG9F26"], b("0102"))
+        self.assertEqual(message["TAG82"], b("3900"))
+
+    def test_build_message_bad_field(self):
+        self.assertRaises(ValueError, lambda: build_message(
+            {"MTI": "1240", "DE4": "1234"}, BIT_CONFIG))
+        self.assertRaises(ValueError, lambda: build_message(
+            {"MTI": "1240", "DE5": "1234"}, BIT_CONFIG))
+        self.assertRaises(ValueError, lambda: build_message(
+            {"MTI": "1240", "DE2": "1" * 100}, BIT_CONFIG))
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+
+import mciutil
+from mciutil.mciutil import b
+import mciutil.index
+from mciutil.index import (
+    iter_indexed_chunks, get_index_filename, write_index, open_indexed,
+    write_value_index, open_value_index,
+)
+
+VALUE_CONFIG = {
+    1: {'field_type': 'FIXED', 'field_name': 'Bitmap secondary',
+        'field_length': 8},
+    31: {'field_type': 'LLVAR', 'field_name': 'Acquirer reference data',
+         'field_length': 23},
+    37: {'field_type': 'FIXED', 'field_name': 'Retrieval reference number',
+         'field_length': 12},
+}
+
+
+def build_value_record(de31, de37):
+    """
+    Build an ascii 1240 record with DE31 and optionally DE37
+    """
+    bitmap = b("\x80\x00\x00\x02")
+    if de37 is not None:
+        bitmap += b("\x08")
+    bitmap = bitmap.ljust(16, b("\x00"))
+    record = b("1240") + bitmap + b("{0:02d}{1}".format(len(de31), de31))
+    if de37 is not None:
+        record += b(de37)
+    return record
+
+
+class TestIndex(TestCase):
+    def setUp(self):
+        self.records = [b("1234567890") * (x % 250 + 1) for x in range(500)]
+        self.temp_dir = tempfile.mkdtemp()
+        self.blocked_filename = os.path.join(self.temp_dir, "blocked")
+        self.vbs_filename = os.path.join(self.temp_dir, "vbs")
+        with open(self.blocked_filename, "wb") as blocked_file:
+            blocked_file.write(mciutil.block(self.records))
+        with open(self.vbs_filename, "wb") as vbs_file:
+            vbs_file.write(mciutil.vbs_pack(self.records))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_record(self):
+        for filename, blocked in ((self.blocked_filename, True),
+                                  (self.vbs_filename, False)):
+            self.assertEqual(write_index(filename, blocked=blocked), 500)
+            with open_indexed(filename) as indexed_file:
+                self.assertEqual(len(indexed_file), 500)
+                self.assertEqual(indexed_file.blocked, blocked)
+                self.assertEqual(indexed_file.record(0), self.records[0])
+                self.assertEqual(indexed_file.record(-1), self.records[-1])
+                self.assertEqual(list(indexed_file), self.records)
+                self.assertRaises(IndexError, lambda: indexed_file.record(500))
+
+    def test_physical_offsets(self):
+        write_index(self.blocked_filename)
+        with open(self.blocked_filename, "rb") as blocked_file:
+            blocked_data = blocked_file.read()
+        with open_indexed(self.blocked_filename) as indexed_file:
+            for record_number in range(len(indexed_file)):
+                physical_offset = indexed_file.record_span(record_number)[2]
+                record = self.records[record_number]
+                # first part of the record is at the physical offset
+                part_length = min(len(record), 1012 - physical_offset % 1014)
+                record_end = physical_offset + part_length
+                self.assertEqual(blocked_data[physical_offset:record_end],
+                                 record[:part_length])
+
+    def test_chunks(self):
+        write_index(self.blocked_filename)
+        with open_indexed(self.blocked_filename) as indexed_file:
+            chunks = list(indexed_file.chunks(150))
+        with open(self.blocked_filename, "rb") as blocked_file:
+            self.assertEqual(chunks, list(
+                mciutil.iter_record_chunks(blocked_file.read(), True, 150)))
+        self.assertEqual(
+            list(iter_indexed_chunks(self.blocked_filename, True, 150)),
+            chunks)
+
+    def test_empty_file(self):
+        empty_filename = os.path.join(self.temp_dir, "empty")
+        open(empty_filename, "wb").close()
+        self.assertEqual(write_index(empty_filename), 0)
+        with open_indexed(empty_filename) as indexed_file:
+            self.assertEqual(len(indexed_file), 0)
+
+    def test_index_does_not_match(self):
+        write_index(self.blocked_filename)
+        with open(self.blocked_filename, "ab") as blocked_file:
+            blocked_file.write(b("\x40") * 1014)
+        self.assertRaises(ValueError,
+                          lambda: open_indexed(self.blocked_filename))
+
+    def test_bad_index_file(self):
+        index_filename = get_index_filename(self.blocked_filename)
+        with open(index_filename, "wb") as index_file:
+            index_file.write(b("not an index file at all"))
+        self.assertRaises(ValueError,
+                          lambda: open_indexed(self.blocked_filename))
+
+
+class TestValueIndex(TestCase):
+    def setUp(self):
+        self.records = [
+            build_value_record("ARN{0:06d}".format(x % 97),
+                               None if x % 5 else "{0:012d}".format(x))
+            for x in range(1000)
+        ]
+        self.temp_dir = tempfile.mkdtemp()
+        self.blocked_filename = os.path.join(self.temp_dir, "blocked")
+        with open(self.blocked_filename, "wb") as blocked_file:
+            blocked_file.write(mciutil.block(self.records))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_find(self):
+        record_count = write_value_index(
+            self.blocked_filename, VALUE_CONFIG, ["DE31", "DE37"],
+            source_format="ascii")
+        self.assertEqual(record_count, 1000)
+
+        with open_value_index(self.blocked_filename, "DE31") as value_index:
+            self.assertEqual(len(value_index), 1000)
+            self.assertTrue(value_index.blocked)
+            self.assertEqual(value_index.source_format, "ascii")
+            found_records = value_index.find("ARN000042")
+            self.assertEqual(
+                [record_number for record_number, record in found_records],
+                list(range(42, 1000, 97)))
+            self.assertEqual(
+                [record for record_number, record in found_records],
+                [self.records[x] for x in range(42, 1000, 97)])
+            self.assertEqual(value_index.find(b("ARN00004")), [])
+            self.assertEqual(value_index.find("ARN0000420"), [])
+
+        with open_value_index(self.blocked_filename, "DE37") as value_index:
+            self.assertEqual(len(value_index), 200)
+            self.assertEqual(value_index.find("000000000995"),
+                             [(995, self.records[995])])
+            self.assertEqual(value_index.find("000000000996"), [])
+
+    def test_converted_field(self):
+        bit_config = dict(VALUE_CONFIG)
+        bit_config[37] = dict(VALUE_CONFIG[37], python_field_type="int")
+        self.assertRaises(ValueError, lambda: write_value_index(
+            self.blocked_filename, bit_config, ["DE37"],
+            source_format="ascii"))
+
+    def test_index_does_not_match(self):
+        write_value_index(
+            self.blocked_filename, VALUE_CONFIG, ["DE31"],
+            source_format="ascii")
+        with open(self.blocked_filename, "ab") as blocked_file:
+            blocked_file.write(b("\x40") * 1014)
+        self.assertRaises(ValueError, lambda: open_value_index(
+            self.blocked_filename, "DE31"))
+
+    def test_file_modified(self):
+        write_value_index(
+            self.blocked_filename, VALUE_CONFIG, ["DE31"],
+            source_format="ascii")
+        file_stat = os.stat(self.blocked_filename)
+        os.utime(self.blocked_filename,
+                 (file_stat.st_atime, file_stat.st_mtime + 10))
+        self.assertRaises(ValueError, lambda: open_value_index(
+            self.blocked_filename, "DE31"))
+
+    def test_sorted_runs(self):
+        run_size = mciutil.index.VALUE_INDEX_RUN_SIZE
+        mciutil.index.VALUE_INDEX_RUN_SIZE = 30
+        try:
+            write_value_index(
+                self.blocked_filename, VALUE_CONFIG, ["DE31"],
+                source_format="ascii")
+        finally:
+            mciutil.index.VALUE_INDEX_RUN_SIZE = run_size
+
+        with open_value_index(self.blocked_filename, "DE31") as value_index:
+            self.assertEqual(len(value_index), 1000)
+            self.assertEqual(
+                [record_number for record_number, record
+                 in value_index.find("ARN000042")],
+                list(range(42, 1000, 97)))
+            self.assertEqual(
+                [record_number for record_number, record
+                 in value_index.find("ARN000096")],
+                list(range(96, 1000, 97)))
@@ -3,14 +3,23 @@
 from __future__ import absolute_import
 from unittest import TestCase
 import binascii
+import codecs
+import io
+import os
+import random
+import shutil
+import tempfile
 import hexdump
+import yaml
 
 # Public import
 import mciutil
 
 # Private functions
 from mciutil.mciutil import (
-    _convert_text_asc2eb, _get_de43_fields, _mask_pan, b, flip_message_encoding, _get_icc_fields
+    _convert_text_asc2eb, _get_de43_fields, _mask_pan, b,
+    flip_message_encoding, _get_icc_fields, _get_bitmap_bits,
+    _convert_text_eb2asc
 )
 
 CONFIG = {
@@ -96,6 +105,12 @@ class TestGetMessageElements(TestCase):
         self.assertEqual(message_elements["DE4"], b"000000009999")
         self.assertEqual(message_elements["PDS0001"], b"Y")
 
+        # memoryview records give the same result
+        self.assertEqual(
+            mciutil.get_message_elements(
+                memoryview(message_raw), CONFIG['data_elements'], 'ascii'),
+            message_elements)
+
     def test_get_message_elements_ebcdic(self):
         message_raw = (
             _convert_text_asc2eb(b("1144")) +
@@ -164,6 +179,40 @@ class TestGetMessageElements(TestCase):
         print(records[0])
         print(records[72])
 
+    def test_unblock_spanning_records(self):
+        # record lengths and record data both span block boundaries
+        records = [b("1234567890") * (x % 250 + 1) for x in range(500)]
+        records.append(b("x") * 5000)
+        self.assertEqual(mciutil.unblock(mciutil.block(records)), records)
+        for length_offset in range(1006, 1012):
+            records = [b("A") * (length_offset - 4), b("B") * 20]
+            self.assertEqual(mciutil.unblock(mciutil.block(records)), records)
+
+    def test_unblock_marker_warning(self):
+        blocked_data = bytearray(mciutil.block([b("1234567890") * 300]))
+        blocked_data[1014 + 1012] = 0x00
+        with self.assertLogs("mciutil.mciutil", "WARNING"):
+            records = mciutil.unblock(bytes(blocked_data))
+        self.assertEqual(records, [b("1234567890") * 300])
+
+    def test_iter_records_marker_warning(self):
+        blocked_data = bytearray(mciutil.block([b("1234567890") * 300]))
+        blocked_data[1012] = 0x00
+        blocked_data[1014 + 1012] = 0x00
+        with self.assertLogs("mciutil.mciutil", "WARNING") as logs:
+            records = list(
+                mciutil.iter_records(io.BytesIO(bytes(blocked_data))))
+        self.assertEqual(records, [b("1234567890") * 300])
+        # warned once for the file
+        self.assertEqual(len(logs.records), 1)
+
+    def test_unblock_truncated(self):
+        records = [b("1234567890") * 300, b("1234567890")]
+        blocked_data = mciutil.block(records)[:1014 * 2 + 500]
+        # the record is cut short like vbs_unpack
+        self.assertEqual(mciutil.unblock(blocked_data),
+                         [records[0][:1012 * 2 + 500 - 4]])
+
     def test_block(self):
         linebreakdata = []
         for x in range(0, 73):
@@ -174,6 +223,156 @@ class TestGetMessageElements(TestCase):
         print(len(input))
         print(input)
 
+    def test_iter_records_blocked(self):
+        records = [b("1234567890") * (x % 250 + 1) for x in range(500)]
+        blocked_file = io.BytesIO(mciutil.block(records))
+        self.assertEqual(list(mciutil.iter_records(blocked_file)), records)
+
+    def test_iter_records_vbs(self):
+        records = [b("1234567890") * (x % 250 + 1) for x in range(500)]
+        vbs_file = io.BytesIO(mciutil.vbs_pack(records))
+        self.assertEqual(
+            list(mciutil.iter_records(vbs_file, blocked=False)), records)
+
+    def test_iter_records_matches_unblock(self):
+        umodedata = ((b("\x00\x00\x00\x0A1234567890") * 72) +
+                     b("\x00\x00\x00\x0A\x40\x401234567890"))
+        records = list(mciutil.iter_records(io.BytesIO(umodedata)))
+        self.assertEqual(records, mciutil.unblock(umodedata))
+
+    def test_iter_records_short_reads(self):
+        """
+        streams such as pipes may return less data than requested
+        """
+        class ShortReadFile(io.BytesIO):
+            def read(self, size=-1):
+                return io.BytesIO.read(self, min(size, 100))
+
+        records = [b("1234567890") * (x % 250 + 1) for x in range(100)]
+        blocked_file = ShortReadFile(mciutil.block(records))
+        self.assertEqual(list(mciutil.iter_records(blocked_file)), records)
+
+    def test_iter_record_views(self):
+        records = [b("1234567890") * (x % 250 + 1) for x in range(500)]
+        for blocked, packer in ((True, mciutil.block),
+                                (False, mciutil.vbs_pack)):
+            views = list(
+                mciutil.iter_record_views(packer(records), blocked=blocked))
+            self.assertEqual([bytes(view) for view in views], records)
+
+    def test_iter_record_views_no_copy(self):
+        vbs_data = mciutil.vbs_pack([b("1234567890"), b("ABCDEFGHIJ")])
+        views = list(mciutil.iter_record_views(vbs_data, blocked=False))
+        self.assertTrue(all(isinstance(view, memoryview) for view in views))
+        self.assertEqual(views[1].tobytes(), b("ABCDEFGHIJ"))
+
+    def test_blocked_writer(self):
+        for record_count in (0, 1, 252, 253, 500):
+            records = [b("1234567890") * (x % 250 + 1)
+                       for x in range(record_count)]
+            output_file = io.BytesIO()
+            with mciutil.BlockedWriter(output_file) as writer:
+                for record in records:
+                    writer.write_record(record)
+                    # only full blocks are written to the file
+                    self.assertEqual(len(output_file.getvalue()) % 1014, 0)
+            self.assertFalse(output_file.closed)
+            self.assertEqual(writer.record_count, record_count)
+            self.assertEqual(writer.byte_count, len(output_file.getvalue()))
+            self.assertEqual(output_file.getvalue(), mciutil.block(records))
+            self.assertEqual(mciutil.unblock(output_file.getvalue()), records)
+
+    def test_blocked_writer_full_last_block(self):
+        # record length and end record fill the block exactly
+        output_file = io.BytesIO()
+        with mciutil.BlockedWriter(output_file) as writer:
+            writer.write_record(b("x") * 1004)
+        self.assertEqual(output_file.getvalue()[1014:], b("\x40") * 1014)
+
+    def test_vbs_writer(self):
+        records = [b("1234567890") * (x % 250 + 1) for x in range(500)]
+        output_file = io.BytesIO()
+        writer = mciutil.VbsWriter(output_file)
+        writer.write_records(records)
+        writer.close()
+        writer.close()
+        self.assertEqual(output_file.getvalue(), mciutil.vbs_pack(records))
+        self.assertEqual(writer.byte_count, len(output_file.getvalue()))
+        self.assertRaises(ValueError, lambda: writer.write_record(b("1234")))
+
+    def test_writer_exception(self):
+        output_file = io.BytesIO()
+        try:
+            with mciutil.VbsWriter(output_file) as writer:
+                writer.write_record(b("1234"))
+                raise KeyError("stop")
+        except KeyError:
+            pass
+        # end record not written
+        self.assertEqual(output_file.getvalue(), b("\x00\x00\x00\x041234"))
+
+    def test_open_ipm_compressed(self):
+        records = [b("1234567890") * (x % 250 + 1) for x in range(500)]
+        temp_dir = tempfile.mkdtemp()
+        try:
+            for suffix, compression in (("", None), (".gz", "gzip"),
+                                        (".bz2", "bz2"), (".xz", "xz")):
+                file_name = os.path.join(temp_dir, "ipm" + suffix)
+                with mciutil.open_ipm(file_name, "wb") as output_file:
+                    with mciutil.BlockedWriter(output_file) as writer:
+                        writer.write_records(records)
+                self.assertEqual(mciutil.get_compression(file_name),
+                                 compression)
+                # compression found from the file data, not the name
+                os.rename(file_name, file_name + ".ipm")
+                with mciutil.open_ipm(file_name + ".ipm") as input_file:
+                    self.assertEqual(input_file.read(), mciutil.block(records))
+                with mciutil.open_ipm(file_name + ".ipm") as input_file:
+                    self.assertEqual(
+                        list(mciutil.iter_records(input_file)), records)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_iter_record_chunks(self):
+        records = [b("1234567890") * (x % 250 + 1) for x in range(500)]
+        for blocked, packer in ((True, mciutil.block),
+                                (False, mciutil.vbs_pack)):
+            data = packer(records)
+            chunks = list(
+                mciutil.iter_record_chunks(data, blocked, chunk_size=150))
+            self.assertEqual([count for start, count in chunks],
+                             [150, 150, 150, 50])
+            chunk_records = [
+                bytes(view) for start, count in chunks
+                for view in mciutil.iter_record_views(
+                    data, blocked, start, count)
+            ]
+            self.assertEqual(chunk_records, records)
+
+    def test_iter_mapped_records(self):
+        records = [b("1234567890") * (x % 250 + 1) for x in range(500)]
+        file_handle, file_name = tempfile.mkstemp()
+        try:
+            with os.fdopen(file_handle, 'wb') as output_file:
+                output_file.write(mciutil.block(records))
+            with open(file_name, 'rb') as input_file:
+                mapped_records = [
+                    bytes(record)
+                    for record in mciutil.iter_mapped_records(input_file)]
+        finally:
+            os.remove(file_name)
+        self.assertEqual(mapped_records, records)
+
+    def test_iter_mapped_records_empty_file(self):
+        file_handle, file_name = tempfile.mkstemp()
+        try:
+            os.close(file_handle)
+            with open(file_name, 'rb') as input_file:
+                self.assertEqual(
+                    list(mciutil.iter_mapped_records(input_file)), [])
+        finally:
+            os.remove(file_name)
+
     def test_mask_pan(self):
         card_number = b("1234567890123456")
         self.assertEqual(_mask_pan(card_number), b"123456*******456")
@@ -203,6 +402,283 @@ class TestGetMessageElements(TestCase):
         hexdump.hexdump(message_elements)
         print("********************************************")
         self.assertEqual(message_raw, message_elements)
+        self.assertEqual(
+            flip_message_encoding(
+                memoryview(message_raw), CONFIG['data_elements'], 'ascii'),
+            flip_message_encoding(
+                message_raw, CONFIG['data_elements'], 'ascii'))
+
+
+class TestCompileBitConfig(TestCase):
+
+    message_raw = b(
+        "1144\xF0\x10\x05\x42\x84\x61\x80\x02\x02\x00\x00\x04"
+        "\x00\x00\x00\x00" +
+        "1644445555444455551111110000000099992015081517151234"
+        "5678901233312342357995799120000001230612061234561234"
+        "5657994211111111145BIG BOBS\\70 FERNDALE ST\\ANNERLE"
+        "Y\\4103  QLDAUS0080001001Y99901600000000000000011234"
+        "567806999999"
+    )
+
+    def test_compile_bit_config(self):
+        bit_config = mciutil.compile_bit_config(CONFIG['data_elements'])
+        self.assertEqual(len(bit_config.fields), 128)
+        self.assertTrue(2 in bit_config)
+        self.assertFalse(5 in bit_config)
+        self.assertIsNone(bit_config.fields[5])
+        self.assertEqual(bit_config.fields[2].key, "DE2")
+        self.assertEqual(bit_config.fields[2].length_size, 2)
+        self.assertEqual(bit_config.fields[48].length_size, 3)
+        self.assertEqual(bit_config.fields[3].field_length, 6)
+        self.assertTrue(bit_config.fields[55].binary)
+        self.assertEqual(bit_config.fields[2].masker(b("1234567890123456")),
+                         b("123456*******456"))
+        self.assertIsNone(bit_config.fields[3].converter)
+        self.assertIs(mciutil.compile_bit_config(bit_config), bit_config)
+
+    def test_compiled_config_same_result(self):
+        data_elements = CONFIG['data_elements']
+        bit_config = mciutil.compile_bit_config(data_elements)
+        for source_format in ('ascii', 'ebcdic'):
+            message = self.message_raw
+            if source_format == 'ebcdic':
+                message = flip_message_encoding(
+                    message, data_elements, 'ascii')
+            self.assertEqual(
+                mciutil.get_message_elements(
+                    message, bit_config, source_format),
+                mciutil.get_message_elements(
+                    message, data_elements, source_format))
+            self.assertEqual(
+                flip_message_encoding(message, bit_config, source_format),
+                flip_message_encoding(message, data_elements, source_format))
+
+    def test_python_field_type(self):
+        bit_config = mciutil.compile_bit_config({4: {
+            'field_type': 'FIXED',
+            'field_length': 12,
+            'python_field_type': 'long'}})
+        self.assertEqual(
+            bit_config.fields[4].converter(b("000000009999")), 9999)
+
+    def test_plan_cache(self):
+        bit_config = mciutil.compile_bit_config(CONFIG['data_elements'])
+        self.assertEqual(bit_config.plan_cache_info(), (0, 0, 0))
+        for _ in range(3):
+            mciutil.get_message_elements(self.message_raw, bit_config, 'ascii')
+        flip_message_encoding(self.message_raw, bit_config, 'ascii')
+        self.assertEqual(bit_config.plan_cache_info(), (3, 1, 1))
+        self.assertEqual(bit_config.binary_plan_cache_info(), (0, 1, 1))
+        flip_message_encoding(self.message_raw, bit_config, 'ascii')
+        self.assertEqual(bit_config.plan_cache_info(), (3, 1, 1))
+        self.assertEqual(bit_config.binary_plan_cache_info(), (1, 1, 1))
+        plan = bit_config.get_plan(self.message_raw[4:20])
+        self.assertEqual([field_spec.bit for field_spec in plan],
+                         [2, 3, 4, 12, 22, 24, 26, 31, 33, 38, 42, 43, 48,
+                          49, 63, 71, 94])
+
+    def test_selected_fields(self):
+        bit_config = mciutil.compile_bit_config(CONFIG['data_elements'])
+        all_elements = mciutil.get_message_elements(
+            self.message_raw, bit_config, 'ascii')
+        for fields in (['DE2', 'DE4'], ['MTI', 'PDS0001', 'DE43_NAME'],
+                       ['DE48', 'DE63', 'DE999'], []):
+            message_elements = mciutil.get_message_elements(
+                self.message_raw, bit_config, 'ascii', fields=fields)
+            self.assertEqual(message_elements,
+                             dict((key, all_elements[key]) for key in fields
+                                  if key in all_elements))
+
+    def test_selected_fields_modes(self):
+        bit_config = mciutil.compile_bit_config(CONFIG['data_elements'])
+        selection = bit_config.get_selection(['DE48', 'DE55', 'TAG9F26'])
+        self.assertEqual(selection.modes[2], mciutil.mciutil._SKIP_FIELD)
+        self.assertEqual(selection.modes[48], mciutil.mciutil._VALUE_FIELD)
+        self.assertEqual(selection.modes[55], mciutil.mciutil._EXPAND_FIELD)
+        self.assertIs(bit_config.get_selection(
+            frozenset(['DE48', 'DE55', 'TAG9F26'])), selection)
+
+    def test_selected_fields_bad_length(self):
+        bit_config = mciutil.compile_bit_config(CONFIG['data_elements'])
+        self.assertRaises(Exception, lambda: mciutil.get_message_elements(
+            self.message_raw + b("^"), bit_config, 'ascii', fields=['DE2']))
+
+    def test_missing_config(self):
+        bit_config = mciutil.compile_bit_config(
+            {2: CONFIG['data_elements'][2]})
+        self.assertRaises(KeyError, lambda: mciutil.get_message_elements(
+            self.message_raw, bit_config, 'ascii'))
+        self.assertRaises(Exception, lambda: flip_message_encoding(
+            self.message_raw, bit_config, 'ascii'))
+
+
+class TestLazyMessage(TestCase):
+
+    message_raw = TestCompileBitConfig.message_raw
+
+    def test_lazy_values(self):
+        message = mciutil.get_message_elements(
+            self.message_raw, CONFIG['data_elements'], 'ascii', lazy=True)
+        self.assertTrue(isinstance(message, mciutil.Message))
+        self.assertEqual(message.values, {})
+        self.assertEqual(message["DE3"], b"111111")
+        self.assertEqual(message.values, {"DE3": b"111111"})
+        self.assertEqual(message["DE2"], b"444455*******555")
+        self.assertEqual(message["PDS0001"], b"Y")
+        self.assertEqual(message["DE43_NAME"], b"BIG BOBS")
+        self.assertEqual(message["MTI"], b"1144")
+        self.assertRaises(KeyError, lambda: message["DE5"])
+        self.assertRaises(KeyError, lambda: message["PDS9999"])
+        self.assertEqual(message.get("DE5", b"-"), b"-")
+        self.assertTrue("DE4" in message)
+        self.assertFalse("TAG9F26" in message)
+
+    def test_lazy_same_as_eager(self):
+        data_elements = CONFIG['data_elements']
+        ebcdic_message = flip_message_encoding(
+            self.message_raw, data_elements, 'ascii')
+        for message_raw, source_format in ((self.message_raw, 'ascii'),
+                                           (ebcdic_message, 'ebcdic')):
+            message = mciutil.get_message_elements(
+                message_raw, data_elements, source_format, lazy=True)
+            self.assertEqual(message.to_dict(), mciutil.get_message_elements(
+                message_raw, data_elements, source_format))
+
+    def test_lazy_pds_in_two_fields(self):
+        pds_config = {'field_type': 'LLLVAR', 'field_length': 999,
+                      'field_processor': 'PDS'}
+        bit_config = {
+            1: {'field_type': 'FIXED', 'field_length': 8},
+            48: pds_config,
+            62: pds_config,
+        }
+        # bits 1, 48 and 62
+        bitmap = binascii.unhexlify(
+            "{0:032x}".format((1 << 127) | (1 << 80) | (1 << 66)))
+        message_raw = (b("1240") + bitmap
+                       + b("0180023003POI0165001M0100023003ABC"))
+        eager_message = mciutil.get_message_elements(
+            message_raw, bit_config, 'ascii')
+        self.assertEqual(eager_message["PDS0023"], b("ABC"))
+        message = mciutil.get_message_elements(
+            message_raw, bit_config, 'ascii', lazy=True)
+        self.assertEqual(message["PDS0023"], b("ABC"))
+        self.assertEqual(message["PDS0165"], b("M"))
+        self.assertEqual(message.to_dict(), eager_message)
+
+    def test_lazy_bad_length(self):
+        self.assertRaises(Exception, lambda: mciutil.get_message_elements(
+            self.message_raw + b("^"), CONFIG['data_elements'], 'ascii',
+            lazy=True))
+
+
+class TestBitmap(TestCase):
+
+    def test_get_bitmap_bits(self):
+        self.assertEqual(
+            _get_bitmap_bits(b("\xF0\x10\x05\x42\x84\x61\x80\x02"
+                               "\x02\x00\x00\x04\x00\x00\x00\x00")),
+            (2, 3, 4, 12, 22, 24, 26, 31, 33, 38, 42, 43, 48, 49, 63, 71, 94))
+
+    def test_get_bitmap_bits_random(self):
+        rng = random.Random(1014)
+        for _ in range(500):
+            bitmap = rng.getrandbits(128)
+            binary_bitmap = binascii.unhexlify("{0:032x}".format(bitmap))
+            expected_bits = tuple(bit for bit in range(2, 128)
+                                  if bitmap >> (128 - bit) & 1)
+            self.assertEqual(_get_bitmap_bits(binary_bitmap), expected_bits)
+
+
+class TestConvertText(TestCase):
+
+    all_bytes = bytes(bytearray(range(256)))
+
+    def test_eb2asc_all_bytes(self):
+        expected = codecs.encode(
+            codecs.decode(self.all_bytes, "cp500"), "latin-1")
+        self.assertEqual(_convert_text_eb2asc(self.all_bytes), expected)
+        self.assertEqual(
+            _convert_text_eb2asc(memoryview(self.all_bytes)), expected)
+        self.assertEqual(_convert_text_eb2asc(bytearray(self.all_bytes)),
+                         bytearray(expected))
+
+    def test_asc2eb_all_bytes(self):
+        expected = codecs.encode(
+            codecs.decode(self.all_bytes, "latin-1"), "cp500")
+        self.assertEqual(_convert_text_asc2eb(self.all_bytes), expected)
+        self.assertEqual(
+            _convert_text_asc2eb(memoryview(self.all_bytes)), expected)
+        self.assertEqual(_convert_text_asc2eb(bytearray(self.all_bytes)),
+                         bytearray(expected))
+
+    def test_round_trip(self):
+        self.assertEqual(
+            _convert_text_eb2asc(_convert_text_asc2eb(self.all_bytes)),
+            self.all_bytes)
+
+
+class TestFlipMessageBulk(TestCase):
+
+    message_raw = b(
+        "1240" + "\xf0"
+        "\x10\x07\xc2\x8d\xe1\x82\x02\x02\x00\x00\x04\x00\x00\x00\x00" + "1"
+        "65204230010000012000000000000063"
+        "20015102901120601010109014C00120"
+        "01401599423752309053030010113511"
+        "09110000000988503314801120609054"
+        "9120000000290000010364     65MER"
+        "CH TERMINAL SETT1\\152 Edward Str"
+        "eetq\\BRISBANE\\4000      QLDAUS04"
+        "80023003NA 014800403620158012   "
+        "       750165001M036052"
+        "\x9f\x26\x08\x3e\x24\x24\xed\xa3\x69"
+        "\xaa\x47\x9f\x36\x02\x04\xdd\x82\x02\x20\x00\x9f\x02\x06\x00\x00"
+        "\x00\x00\x14\x50\x9f\x03\x06\x00\x00\x00\x00\x00\x00\x9f\x27\x01"
+        "\x80\x9f\x34\x03\x1f\x00\x00\x9f\x53\x01\xb5"
+        "016 M"
+        "DP388S6Q1015  000000921100000009"
+        "885"
+    )
+
+    def setUp(self):
+        config_filename = os.path.join(
+            os.path.dirname(mciutil.__file__), "cli", "mideu.yml")
+        with open(config_filename) as config_file:
+            self.bit_config = mciutil.compile_bit_config(
+                yaml.safe_load(config_file)["bit_config"])
+
+    def test_bulk_same_as_validate(self):
+        ebcdic_message = flip_message_encoding(
+            self.message_raw, self.bit_config, 'ascii', validate=True)
+        self.assertEqual(flip_message_encoding(
+            self.message_raw, self.bit_config, 'ascii'), ebcdic_message)
+        self.assertEqual(flip_message_encoding(
+            ebcdic_message, self.bit_config, 'ebcdic'), self.message_raw)
+        self.assertEqual(flip_message_encoding(
+            ebcdic_message, self.bit_config, 'ebcdic', validate=True),
+            self.message_raw)
+
+    def test_bulk_keeps_icc_data(self):
+        ebcdic_message = flip_message_encoding(
+            self.message_raw, self.bit_config, 'ascii')
+        icc_data = b("\x9f\x26\x08\x3e\x24\x24\xed\xa3\x69\xaa\x47")
+        self.assertNotEqual(ebcdic_message.find(icc_data), -1)
+        self.assertEqual(ebcdic_message[4:20], self.message_raw[4:20])
+
+    def test_bulk_no_binary_fields(self):
+        message_raw = TestCompileBitConfig.message_raw
+        self.assertEqual(
+            flip_message_encoding(message_raw, self.bit_config, 'ascii'),
+            flip_message_encoding(message_raw, self.bit_config, 'ascii',
+                                  validate=True))
+
+    def test_validate_bad_length(self):
+        bad_message = self.message_raw + b("^")
+        flip_message_encoding(bad_message, self.bit_config, 'ascii')
+        self.assertRaises(Exception, lambda: flip_message_encoding(
+            bad_message, self.bit_config, 'ascii', validate=True))
 
 
 class TestDe55unblock(TestCase):
@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import absolute_import
+import bz2
+import gzip
 import os.path
+import subprocess
 import sys
 import hexdump
 
 from unittest import TestCase
 
+import mciutil
 from mciutil.mciutil import block, vbs_pack, _convert_text_asc2eb, b
+from mciutil.index import open_indexed
 from mciutil.cli.mideu import _get_cli_parser, _main
-from mciutil.cli.common import get_config_filename, filter_dictionary
+from mciutil.cli import common
+from mciutil.cli.common import (
+    get_config_filename, filter_dictionary, get_row_values,
+)
 
 TEST_ASCII_IPM_FILENAME = "build/test/test_ascii_ipm"
 TEST_EBCDIC_IPM_FILENAME = "build/test/test_ebcdic_ipm"
@@ -49,6 +57,22 @@ class MideuCommonTestCase(CommandLineTestCase):
         """
         _main(None)
 
+    def test_subcommands_imported_when_run(self):
+        """
+        the cli module should not import the subcommand modules, yaml,
+        pkg_resources or modules only used by some subcommands
+        """
+        modules = ["mciutil.cli.extract", "mciutil.cli.convert",
+                   "mciutil.index", "mciutil.generator",
+                   "yaml", "pkg_resources", "pickle", "hashlib", "tempfile"]
+        output = subprocess.check_output([
+            sys.executable, "-c",
+            "import sys, mciutil.cli.mideu; "
+            "print([name for name in {0!r} if name in sys.modules])".format(
+                modules)
+        ])
+        self.assertEqual(output.decode("ascii").splitlines()[-1], "[]")
+
 
 class MideuExtractTestCase(CommandLineTestCase):
 
@@ -116,6 +140,71 @@ class MideuExtractTestCase(CommandLineTestCase):
         for line in range(start_line, start_line+5):
             self.assertEqual(csv_file_lines[line], DETAIL_LINE)
 
+    def test_with_workers(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        csv_filename = input_filename + ".workers.csv"
+        records_per_chunk = common.RECORDS_PER_CHUNK
+        common.RECORDS_PER_CHUNK = 2
+        try:
+            args = self.parser.parse_args(
+                ["extract", "-s", "ascii", "--workers", "2",
+                 "--csvoutputfile", csv_filename, input_filename])
+            _main(args)
+        finally:
+            common.RECORDS_PER_CHUNK = records_per_chunk
+        with open(csv_filename, 'r') as csv_file:
+            csv_file_lines = csv_file.readlines()
+
+        self.assertEqual(len(csv_file_lines), 6)
+        self.assertEqual(csv_file_lines[0], HEADER_LINE)
+        for line in range(1, 6):
+            self.assertEqual(csv_file_lines[line], DETAIL_LINE)
+
+    def test_with_compressed_file(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        with open(input_filename, "rb") as input_file:
+            with gzip.open(input_filename + ".gz", "wb") as output_file:
+                output_file.write(input_file.read())
+
+        for workers in ("1", "2"):
+            args = self.parser.parse_args(
+                ["extract", "-s", "ascii", "--workers", workers,
+                 input_filename + ".gz"])
+            _main(args)
+            with open(input_filename + ".gz.csv", 'r') as csv_file:
+                csv_file_lines = csv_file.readlines()
+            self.assertEqual(csv_file_lines, [HEADER_LINE] + [DETAIL_LINE] * 5)
+
+    def test_with_several_files(self):
+        batch_filenames = create_test_ascii_ipm_batch_files(3)
+
+        for jobs in ("1", "2"):
+            _main(self.parser.parse_args(
+                ["extract", "-s", "ascii", "--jobs", jobs,
+                 TEST_ASCII_IPM_FILENAME + ".batch?"]))
+            for batch_filename in batch_filenames:
+                with open(batch_filename + ".csv", 'r') as csv_file:
+                    self.assertEqual(csv_file.readlines(),
+                                     [HEADER_LINE] + [DETAIL_LINE] * 5)
+                os.remove(batch_filename + ".csv")
+
+    def test_with_merge(self):
+        batch_filenames = create_test_ascii_ipm_batch_files(2)
+        csv_filename = TEST_ASCII_IPM_FILENAME + ".merged.csv"
+        self.assertRaises(SystemExit, lambda: _main(self.parser.parse_args(
+            ["extract", "-s", "ascii", "--csvoutputfile", csv_filename] +
+            batch_filenames)))
+
+        for jobs in ("1", "2"):
+            _main(self.parser.parse_args(
+                ["extract", "-s", "ascii", "--jobs", jobs, "--merge",
+                 "--csvoutputfile", csv_filename] + batch_filenames))
+            with open(csv_filename, 'r') as csv_file:
+                csv_file_lines = csv_file.readlines()
+            self.assertEqual(csv_file_lines, ["SOURCE_FILE," + HEADER_LINE]
+                             + [batch_filenames[0] + "," + DETAIL_LINE] * 5
+                             + [batch_filenames[1] + "," + DETAIL_LINE] * 5)
+
     def test_with_ascii_de55_values(self):
         args = self.parser.parse_args(["extract", "-s", "ascii",
                                        "build/test/test_ascii_de55_ipm.in"])
@@ -127,6 +216,99 @@ class MideuExtractTestCase(CommandLineTestCase):
         self.assertRaises(Exception, lambda: _main(args))
 
 
+class MideuIndexTestCase(CommandLineTestCase):
+    def test_index(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        args = self.parser.parse_args(["index", input_filename])
+        _main(args)
+        with open_indexed(input_filename) as indexed_file:
+            self.assertEqual(len(indexed_file), 5)
+
+    def test_index_vbs(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "vbs"])
+        index_filename = input_filename + ".index"
+        args = self.parser.parse_args(
+            ["index", "--no1014blocking", "--indexfile", index_filename,
+             input_filename])
+        _main(args)
+        with open_indexed(input_filename, index_filename) as indexed_file:
+            self.assertEqual(len(indexed_file), 5)
+            self.assertFalse(indexed_file.blocked)
+
+    def test_lookup(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        _main(self.parser.parse_args(
+            ["index", "-s", "ascii", "--field", "DE31", input_filename]))
+        process = subprocess.Popen(
+            [sys.executable, "-m", "mciutil.cli.mideu", "lookup",
+             "--field", "DE31",
+             "57995799120000001230612", input_filename],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        csv_data, status_data = process.communicate()
+        self.assertEqual(process.returncode, 0)
+        csv_lines = csv_data.splitlines()
+        self.assertEqual(csv_lines[0], "RECORD," + HEADER_LINE.rstrip())
+        self.assertEqual(
+            csv_lines[1:],
+            ["{0},{1}".format(x, DETAIL_LINE.rstrip()) for x in range(5)])
+        self.assertIn("Found 5 records", status_data)
+
+    def test_lookup_no_value(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        _main(self.parser.parse_args(
+            ["index", "-s", "ascii", "--field", "DE31", input_filename]))
+        process = subprocess.Popen(
+            [sys.executable, "-m", "mciutil.cli.mideu", "lookup",
+             "--field", "DE31",
+             "57995799120000001230613", input_filename],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        csv_data, status_data = process.communicate()
+        self.assertEqual(csv_data.splitlines(),
+                         ["RECORD," + HEADER_LINE.rstrip()])
+        self.assertIn("Found 0 records", status_data)
+
+    def test_lookup_format_args(self):
+        for option in ("--no1014blocking", "-s"):
+            self.assertRaises(SystemExit, lambda: self.parser.parse_args(
+                ["lookup", option, "--field", "DE31", "1234", "file"]))
+
+    def test_lookup_without_index(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        args = self.parser.parse_args(
+            ["lookup", "--field", "DE94", "1234", input_filename])
+        self.assertRaises(SystemExit, lambda: _main(args))
+
+
+class MideuGenerateTestCase(CommandLineTestCase):
+    def test_generate(self):
+        output_filename = "build/test/test_generated_ipm"
+        _main(self.parser.parse_args(
+            ["generate", "-n", "100", "--seed", "42", "--date", "2017-03-15",
+             output_filename]))
+        _main(self.parser.parse_args(["extract", output_filename]))
+        with open(output_filename + ".csv") as csv_file:
+            self.assertEqual(len(csv_file.readlines()), 103)
+
+    def test_generate_vbs_ascii(self):
+        output_filename = "build/test/test_generated_ipm.vbs"
+        _main(self.parser.parse_args(
+            ["generate", "-n", "100", "-e", "ascii", "--no1014blocking",
+             output_filename]))
+        _main(self.parser.parse_args(
+            ["convert", "-s", "ascii", "--no1014blocking", output_filename]))
+        with open(output_filename + ".out", "rb") as output_file:
+            records = list(mciutil.iter_records(output_file, blocked=False))
+        self.assertEqual(len(records), 102)
+
+    def test_generate_bad_date(self):
+        args = self.parser.parse_args(
+            ["generate", "--date", "15/03/2017",
+             "build/test/test_generated_ipm"])
+        self.assertRaises(SystemExit, lambda: _main(args))
+
+
 class CsvOutputTest(TestCase):
     def test_output_byte_field(self):
         field = b"this is some text"
@@ -154,6 +336,15 @@ class FilteredDictionaryTest(TestCase):
         self.assertEqual(len(actual_dict), 2)
         self.assertEqual(actual_dict, expected_dict)
 
+    def test_filter_dict_missing_field(self):
+        dict = {"a": b("123"), "b": b("456")}
+        self.assertEqual(filter_dictionary(dict, ["c", "a"]), {"a": b("123")})
+
+    def test_get_row_values(self):
+        dict = {"a": b("123"), "b": b("456"), "c": b("789")}
+        self.assertEqual(
+            get_row_values(dict, ("c", "d", "a")), (b("789"), "", b("123")))
+
 
 class GetConfigFilenameTest(TestCase):
     def test_module_default(self):
@@ -174,6 +365,109 @@ class MideuConvertTestCases(CommandLineTestCase):
     def test_with_ascii_file_vbs(self):
         self.run_file_both_directions("vbs", "--no1014blocking")
 
+    def test_with_workers(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        _main(self.parser.parse_args(
+            ["convert", "-s", "ascii", input_filename]))
+        with open(input_filename + ".out", "rb") as serial_file:
+            serial_data = serial_file.read()
+
+        records_per_chunk = common.RECORDS_PER_CHUNK
+        common.RECORDS_PER_CHUNK = 2
+        try:
+            _main(self.parser.parse_args(
+                ["convert", "-s", "ascii", "--workers", "2", input_filename]))
+        finally:
+            common.RECORDS_PER_CHUNK = records_per_chunk
+        with open(input_filename + ".out", "rb") as parallel_file:
+            self.assertEqual(parallel_file.read(), serial_data)
+
+    def test_with_compressed_file(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "vbs"])
+        with open(input_filename, "rb") as input_file:
+            ascii_data = input_file.read()
+        with bz2.BZ2File(input_filename + ".bz2", "wb") as output_file:
+            output_file.write(ascii_data)
+
+        _main(self.parser.parse_args(
+            ["convert", "-s", "ascii", "--no1014blocking",
+             input_filename + ".bz2"]))
+        _main(self.parser.parse_args(["convert", "--no1014blocking",
+                                      input_filename + ".out.bz2"]))
+
+        with bz2.BZ2File(input_filename + ".out.out.bz2", "rb") as ascii2_file:
+            self.assertEqual(ascii2_file.read(), ascii_data)
+
+    def test_with_output_filename(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        output_filename = input_filename + ".ebcdic"
+        _main(self.parser.parse_args(
+            ["convert", "-s", "ascii", "-o", output_filename, input_filename]))
+        _main(self.parser.parse_args(
+            ["convert", "-s", "ascii", input_filename]))
+        with open(output_filename, "rb") as output_file:
+            with open(input_filename + ".out", "rb") as default_file:
+                self.assertEqual(output_file.read(), default_file.read())
+
+    def test_with_input_as_output(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        with open(input_filename, "rb") as input_file:
+            ascii_data = input_file.read()
+        for workers in ("1", "2"):
+            args = self.parser.parse_args(
+                ["convert", "-s", "ascii", "--workers", workers,
+                 "-o", input_filename, input_filename])
+            self.assertRaises(SystemExit, lambda: _main(args))
+            with open(input_filename, "rb") as input_file:
+                self.assertEqual(input_file.read(), ascii_data)
+
+    def test_with_unwritable_output(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        args = self.parser.parse_args(
+            ["convert", "-s", "ascii", "-o", "build/test/missing/out",
+             input_filename])
+        with self.assertRaises(IOError) as context:
+            _main(args)
+        # the open error is raised, not an error from removing the output
+        self.assertIsNone(getattr(context.exception, "__context__", None))
+
+    def test_with_stdin_and_stdout(self):
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        with open(input_filename, "rb") as input_file:
+            ascii_data = input_file.read()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "mciutil.cli.mideu", "convert",
+             "-s", "ascii", "-o", "-", "-"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        ebcdic_data, status_data = process.communicate(ascii_data)
+        self.assertEqual(process.returncode, 0)
+        with open(input_filename + ".out", "wb") as output_file:
+            output_file.write(ebcdic_data)
+        _main(self.parser.parse_args(["convert", input_filename + ".out"]))
+        with open(input_filename + ".out.out", "rb") as ascii2_file:
+            self.assertEqual(ascii2_file.read(), ascii_data)
+
+    def test_with_several_files(self):
+        batch_filenames = create_test_ascii_ipm_batch_files(2)
+        self.assertRaises(SystemExit, lambda: _main(self.parser.parse_args(
+            ["convert", "-s", "ascii", "-o", "out"] + batch_filenames)))
+
+        input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+        _main(self.parser.parse_args(
+            ["convert", "-s", "ascii", input_filename]))
+        with open(input_filename + ".out", "rb") as output_file:
+            ebcdic_data = output_file.read()
+
+        for jobs in ("1", "2"):
+            _main(self.parser.parse_args(
+                ["convert", "-s", "ascii", "--jobs", jobs,
+                 TEST_ASCII_IPM_FILENAME + ".batch?"]))
+            for batch_filename in batch_filenames:
+                with open(batch_filename + ".out", "rb") as output_file:
+                    self.assertEqual(output_file.read(), ebcdic_data)
+                os.remove(batch_filename + ".out")
+
     def run_file_both_directions(self, file_postfix, option):
         print("************ ASCII IN ****************")
         with open(".".join([TEST_ASCII_IPM_FILENAME, file_postfix]), "rb") as ascii_file:
@@ -199,6 +493,26 @@ class MideuConvertTestCases(CommandLineTestCase):
         self.assertEqual(ascii2_data, ascii_data)
 
 
+def create_test_ascii_ipm_batch_files(file_count):
+    """
+    Copies the ascii 1014 blocked test file to files for batch tests
+
+    :param file_count: number of files to create
+    :return: list of the file names
+    """
+    input_filename = ".".join([TEST_ASCII_IPM_FILENAME, "1014block"])
+    with open(input_filename, "rb") as input_file:
+        ascii_data = input_file.read()
+    batch_filenames = [
+        ".".join([TEST_ASCII_IPM_FILENAME, "batch{0}".format(x)])
+        for x in range(file_count)
+    ]
+    for batch_filename in batch_filenames:
+        with open(batch_filename, "wb") as batch_file:
+            batch_file.write(ascii_data)
+    return batch_filenames
+
+
 def create_test_ebcdic_ipm_file():
     message_raw = _convert_text_asc2eb(b("1144")) + \
         b("\xF0\x10\x05\x42\x84\x61\x80\x02\x02\x00\x00\x04"
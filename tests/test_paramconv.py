@@ -1,5 +1,8 @@
 from __future__ import absolute_import
+import gzip
 import os
+import subprocess
+import sys
 from unittest import TestCase
 from mciutil import b, block
 from mciutil.cli.paramconv import _get_cli_parser, _main
@@ -49,6 +52,48 @@ class ParamConvTestCase(CommandLineTestCase):
 
         self.assertEqual(output_data, create_test_mpe_parameter_extract())
 
+    def test_with_compressed_file(self):
+        gzip_filename = TEST_ASCII_MPE_PARAM_FILENAME + ".gz"
+        with gzip.open(gzip_filename, "wb") as gzip_file:
+            gzip_file.write(create_test_mpe_parameter_extract())
+        # convert to ebcdic, output is compressed the same way
+        args = self.parser.parse_args(["-s", "ascii", gzip_filename])
+        _main(args)
+        # convert back to ascii
+        args = self.parser.parse_args(
+            [TEST_ASCII_MPE_PARAM_FILENAME + ".out.gz",
+             "-o", TEST_ASCII_MPE_PARAM_FILENAME + ".out.out"])
+        _main(args)
+
+        with open(TEST_ASCII_MPE_PARAM_FILENAME + ".out.out", 'rb') as outfile:
+            output_data = outfile.read()
+
+        self.assertEqual(output_data, create_test_mpe_parameter_extract())
+
+    def test_status_lines(self):
+        process = subprocess.Popen(
+            [sys.executable, "-m", "mciutil.cli.paramconv", "-s", "ascii",
+             TEST_ASCII_MPE_PARAM_FILENAME],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        status_data = process.communicate()[0]
+        self.assertEqual(process.returncode, 0)
+        file_size = len(create_test_mpe_parameter_extract())
+        self.assertIn("{0} bytes read from {1}\n".format(
+            file_size, TEST_ASCII_MPE_PARAM_FILENAME), status_data)
+        self.assertIn("{0} bytes written to {1}.out\n".format(
+            file_size, TEST_ASCII_MPE_PARAM_FILENAME), status_data)
+        self.assertIn("5 records\n", status_data)
+
+    def test_with_input_as_output(self):
+        args = self.parser.parse_args(
+            ["-s", "ascii", TEST_ASCII_MPE_PARAM_FILENAME,
+             "-o", TEST_ASCII_MPE_PARAM_FILENAME])
+        self.assertRaises(SystemExit, lambda: _main(args))
+        with open(TEST_ASCII_MPE_PARAM_FILENAME, 'rb') as infile:
+            self.assertEqual(infile.read(),
+                             create_test_mpe_parameter_extract())
+
 
 def create_test_mpe_parameter_extract():
     """